@@ -0,0 +1,65 @@
+import numpy as np
+import optima
+
+# Compares the damping strategies of optima.LevenbergMarquardtBroyden on the synthetic problems of nonlinearTest.py:
+# the fixed schedule l = 1/(iteration + 1 - n)**2 against gain-ratio adaptive damping with step rejection.
+# Reports success rate, functional evaluations used by successful runs, and evaluations used on the problems that
+# every strategy solves (the fair comparison of cost, as the strategies don't fail on the same problems).
+
+# Testing parameters
+nTests = 50
+nVal = 100
+nTotalParams = 2
+xrange = 1
+paramRange = [0,4]
+
+# Optima parameters
+tol = 1e-6
+maxIts = 40
+
+# Same "black-box" function as nonlinearTest.py
+def blackBox(testValues, parameters):
+    output = 0
+    for j in range(len(parameters)):
+        output += testValues[j]**parameters[j]
+    return output
+
+# Counts functional evaluations
+class CountingEvaluator:
+    def __init__(self, values):
+        self.values = values
+        self.evaluations = 0
+    def __call__(self, tags, beta):
+        self.evaluations += 1
+        return np.array([blackBox(v, beta) for v in self.values])
+
+rng = np.random.default_rng(0)
+problems = []
+for ti in range(nTests):
+    trueParams = rng.uniform(paramRange[0], paramRange[1], size = nTotalParams)
+    values = rng.uniform(0, xrange, size = [nVal, nTotalParams])
+    start = rng.uniform(paramRange[0], paramRange[1], size = [nTotalParams, 2])
+    problems.append((trueParams, values, start))
+
+# Evaluations of each damping strategy by problem, None where it didn't converge
+results = dict([])
+for damping in ['schedule', 'adaptive']:
+    results[damping] = []
+    for trueParams, values, start in problems:
+        evaluator = CountingEvaluator(values)
+        y = evaluator([], trueParams)
+        evaluator.evaluations = 0
+        tags = dict([(f'p{p}', list(start[p])) for p in range(nTotalParams)])
+        norm, iterations, beta = optima.LevenbergMarquardtBroyden(y, tags, evaluator, maxIts, tol,
+                                                                  observers = [], damping = damping)
+        results[damping].append(evaluator.evaluations if norm < tol else None)
+common = [i for i in range(nTests) if all([results[damping][i] is not None for damping in results])]
+
+print(f'{"damping":>10} {"passed":>8} {"mean evaluations":>18} {"median evaluations":>20} {"mean on common":>16}')
+for damping, counts in results.items():
+    evaluations = [count for count in counts if count is not None]
+    mean = np.mean(evaluations) if evaluations else np.nan
+    median = np.median(evaluations) if evaluations else np.nan
+    commonMean = np.mean([counts[i] for i in common]) if common else np.nan
+    print(f'{damping:>10} {len(evaluations):>4}/{nTests:<3} {mean:18.1f} {median:20.1f} {commonMean:16.1f}')
+print(f'{len(common)} problems solved by every strategy')
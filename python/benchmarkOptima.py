@@ -0,0 +1,130 @@
+import numpy as np
+import time
+import optima
+
+# Microbenchmark for the Broyden/Levenberg-Marquardt kernels in optima.
+# The loop versions below are the original pure-Python implementations, kept as reference.
+
+def loopFunctionalNorm(residual):
+    norm = 0
+    for i in range(len(residual)):
+        norm += residual[i]**2
+    return norm
+
+def loopBroydenUpdate(broydenMatrix,dependent,objective):
+    m = len(dependent)
+    n = len(objective)
+    update = np.zeros(m)
+    for j in range(n):
+        for i in range(m):
+            update[i] += broydenMatrix[i][j] * objective[j]
+    sMag = 0
+    for j in range(n):
+        sMag += objective[j]**2
+    for i in range(m):
+        update[i] = (dependent[i] - update[i]) / sMag
+    for j in range(n):
+        for i in range(m):
+            broydenMatrix[i][j] = broydenMatrix[i][j] + update[i] * objective[j]
+
+def loopDirectionVector(residual, broydenMatrix, coefficient, l, steplength, weight):
+    m = len(residual)
+    n = len(coefficient)
+    a = np.zeros([n,n])
+    b = np.zeros(n)
+    for j in range(n):
+        for i in range(j,n):
+            for k in range(m):
+                a[i][j] += broydenMatrix[k][i] * broydenMatrix[k][j] * weight[k]
+                if abs(a[i][j]) > 1e20:
+                    steplength = 1e-6
+            a[j][i] = a[i][j]
+    for j in range(n):
+        for i in range(m):
+            b[j] = b[j] + broydenMatrix[i][j] * residual[i]
+            if abs(b[j]) > 1e20:
+                steplength = 1e-6
+        a[j][j] = a[j][j] + l
+    [x, residuals, rank, singular] = np.linalg.lstsq(a,b,rcond=None)
+    betaNew = np.zeros(n)
+    for j in range(n):
+        betaNew[j] = coefficient[j] + steplength * x[j]
+    return betaNew
+
+def timeCall(function, *args, repeats = 3):
+    best = np.Inf
+    for _ in range(repeats):
+        st = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - st)
+    return best
+
+rng = np.random.default_rng(0)
+rtol = 1e-10
+
+print(f'{"m":>7} {"n":>4} {"kernel":>16} {"loop [s]":>12} {"numpy [s]":>12} {"speedup":>9}')
+for m in [100, 1000, 10000]:
+    for n in [4, 16, 32]:
+        broydenMatrix = rng.normal(size = [m,n])
+        residual = rng.normal(size = m)
+        weight = rng.uniform(0.5, 2, size = m)
+        objective = rng.normal(size = n)
+        coefficient = rng.normal(size = n)
+
+        # Check equivalence before timing
+        loopMatrix = broydenMatrix.copy()
+        vectorMatrix = broydenMatrix.copy()
+        loopBroydenUpdate(loopMatrix, residual, objective)
+        optima.broydenUpdate(vectorMatrix, residual, objective)
+        assert np.allclose(loopMatrix, vectorMatrix, rtol = rtol, atol = 0)
+        assert np.allclose(loopDirectionVector(residual, broydenMatrix, coefficient, 0.5, 1, weight),
+                           optima.directionVector(residual, broydenMatrix, coefficient, 0.5, 1, weight),
+                           rtol = 1e-8)
+        assert np.isclose(loopFunctionalNorm(residual), optima.functionalNorm(residual), rtol = rtol)
+
+        kernels = [
+            ('broydenUpdate',   loopBroydenUpdate,   optima.broydenUpdate,   (broydenMatrix.copy(), residual, objective)),
+            ('directionVector', loopDirectionVector, optima.directionVector, (residual, broydenMatrix, coefficient, 0.5, 1, weight)),
+            ('functionalNorm',  loopFunctionalNorm,  optima.functionalNorm,  (residual,))
+        ]
+        for name, loopKernel, vectorKernel, args in kernels:
+            # The quadratic loop kernels get slow quickly, so only repeat them once at large sizes
+            loopTime = timeCall(loopKernel, *args, repeats = 1 if m * n > 1e5 else 3)
+            vectorTime = timeCall(vectorKernel, *args)
+            print(f'{m:7d} {n:4d} {name:>16} {loopTime:12.3e} {vectorTime:12.3e} {loopTime/vectorTime:9.1f}')
+
+# Full LMB linear-algebra step: rank-one update followed by a solve
+# Rebuilding the normal equations each time vs. carrying them in optima.BroydenMatrix
+def rebuiltStep(broydenMatrix, dependent, objective, residual, coefficient, weight):
+    optima.broydenUpdate(broydenMatrix, dependent, objective)
+    return optima.directionVector(residual, broydenMatrix, coefficient, 0.5, 1, weight)
+
+def incrementalStep(broydenMatrix, dependent, objective, residual, coefficient):
+    broydenMatrix.update(dependent, objective)
+    return broydenMatrix.direction(residual, coefficient, 0.5, 1)
+
+print()
+print(f'{"m":>7} {"n":>4} {"rebuilt [s]":>12} {"incremental [s]":>16} {"speedup":>9}')
+nSteps = 20
+for m in [1000, 10000, 100000]:
+    for n in [4, 16, 32]:
+        matrix = rng.normal(size = [m,n])
+        weight = rng.uniform(0.5, 2, size = m)
+        steps = [(rng.normal(size = m), rng.normal(size = n)) for _ in range(nSteps)]
+        residual = rng.normal(size = m)
+        coefficient = rng.normal(size = n)
+
+        rebuiltMatrix = matrix.copy()
+        st = time.perf_counter()
+        for dependent, objective in steps:
+            rebuiltBeta = rebuiltStep(rebuiltMatrix, dependent, objective, residual, coefficient, weight)
+        rebuiltTime = (time.perf_counter() - st) / nSteps
+
+        incrementalMatrix = optima.BroydenMatrix(matrix, weight)
+        st = time.perf_counter()
+        for dependent, objective in steps:
+            incrementalBeta = incrementalStep(incrementalMatrix, dependent, objective, residual, coefficient)
+        incrementalTime = (time.perf_counter() - st) / nSteps
+
+        assert np.allclose(rebuiltBeta, incrementalBeta, rtol = 1e-6)
+        print(f'{m:7d} {n:4d} {rebuiltTime:12.3e} {incrementalTime:16.3e} {rebuiltTime/incrementalTime:9.1f}')
@@ -0,0 +1,65 @@
+import numpy as np
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import thermoValidation
+
+# Compares running a calculation list in the order states were entered against thermoValidation.calculationOrder,
+# on random states of a kayetest.dat style system (Pd-Ru-Tc-Mo).
+# Always reports the scaled path length through state space. If RunCalculationList is found (in thermochimica, or
+# the path given as the first argument), it also reports total Thermochimica time for both orders.
+
+database = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'kayetest.dat'))
+elements = ['Pd', 'Ru', 'Tc', 'Mo']
+thermochimica_path = sys.argv[1] if len(sys.argv) > 1 else 'thermochimica'
+runCalculationList = os.path.join(thermochimica_path, 'bin', 'RunCalculationList')
+
+def randomStates(nStates, rng):
+    temperatures = rng.uniform(800, 2500, size = nStates)
+    amounts = rng.dirichlet(np.ones(len(elements)), size = nStates)
+    return [[t, 1.0] + list(a) for t, a in zip(temperatures, amounts)]
+
+def inputText(states):
+    lines = ['! Optima-generated input file for validation points',
+             f'data file         = {database}',
+             'temperature unit  = K',
+             'pressure unit     = atm',
+             'mass unit         = moles',
+             f'nEl               = {len(elements)} ',
+             f'iEl               = {" ".join([str(thermoValidation.atomic_number_map.index(element)+1) for element in elements])}',
+             f'nCalc             = {len(states)}']
+    lines.extend([' '.join([str(value) for value in state]) for state in states])
+    return '\n'.join(lines) + '\n'
+
+def timeList(states, directory, repeats = 3):
+    inputFile = os.path.join(directory, 'benchmarkOrdering.ti')
+    with open(inputFile, 'w') as f:
+        f.write(inputText(states))
+    best = np.Inf
+    for _ in range(repeats):
+        st = time.perf_counter()
+        subprocess.run([runCalculationList, inputFile], stdout = subprocess.DEVNULL, cwd = thermochimica_path)
+        best = min(best, time.perf_counter() - st)
+    return best
+
+rng = np.random.default_rng(0)
+runs = os.path.isfile(runCalculationList)
+if not runs:
+    print(f'{runCalculationList} not found, only comparing path lengths')
+header = f'{"states":>7} {"path (entered)":>15} {"path (ordered)":>15}'
+if runs:
+    header += f' {"time (entered) [s]":>19} {"time (ordered) [s]":>19} {"speedup":>8}'
+print(header)
+with tempfile.TemporaryDirectory() as directory:
+    for nStates in [50, 200, 1000]:
+        states = randomStates(nStates, rng)
+        order = thermoValidation.calculationOrder(states)
+        line = (f'{nStates:7d} {thermoValidation.pathLength(states, np.arange(nStates)):15.1f}'
+                f' {thermoValidation.pathLength(states, order):15.1f}')
+        if runs:
+            enteredTime = timeList(states, directory)
+            orderedTime = timeList([states[i] for i in order], directory)
+            line += f' {enteredTime:19.3f} {orderedTime:19.3f} {enteredTime/orderedTime:8.2f}'
+        print(line)
@@ -0,0 +1,63 @@
+import numpy as np
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import optimaTemplate
+
+# Compares filling a tagged database with one sed process per tag (the original updateDat)
+# against rendering a compiled optimaTemplate.DatabaseTemplate with a single write.
+
+def sedFill(templateFile, outputFile, values):
+    shutil.copy(templateFile, outputFile)
+    for tag, value in values.items():
+        subprocess.call(['sed', '-i', '-e',  f's/<{tag}>/{value}/g', outputFile])
+
+def templateFill(templateFile, outputFile, values):
+    optimaTemplate.load(templateFile).write(outputFile, values)
+
+# Synthetic database: lines of coefficients, some of which are tags
+def syntheticDatabase(nLines, tags, rng):
+    lines = []
+    for i in range(nLines):
+        coefficients = [f'{value:.8E}' for value in rng.normal(size = 4)]
+        if i % 50 == 0:
+            coefficients[rng.integers(4)] = f'<{tags[(i // 50) % len(tags)]}>'
+        lines.append('  ' + '   '.join(coefficients))
+    return '\n'.join(lines) + '\n'
+
+def timeFill(fill, templateFile, outputFile, values, repeats = 5):
+    best = np.Inf
+    for _ in range(repeats):
+        st = time.perf_counter()
+        fill(templateFile, outputFile, values)
+        best = min(best, time.perf_counter() - st)
+    return best
+
+rng = np.random.default_rng(0)
+print(f'{"size [kB]":>10} {"tags":>5} {"sed [s]":>12} {"template [s]":>13} {"speedup":>9}')
+with tempfile.TemporaryDirectory() as directory:
+    templateFile = os.path.join(directory, 'template.dat')
+    sedFile = os.path.join(directory, 'sed.dat')
+    renderedFile = os.path.join(directory, 'rendered.dat')
+    for nLines in [1000, 10000]:
+        for nTags in [4, 16]:
+            tags = [f'tag{i}' for i in range(nTags)]
+            with open(templateFile, 'w') as f:
+                f.write(syntheticDatabase(nLines, tags, rng))
+            optimaTemplate.forget(templateFile)
+            values = dict([(tag, value) for tag, value in zip(tags, rng.normal(size = nTags) * 1e4)])
+
+            # Check that both produce the same database before timing
+            sedFill(templateFile, sedFile, values)
+            templateFill(templateFile, renderedFile, values)
+            with open(sedFile, 'rb') as f:
+                sedBytes = f.read()
+            with open(renderedFile, 'rb') as f:
+                assert f.read() == sedBytes
+
+            sedTime = timeFill(sedFill, templateFile, sedFile, values)
+            templateTime = timeFill(templateFill, templateFile, renderedFile, values)
+            size = os.path.getsize(templateFile) / 1024
+            print(f'{size:10.0f} {nTags:5d} {sedTime:12.3e} {templateTime:13.3e} {sedTime/templateTime:9.1f}')
@@ -1,9 +1,9 @@
 import os
-import re
 import PySimpleGUI as sg
 import shutil
 import subprocess
 import dictTools
+import thermoDatabase
 
 timeout = 50
 inputSize = 16
@@ -23,15 +23,10 @@ class TagWindow:
     def __init__(self,datafile,windowList):
         self.windowList = windowList
         self.datafile = datafile
-        tags = []
-        with open(datafile) as f:
-            data = f.readlines()
-            for line in data:
-                tags.extend(re.findall('<([^>]*)>', line))
+        tags = list(thermoDatabase.load(datafile).tags)
         if tags == []:
             print('No tags found')
             self.close()
-        tags = list(dict.fromkeys(tags))
         self.tags = dict([(tags[i], dict([('initial',[0,0]),('optimize',True),('scale',1.0)])) for i in range(len(tags))])
         self.open()
         self.children = []
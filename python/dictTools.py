@@ -11,6 +11,18 @@ def getParallelDictValues(validation,measured,values):
         # it's a val!
         values.append(measured)
 
+# Method to build lists of keys leading to all values in a nested dict
+# Paths are in the same order getParallelDictValues returns values
+def getDictKeyPaths(dictionary,activePath,allPaths):
+    if type(dictionary) is dict:
+        # it's a dict!
+        for key in dictionary.keys():
+            # keep digging
+            getDictKeyPaths(dictionary[key],activePath + [key],allPaths)
+    else:
+        # end of keys
+        allPaths.append(activePath)
+
 # Method to build strings out of all keys in a nested dict
 def getDictKeyString(dictionary,activeString,allStrings):
     if type(dictionary) is dict:
@@ -1,7 +1,7 @@
 import optima
 import thermoOptima
-import math
 import dictTools
+import thermoDatabase
 
 class transitionFinder:
     def __init__(self, datafile,):
@@ -45,31 +45,8 @@ class transitionFinder:
         self.elements = []
         if self.datafile == '':
             return
-        # Get element names so that we can set up the calculation and windows
-        with open(self.datafile) as f:
-            f.readline() # read comment line
-            line = f.readline() # read first data line (# elements, # phases, n*# species)
-            nElements = int(line[1:5])
-            nSoln = int(line[6:10])
-            while True:
-                line = f.readline() # read the rest of the # species but don't need them)
-                if any(c.isalpha() for c in line):
-                    break
-            elLen = 25 # element names are formatted 25 wide
-            els = line # get the first line with letters in it
-            for i in range(math.ceil(nElements/3)):
-                for j in range(3):
-                    self.elements.append(els[1+j*elLen:(1+j)*elLen].strip())
-                els = f.readline() # read a line of elements (3 per line)
-                # It doesn't matter now, but this reads one more line than required
-        for el in self.elements:
-            try:
-                index = thermoOptima.atomic_number_map.index(el)+1 # get element indices in PT (i.e. # of protons)
-            except ValueError:
-                if len(el) > 0:
-                    if el[0] != 'e':
-                        print(el+' not in list') # if the name is bogus (or e(phase)), discard
-                self.elements = list(filter(lambda a: a != el, self.elements))
+        # Get element names so that we can set up the calculation
+        self.elements = list(thermoDatabase.load(self.datafile).elements)
     def updateInputFile(self, tags, beta):
         with open('validationPoints.ti', 'w') as inputFile:
             inputFile.write('! Optima-generated input file for validation points\n')
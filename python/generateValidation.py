@@ -1,7 +1,9 @@
 import json
 from random import random
 import thermoOptima
+import thermoValidation
 import subprocess
+import sys
 
 # Set units
 tunit = 'K'
@@ -38,7 +40,12 @@ with open('generatedPoints.ti', 'w') as inputFile:
         inputFile.write(f'{" ".join([str(states[s][i]) for i in range(len(elements)+2)])}\n')
 
 # Run it
-subprocess.run(['thermochimica/bin/RunCalculationList','generatedPoints.ti'])
+try:
+    subprocess.run(['thermochimica/bin/RunCalculationList','generatedPoints.ti'],
+                   timeout = thermoValidation.runLimits.runTimeout(nSample))
+except subprocess.TimeoutExpired:
+    print('RunCalculationList did not finish in time')
+    sys.exit(1)
 
 # Load results and create validation file
 jsonFile = open('thermochimica/thermoout.json',)
@@ -1,5 +1,8 @@
 import numpy as np
 import copy
+import time
+import optimaCheckpoint
+import optimaEvents
 
 # Levenberg-Marquardt non-linear optimizer using Broyden approximation for Jacobian.
 # Make this class general. Avoid to the greatest extent possible including any application-specific code.
@@ -9,477 +12,1190 @@ import copy
 # functional is a function that returns an array of values corresponding to the validationPoints
 # maxIts and tol are convergence parameters
 def LevenbergMarquardtBroyden(y,tags,functional,maxIts,tol,weight = [], scale = [], **extraParams):
-    # get problem dimensions
-    m = len(y)
-    n = len(tags)
+    return runOptimizer(LevenbergMarquardtBroydenOptimizer(y,tags,maxIts,tol,weight = weight, scale = scale, **extraParams), functional)
 
-    if not len(weight) == m:
-        weight = np.ones(m)
+# Ask/tell interface
+# The optimizer classes hold the state of a run and leave evaluating the functional to the caller:
+#   ask() returns a list of beta vectors to evaluate with functional(optimizer.tags, beta) that have not been handed out yet.
+#         The list is empty once the optimizer is done, or while it is waiting for results that are still outstanding.
+#   tell(beta, f) hands back the functional values f for a beta from ask(), or an OptimaException if the evaluation failed.
+#   done is set once the run is over, and result then holds what the function version of the method returns.
+# Results may be told in any order, so evaluations can be overlapped, distributed, or driven from an event loop.
+# The function versions of the methods construct an optimizer and pass it to runOptimizer with their functional.
 
-    if not len(scale) == n:
-        scale = np.ones(n)
+# Drives optimizer to completion, evaluating each set of points from ask() concurrently on optimizer.processes workers
+def runOptimizer(optimizer, functional):
+    import optimaParallel
 
-    # check that we have enough data to go ahead
-    if n == 0:
-        print('No tags with unknown values')
-        return
-    if m == 0:
-        print('No validation points')
-        return
+    while not optimizer.done:
+        betas = optimizer.ask()
+        if len(betas) == 0:
+            # Only possible with results outstanding, which never happens here
+            break
+        results = optimaParallel.evaluateConcurrently(functional, optimizer.tags, betas, optimizer.processes)
+        for beta, result in zip(betas, results):
+            if isinstance(result, Exception) and not isinstance(result, OptimaException):
+                raise result
+            optimizer.tell(beta, result)
+    return optimizer.result
 
-    # Get bounds if provided
-    bounds = [[-np.Inf,np.Inf] for _ in range(n)]
-    for param, value in extraParams.items():
-        if param == 'bounds':
-            if len(value) == n:
-                bounds = value
+# Ask/tell version of LevenbergMarquardtBroyden.
+# One point is asked for per iteration, apart from finite-difference seeding, which asks for all seed points at once.
+class LevenbergMarquardtBroydenOptimizer:
+    method = 'LevenbergMarquardtBroyden'
+    def __init__(self,y,tags,maxIts,tol,weight = [], scale = [], **extraParams):
+        self.y = np.asarray(y, dtype = float)
+        self.tags = tags
+        self.maxIts = maxIts
+        self.tol = tol
+        self.done = False
+        self.result = None
+        # get problem dimensions
+        m = len(self.y)
+        n = len(tags)
+        self.n = n
 
-    # initialize Broyden matrix as 1s
-    broydenMatrix = np.ones([m,n])
+        if not len(weight) == m:
+            weight = np.ones(m)
 
-    # beta is array of coefficients, start with initial value 0
-    betaInit0 = np.array([float(tags[tag][0]) for tag in tags]) / scale
-    betaInit1 = np.array([float(tags[tag][1]) for tag in tags]) / scale
+        if not len(scale) == n:
+            scale = np.ones(n)
+        self.scale = scale
 
-    bestNorm = np.Inf
-    bestBeta = np.zeros(n)
+        self.observers = optimaEvents.getObservers(extraParams)
+        self.processes = 0
+
+        # check that we have enough data to go ahead
+        if n == 0:
+            optimaEvents.notify(self.observers, 'message', text = 'No tags with unknown values')
+            self.done = True
+            return
+        if m == 0:
+            optimaEvents.notify(self.observers, 'message', text = 'No validation points')
+            self.done = True
+            return
+
+        # Get bounds and Jacobian initialization mode if provided
+        # jacobian = 'broyden' seeds the Broyden matrix one coefficient per iteration (default)
+        # jacobian = 'forward' or 'central' evaluates all finite-difference seed points concurrently on processes workers
+        # cancel(iterations, bestNorm) may be given to stop the run early, returning the best result so far
+        # checkpoint names a file that solver state is saved to every checkpointInterval iterations
+        # resume = True continues from that file if it exists
+        # damping = 'schedule' uses the fixed damping l = 1/(iteration + 1 - n)**2 and accepts every step (default)
+        # damping = 'adaptive' adjusts l by the gain ratio of each step and rejects steps that increase the norm,
+        # starting from dampingInitial (default: 0.1 times the largest diagonal entry of B^T W B). It is an option for
+        # robustness rather than speed: it converges from more starting points (see benchmarkDamping.py), but each
+        # rejected step costs an evaluation, so problems the schedule solves take a few more evaluations
+        # minConverged and failurePenalty set how evaluations with failed (NaN) values are handled, see FailurePolicy
+        self.bounds = [[-np.Inf,np.Inf] for _ in range(n)]
+        jacobian = 'broyden'
+        self.cancel = None
+        self.checkpoint = None
+        self.checkpointInterval = 1
+        resume = False
+        self.adaptive = False
+        self.damping = None
+        self.failures = FailurePolicy()
+        for param, value in extraParams.items():
+            if param == 'bounds':
+                if len(value) == n:
+                    self.bounds = value
+            elif param == 'jacobian':
+                if value in ['broyden','forward','central']:
+                    jacobian = value
+                else:
+                    optimaEvents.notify(self.observers, 'message', text = f'Unknown Jacobian initialization {value}, using broyden')
+            elif param == 'processes':
+                self.processes = value
+            elif param == 'cancel':
+                self.cancel = value
+            elif param == 'checkpoint':
+                self.checkpoint = value
+            elif param == 'checkpointInterval':
+                self.checkpointInterval = max(int(value), 1)
+            elif param == 'resume':
+                resume = value
+            elif param == 'damping':
+                if value in ['schedule','adaptive']:
+                    self.adaptive = value == 'adaptive'
+                else:
+                    optimaEvents.notify(self.observers, 'message', text = f'Unknown damping {value}, using schedule')
+            elif param == 'dampingInitial':
+                self.damping = value
+            elif param == 'minConverged':
+                self.failures.minConverged = value
+            elif param == 'failurePenalty':
+                self.failures.penalty = value
+        self.jacobian = jacobian
+        # Growth factor for the damping after consecutive rejected steps
+        self.dampingFactor = 2
+
+        # initialize Broyden matrix as 1s
+        self.broydenMatrix = BroydenMatrix(np.ones([m,n]), weight)
+
+        # beta is array of coefficients, start with initial value 0
+        self.betaInit0 = np.array([float(tags[tag][0]) for tag in tags]) / scale
+        self.betaInit1 = np.array([float(tags[tag][1]) for tag in tags]) / scale
+
+        self.bestNorm = np.Inf
+        self.bestBeta = np.zeros(n)
+
+        # Point asked for (scaled), whether its result is outstanding, and whether it is a retry after a failure
+        self.pending = None
+        self.waiting = False
+        self.retried = False
+        # Finite-difference seed points and their results, while seeding
+        self.seedPoints = None
+        self.seedResults = None
+
+        self.iteration = 0
+        resumed = False
+        if resume and optimaCheckpoint.exists(self.checkpoint):
+            state = optimaCheckpoint.load(self.checkpoint)
+            if state['method'] != self.method or state['broydenMatrix'].shape != (m,n):
+                optimaEvents.notify(self.observers, 'message', text = f'Checkpoint {self.checkpoint} does not match this problem, starting over')
+            else:
+                self.iteration = state['iteration']
+                self.beta = state['beta']
+                self.r = state['r']
+                self.betaOld = state['betaOld']
+                self.rOld = state['rOld']
+                self.normOld = state['normOld']
+                if not np.isnan(state['damping']):
+                    self.damping = state['damping']
+                self.dampingFactor = state['dampingFactor']
+                self.bestNorm = state['bestNorm']
+                self.bestBeta = state['bestBeta']
+                self.broydenMatrix = BroydenMatrix(state['broydenMatrix'], weight)
+                resumed = True
+                optimaEvents.notify(self.observers, 'message', text = f'Resuming from {self.checkpoint} at iteration {self.iteration + 1}')
+        if jacobian != 'broyden' and not resumed:
+            self.seedPoints = finiteDifferencePoints(self.betaInit0, self.betaInit1, self.bounds, jacobian)
+            self.seedResults = [None for _ in self.seedPoints]
+        elif self.iteration >= maxIts:
+            self.finish(maxIts, 'maxIterations')
 
-    for iteration in range(maxIts):
+    # Report the end of the run and set results
+    def finish(self, iterations, reason):
+        optimaEvents.notify(self.observers, 'finished', method = self.method, iteration = iterations,
+                            beta = self.bestBeta * self.scale, norm = self.bestNorm, reason = reason)
+        self.result = (self.bestNorm, iterations, self.bestBeta * self.scale)
+        self.done = True
+
+    # Report convergence and set results
+    def converge(self, iterations, beta, norm):
+        optimaEvents.notify(self.observers, 'converged', method = self.method, iteration = iterations, beta = beta * self.scale, norm = norm)
+        self.result = (self.bestNorm, iterations, self.bestBeta * self.scale)
+        self.done = True
+
+    # Move on to the next iteration
+    def advance(self):
+        self.iteration += 1
+        if self.iteration >= self.maxIts:
+            self.finish(self.maxIts, 'maxIterations')
+
+    # Save everything needed to continue with iteration nextIteration
+    def saveCheckpoint(self, nextIteration):
+        optimaCheckpoint.save(self.checkpoint, method = self.method, iteration = nextIteration,
+                              beta = self.beta, r = self.r, betaOld = self.betaOld, rOld = self.rOld, normOld = self.normOld,
+                              bestNorm = self.bestNorm, bestBeta = self.bestBeta, broydenMatrix = self.broydenMatrix.matrix,
+                              damping = np.nan if self.damping is None else self.damping, dampingFactor = self.dampingFactor)
+
+    def ask(self):
+        if self.done or self.waiting:
+            return []
+        self.waiting = True
+        if self.seedPoints is not None:
+            optimaEvents.notify(self.observers, 'message', text = f'Evaluating {len(self.seedPoints)} {self.jacobian} difference seed points')
+            self.evaluationStart = time.perf_counter()
+            return [point * self.scale for point in self.seedPoints]
+        if self.pending is None:
+            beta = self.nextBeta()
+            if beta is None:
+                return []
+            # Calculate the functional values
+            # Leave this call straightforward: want to be able to swap this function for any other black box
+            beta = clipToBounds(beta, self.bounds)
+            self.pending = beta * self.scale
+        if not self.retried:
+            self.evaluationStart = time.perf_counter()
+        return [self.pending]
+
+    # Coefficients (unscaled) for the current iteration, or None if the linear solve failed
+    def nextBeta(self):
+        n = self.n
+        iteration = self.iteration
+        self.l = None
+        self.steplength = None
+        self.linearAlgebraTime = 0
         # Get beta
         if iteration == 0:
             # Start with first initial guess
-            beta = copy.deepcopy(betaInit0)
+            beta = copy.deepcopy(self.betaInit0)
         elif iteration < n + 1:
             # Update to second set of initial values one-by-one
-            # Ensure initial values don't repeat
             i = iteration - 1
-            if betaInit1[i] == betaInit0[i]:
-                if betaInit1[i] == 0:
-                    # If everything is left blank, mix the values around a bit
-                    beta[i] = (-1)**i * (7 * i + 1)
-                else:
-                    # Otherwise try a small step from the value provided
-                    beta[i] = 1.007 * betaInit0[i]
-            else:
-                # If there is a usable value, use it
-                beta[i] = betaInit1[i]
+            beta = self.beta
+            beta[i] = seedValue(self.betaInit0, self.betaInit1, i)
         else:
-            # Otherwise use directionVector method to update beta
-            l = 1/(iteration + 1 - n)**2
-            steplength = 1
-            # Calculate update to coefficients
+            # Otherwise use the factored normal equations to update beta
+            if self.adaptive:
+                if self.damping is None:
+                    self.damping = 0.1 * np.max(np.diag(self.broydenMatrix.gram))
+                self.l = self.damping
+            else:
+                self.l = 1/(iteration + 1 - n)**2
+            self.steplength = 1
+            # Calculate update to coefficients from the last accepted point
+            linearAlgebraStart = time.perf_counter()
             try:
-                beta = directionVector(r, broydenMatrix, beta, l, steplength, weight)
-            except OptimaException:
-                return bestNorm, iteration + 1, bestBeta * scale
-
-        # Calculate the functional values
-        # Leave this call straightforward: want to be able to swap this function for any other black box
-        for i in range(n):
-            if beta[i] < bounds[i][0]:
-                beta[i] = bounds[i][0]
-            elif beta[i] > bounds[i][1]:
-                beta[i] = bounds[i][1]
-        beta = beta * scale
-        try:
-            f = functional(tags,beta)
-        except OptimaException:
-            if iteration == 0:
-                return bestNorm, iteration + 1, bestBeta * scale
+                beta = self.broydenMatrix.direction(self.rOld, self.betaOld, self.l, self.steplength)
+            except OptimaException as e:
+                optimaEvents.notify(self.observers, 'message', text = str(e))
+                self.finish(iteration + 1, 'failed')
+                return None
+            self.linearAlgebraTime += time.perf_counter() - linearAlgebraStart
+        return beta
+
+    def tell(self, beta, f):
+        if self.done or not self.waiting:
+            optimaEvents.notify(self.observers, 'message', text = 'Result for a point that was not asked for, ignored')
+            return
+        if self.seedPoints is not None:
+            self.tellSeed(beta, f)
+            return
+        if not np.array_equal(np.asarray(beta, dtype = float), self.pending):
+            optimaEvents.notify(self.observers, 'message', text = 'Result for a point that was not asked for, ignored')
+            return
+        self.waiting = False
+        n = self.n
+        iteration = self.iteration
+        beta = self.pending
+        self.pending = None
+        f = self.failures.check(f, self.observers)
+        if isinstance(f, Exception):
+            if iteration == 0 or self.retried:
+                self.finish(iteration + 1, 'failed')
+                return
+            if self.adaptive and iteration > n:
+                # Treat a failed calculation as a rejected step
+                self.damping *= self.dampingFactor
+                self.dampingFactor *= 2
+                self.beta = self.betaOld
+                self.advance()
+                return
             # If a calculation fails, try shrinking step drastically
-            beta = 0.999 * betaOld + 0.001 * beta
-            try:
-                f = functional(tags,beta)
-            except OptimaException:
-                return bestNorm, iteration + 1, bestBeta * scale
-        beta = beta / scale
+            self.pending = 0.999 * self.betaOld + 0.001 * beta
+            self.retried = True
+            return
+        self.retried = False
+        evaluationTime = time.perf_counter() - self.evaluationStart
+        beta = beta / self.scale
         # Compute the functional norm:
-        rscale = 1e6
-        r = rscale * (f - y)
-        for i in range(m):
-            if (y[i] != 0):
-                r[i] = r[i] / abs(y[i])
-        norm = functionalNorm(r / rscale)
-        # Print current status
-        print(f'Iteration: {iteration + 1}')
-        print(f'Current coefficients: {beta * scale}')
-        print(f'Norm: {norm}')
-        print()
+        r, norm = relativeResidual(f, self.y, failures = self.failures)
+        # Report current status
+        optimaEvents.notify(self.observers, 'iteration', method = self.method, iteration = iteration + 1,
+                            beta = beta * self.scale, norm = norm, steplength = self.steplength, damping = self.l,
+                            evaluationTime = evaluationTime, linearAlgebraTime = self.linearAlgebraTime)
         # Keep track of best norm/beta found
-        if norm < bestNorm:
-            bestBeta = beta
-            bestNorm = norm
+        if norm < self.bestNorm:
+            self.bestBeta = beta
+            self.bestNorm = norm
         # Check if converged
-        if norm < tol:
-            # Converged, print and return
-            print()
-            print('Converged')
-            print(f'{beta * scale} after {iteration + 1}')
-            return bestNorm, iteration + 1, bestBeta * scale
-
-        # Update the Broyden matrix:
+        if norm < self.tol:
+            # Converged, report and return
+            self.converge(iteration + 1, beta, norm)
+            return
+        # Check if the caller wants this run stopped
+        if self.cancel is not None and self.cancel(iteration + 1, self.bestNorm):
+            self.finish(iteration + 1, 'cancelled')
+            return
+
+        # Accept or reject the step by comparing the actual reduction in norm to the one predicted by the Broyden model
+        accepted = True
+        if self.adaptive and iteration > n:
+            s = beta - self.betaOld
+            predictedNorm = self.failures.norm((self.rOld - self.broydenMatrix.matrix @ s) / residualScale)
+            actual = self.normOld - norm
+            predicted = self.normOld - predictedNorm
+            accepted = actual > 0
+            if accepted:
+                gainRatio = actual / predicted if predicted > 0 else 1
+                self.damping *= max(1/3, 1 - (2 * gainRatio - 1)**3)
+                self.dampingFactor = 2
+            else:
+                self.damping *= self.dampingFactor
+                self.dampingFactor *= 2
+
+        # Update the Broyden matrix (rejected steps still carry information about the Jacobian):
         if iteration > 0:
             # Residuals and deltas
-            s = beta - betaOld
-            t = rOld - r
-            broydenUpdate(broydenMatrix, t, s)
+            s = beta - self.betaOld
+            t = self.rOld - r
+            linearAlgebraStart = time.perf_counter()
+            self.broydenMatrix.update(t, s)
+            self.linearAlgebraTime += time.perf_counter() - linearAlgebraStart
 
         # Update vectors for succeeding iteration:
-        betaOld = copy.deepcopy(beta)
-        rOld = copy.deepcopy(r)
+        if accepted:
+            self.beta = beta
+            self.r = r
+            self.betaOld = copy.deepcopy(beta)
+            self.rOld = copy.deepcopy(r)
+            self.normOld = norm
+        else:
+            self.beta = copy.deepcopy(self.betaOld)
+            self.r = copy.deepcopy(self.rOld)
+
+        if self.checkpoint and (iteration + 1) % self.checkpointInterval == 0:
+            self.saveCheckpoint(iteration + 1)
+        self.advance()
+
+    # Collects finite-difference seed results, and builds the Broyden matrix from them once all are in
+    def tellSeed(self, beta, f):
+        beta = np.asarray(beta, dtype = float)
+        f = self.failures.check(f, self.observers)
+        for k, point in enumerate(self.seedPoints):
+            if self.seedResults[k] is None and np.array_equal(beta, point * self.scale):
+                self.seedResults[k] = f
+                break
+        else:
+            optimaEvents.notify(self.observers, 'message', text = 'Result for a point that was not asked for, ignored')
+            return
+        if any([result is None for result in self.seedResults]):
+            return
+        self.waiting = False
+        evaluationTime = time.perf_counter() - self.evaluationStart
+        seed = finiteDifferenceSeed(self.y, self.seedPoints, self.seedResults, self.scale, self.broydenMatrix.weight,
+                                    self.jacobian, evaluationTime, self.observers, self.failures)
+        self.seedPoints = None
+        self.seedResults = None
+        if seed is None:
+            self.finish(1, 'failed')
+            return
+        beta, r, norm, self.broydenMatrix = seed
+        self.beta = beta
+        self.r = r
+        self.bestBeta = beta
+        self.bestNorm = norm
+        if norm < self.tol:
+            self.converge(1, beta, norm)
+            return
+        self.betaOld = copy.deepcopy(beta)
+        self.rOld = copy.deepcopy(r)
+        self.normOld = norm
+        # Seeding replaces the first n + 1 Broyden iterations
+        self.iteration = self.n + 1
+        if self.checkpoint:
+            self.saveCheckpoint(self.iteration)
+        if self.iteration >= self.maxIts:
+            self.finish(self.maxIts, 'maxIterations')
+
+# Second initial value for coefficient i, ensuring initial values don't repeat
+def seedValue(betaInit0, betaInit1, i):
+    if betaInit1[i] == betaInit0[i]:
+        if betaInit1[i] == 0:
+            # If everything is left blank, mix the values around a bit
+            return (-1)**i * (7 * i + 1)
+        else:
+            # Otherwise try a small step from the value provided
+            return 1.007 * betaInit0[i]
+    else:
+        # If there is a usable value, use it
+        return betaInit1[i]
+
+# Clip (scaled) coefficients to bounds
+def clipToBounds(beta, bounds):
+    bounds = np.asarray(bounds, dtype = float)
+    return np.clip(beta, bounds[:,0], bounds[:,1])
+
+# Initial guess and its finite-difference neighbours, from which a Broyden matrix can be seeded.
+# Perturbations are the same ones the serial Broyden seeding would use, but each is applied alone to the first guess.
+def finiteDifferencePoints(betaInit0, betaInit1, bounds, jacobian):
+    n = len(betaInit0)
+    beta0 = clipToBounds(betaInit0, bounds)
+    points = [beta0]
+    for i in range(n):
+        step = seedValue(betaInit0, betaInit1, i) - betaInit0[i]
+        if jacobian == 'forward':
+            offsets = [step]
+        else:
+            offsets = [step, -step]
+        for offset in offsets:
+            point = copy.deepcopy(beta0)
+            point[i] += offset
+            points.append(clipToBounds(point, bounds))
+    return points
+
+# Builds a Broyden matrix from the functional values (or exceptions) at the points from finiteDifferencePoints.
+# Returns beta, r, norm and the Broyden matrix at the first guess, or None if the first guess fails.
+def finiteDifferenceSeed(y, points, results, scale, weight, jacobian, evaluationTime, observers, failures = None):
+    m = len(y)
+    n = len(points[0])
+    beta0 = points[0]
+    if isinstance(results[0], Exception):
+        return None
+    r, norm = relativeResidual(results[0], y, failures = failures)
+    optimaEvents.notify(observers, 'iteration', method = 'LevenbergMarquardtBroyden', iteration = 1,
+                        beta = beta0 * scale, norm = norm, steplength = None, damping = None,
+                        evaluationTime = evaluationTime, linearAlgebraTime = None)
+
+    # Broyden matrix approximates -dr/dbeta; columns that can't be computed keep the default 1s
+    matrix = np.ones([m,n])
+    residuals = [None if isinstance(result, Exception) else relativeResidual(result, y)[0] for result in results]
+    pointsPerColumn = 1 if jacobian == 'forward' else 2
+    for i in range(n):
+        # Collect the usable (point, residual) pairs for this column, including the first guess
+        column = [(beta0[i], r)]
+        for k in range(1 + pointsPerColumn * i, 1 + pointsPerColumn * (i + 1)):
+            if residuals[k] is not None and points[k][i] != beta0[i]:
+                column.append((points[k][i], residuals[k]))
+        if len(column) == 1:
+            optimaEvents.notify(observers, 'message', text = f'Seed points for coefficient {i} failed, keeping default Broyden column')
+            continue
+        # Central difference uses the two outer points, forward difference the first guess and its neighbour
+        (lowBeta, lowR), (highBeta, highR) = column[-2], column[-1]
+        if len(column) == 3:
+            (lowBeta, lowR) = column[1]
+        difference = -(highR - lowR) / (highBeta - lowBeta)
+        # Rows where either point failed keep the default too
+        matrix[:,i] = np.where(np.isnan(difference), matrix[:,i], difference)
 
-    print('Reached maximum iterations without converging')
-    return bestNorm, iteration + 1, bestBeta * scale
+    return beta0, r, norm, BroydenMatrix(matrix, weight)
 
 # Functional norm calculation
 def functionalNorm(residual):
-    norm = 0
-    for i in range(len(residual)):
-        norm += residual[i]**2
-    return norm
+    residual = np.asarray(residual, dtype = float)
+    return np.dot(residual, residual)
 
-# Updates to Broyden matric based on current function values
-def broydenUpdate(broydenMatrix,dependent,objective):
-    m = len(dependent)
-    n = len(objective)
+# Scale applied to residuals while they are handled by the solver
+residualScale = 1e6
 
-    # Compute Bs:
-    update = np.zeros(m)
-    for j in range(n):
-        for i in range(m):
-            update[i] += broydenMatrix[i][j] * objective[j]
+# Relative residual and norm computed together
+# Entries with y == 0 are left as absolute differences
+# Failed (NaN) values stay NaN in the residual, and count towards the norm as failures (a FailurePolicy) says
+def relativeResidual(f, y, rscale = residualScale, failures = None):
+    if failures is None:
+        failures = defaultFailures
+    r = rscale * (np.asarray(f, dtype = float) - y)
+    nonzero = y != 0
+    r[nonzero] = r[nonzero] / np.abs(y[nonzero])
+    norm = failures.norm(r / rscale)
+    return r, norm
 
-    # Compute sTs:
-    sMag = 0
-    for j in range(n):
-        sMag += objective[j]**2
+# Handling of evaluations in which some calculations failed, which the functional marks by returning NaN for their values.
+# An evaluation with less than minConverged (a fraction) of its values is treated as a failed evaluation.
+# Otherwise the solver carries on with the converged values: residual rows of failed values take no part in the
+# Broyden update or the step, and each failed value adds penalty to the norm, so that failing doesn't look like
+# an improvement. penalty = 'rescale' instead scales the norm of the converged values up to the full number of values.
+class FailurePolicy:
+    def __init__(self, minConverged = 0.9, penalty = 1.0):
+        self.minConverged = minConverged
+        self.penalty = penalty
+    # f, or an OptimaException in its place if too few of its values converged
+    def check(self, f, observers = []):
+        if isinstance(f, Exception):
+            return f
+        f = np.asarray(f, dtype = float)
+        failed = np.count_nonzero(np.isnan(f))
+        if failed == 0:
+            return f
+        if len(f) - failed < self.minConverged * len(f) or failed == len(f):
+            optimaEvents.notify(observers, 'message', text = f'{failed} of {len(f)} values failed, evaluation treated as failed')
+            return OptimaException()
+        optimaEvents.notify(observers, 'message', text = f'{failed} of {len(f)} values failed, continuing without them')
+        return f
+    # Norm of residual, which may have failed (NaN) entries
+    def norm(self, residual):
+        residual = np.asarray(residual, dtype = float)
+        failed = np.isnan(residual)
+        if not np.any(failed):
+            return functionalNorm(residual)
+        norm = functionalNorm(residual[~failed])
+        if self.penalty == 'rescale':
+            return norm * len(residual) / np.count_nonzero(~failed)
+        return norm + self.penalty * np.count_nonzero(failed)
 
+# Used where no other policy is given
+defaultFailures = FailurePolicy()
+
+# Updates to Broyden matric based on current function values
+def broydenUpdate(broydenMatrix,dependent,objective):
     # Compute (y - Bs) / sTs
-    for i in range(m):
-        update[i] = (dependent[i] - update[i]) / sMag
+    update = (dependent - broydenMatrix @ objective) / np.dot(objective, objective)
+
+    # Rank-one update of the Broyden matrix (in place)
+    broydenMatrix += np.outer(update, objective)
 
-    # Update the Broyden matrix:
-    for j in range(n):
-        for i in range(m):
-            broydenMatrix[i][j] = broydenMatrix[i][j] + update[i] * objective[j]
+# Reason given when the damped normal equations can't be solved, for the solver to report to its observers
+linearSolveMessage = 'There was a problem in solving the system of linear equations.'
 
 # New direction vector given current residual
 def directionVector(residual, broydenMatrix, coefficient, l, steplength, weight):
-    m = len(residual)
     n = len(coefficient)
 
-    a = np.zeros([n,n])
-    b = np.zeros(n)
-
-    # Compute the (J^T J) matrix:
-    for j in range(n):
-        for i in range(j,n):
-            # Compute the coefficient for the A matrix:
-            for k in range(m):
-                a[i][j] += broydenMatrix[k][i] * broydenMatrix[k][j] * weight[k]
-                if abs(a[i][j]) > 1e20:
-                    steplength = 1e-6
-            # Apply symmetry:
-            a[j][i] = a[i][j]
-
-    # Compute the right hand side vector:
-    for j in range(n):
-        for i in range(m):
-            b[j] = b[j] + broydenMatrix[i][j] * residual[i]
-            if abs(b[j]) > 1e20:
-                steplength = 1e-6
-        a[j][j] = a[j][j] + l
+    # Compute the (J^T W J) matrix and the right hand side vector:
+    a = broydenMatrix.T @ (broydenMatrix * np.asarray(weight)[:,np.newaxis])
+    b = broydenMatrix.T @ residual
+    if np.any(np.abs(a) > 1e20) or np.any(np.abs(b) > 1e20):
+        steplength = 1e-6
+    a[np.diag_indices(n)] += l
 
     # Call the linear equation solver:
     try:
         [x, residuals, rank, singular] = np.linalg.lstsq(a,b,rcond=None)
-        betaNew = np.zeros(n)
-        # Print results to screen:
-        for j in range(n):
-            betaNew[j] = coefficient[j] + steplength * x[j]
+        betaNew = coefficient + steplength * x
         return betaNew
     except (np.linalg.LinAlgError, ValueError) as e:
-        print('There was a problem in solving the system of linear equations.')
-        raise OptimaException
+        raise OptimaException(linearSolveMessage)
+
+# Broyden matrix that carries the weighted Gram matrix (B^T W B) of the normal equations along with it.
+# Rank-one updates adjust the Gram matrix in O(m*n + n^2) instead of rebuilding it in O(m*n^2).
+# The Gram matrix is factored once per update, so the damping parameter can change freely between solves.
+# refreshInterval sets how many updates pass before the Gram matrix is rebuilt to clear accumulated round-off.
+class BroydenMatrix:
+    def __init__(self, matrix, weight, refreshInterval = 0):
+        self.matrix = np.array(matrix, dtype = float)
+        self.weight = np.asarray(weight, dtype = float)
+        m, n = self.matrix.shape
+        if refreshInterval > 0:
+            self.refreshInterval = refreshInterval
+        else:
+            # Amortizes the O(m*n^2) rebuild to O(m*n) per update
+            self.refreshInterval = n
+        self.refresh()
+    def refresh(self):
+        self.gram = self.matrix.T @ (self.matrix * self.weight[:,np.newaxis])
+        self.nUpdates = 0
+        self.factor = None
+    def update(self, dependent, objective):
+        # Same update as broydenUpdate: B <- B + u s^T with u = (y - Bs) / sTs
+        # Rows without a change in residual (failed values) are left as they are
+        # A step of zero length (e.g. retried from a rejected point) says nothing about the Jacobian
+        if not np.any(objective):
+            return
+        predicted = self.matrix @ objective
+        u = np.where(np.isnan(dependent), 0, dependent - predicted) / np.dot(objective, objective)
+        wu = self.weight * u
+        c = self.matrix.T @ wu
+        self.matrix += np.outer(u, objective)
+        # (B + u s^T)^T W (B + u s^T) = G + c s^T + s c^T + (u^T W u) s s^T
+        self.gram += np.outer(c, objective) + np.outer(objective, c) + np.dot(u, wu) * np.outer(objective, objective)
+        self.factor = None
+        self.nUpdates += 1
+        if self.nUpdates >= self.refreshInterval:
+            self.refresh()
+    def direction(self, residual, coefficient, l, steplength):
+        # Same system as directionVector: (B^T W B + l I) x = B^T r, leaving out the rows of failed (NaN) values
+        failed = np.isnan(residual)
+        b = self.matrix.T @ np.where(failed, 0, residual)
+        gram = self.gram
+        if np.any(failed):
+            rows = self.matrix[failed]
+            gram = gram - rows.T @ (rows * self.weight[failed][:,np.newaxis])
+        if np.any(np.abs(gram) > 1e20) or np.any(np.abs(b) > 1e20):
+            steplength = 1e-6
+        try:
+            if np.any(failed):
+                # Only used for this solve, the factor of the full Gram matrix is kept
+                factor = np.linalg.eigh(gram)
+            else:
+                if self.factor is None:
+                    self.factor = np.linalg.eigh(self.gram)
+                factor = self.factor
+            eigenvalues, eigenvectors = factor
+            # Damping shifts the eigenvalues only, so no re-factoring is needed when l changes
+            shifted = eigenvalues + l
+            # Treat (numerically) zero modes the way lstsq does
+            cutoff = np.finfo(float).eps * len(shifted) * np.max(np.abs(shifted))
+            inverse = np.zeros(len(shifted))
+            usable = np.abs(shifted) > cutoff
+            inverse[usable] = 1 / shifted[usable]
+            x = eigenvectors @ (inverse * (eigenvectors.T @ b))
+        except (np.linalg.LinAlgError, ValueError) as e:
+            raise OptimaException(linearSolveMessage)
+        if not np.all(np.isfinite(x)):
+            raise OptimaException(linearSolveMessage)
+        return coefficient + steplength * x
 
 # Bayesian optimization
 # Arguments match those in LevenbergMarquardtBroyden so a common interface can be used
+# A failed evaluation (OptimaException, or too many failed values) is skipped and the search goes on, where this used
+# to stop the whole run; it still counts against maxIts.
 def Bayesian(y,tags,functional,maxIts,tol,weight = [], scale = [], **extraParams):
-    from sklearn.metrics import r2_score
-    import sys
-    sys.path.append('.')
-    from BayesianOptimization.bayes_opt import BayesianOptimization, SequentialDomainReductionTransformer
-
-    # Set default values for optional parameters
-    acq = 'ucb'
-    init_points = 10
-    eta = 1
-    kappa = 2.576
-    kappa_decay = 1
-    kappa_decay_delay = 0
-    for param, value in extraParams.items():
-        if param == 'acq':
-            acq = value
-        elif param == 'init_points':
-            init_points = value
-        elif param == 'eta':
-            eta = value
-        elif param == 'kappa':
-            kappa = value
-        elif param == 'kappa_decay':
-            kappa_decay = value
-        elif param == 'kappa_decay_delay':
-            kappa_decay_delay = value
-
-    # Get problem dimensions
-    m = len(y)
-    n = len(tags)
+    return runOptimizer(BayesianOptimizer(y,tags,maxIts,tol,weight = weight, scale = scale, **extraParams), functional)
 
-    if not len(weight) == m:
-        weight = np.ones(m)
+# Ask/tell version of Bayesian.
+# Up to batch_size points are asked for at a time, proposed using the constant liar strategy: a copy of the optimizer
+# is told that every outstanding point scored the worst target seen so far, which pushes the next proposal elsewhere.
+# A stage starts with random points and stops once its evaluation budget is spent, when the best target exceeds 1/tol or,
+# if stagnationIterations is set, when the best target has not improved by more than stagnationThreshold for that many evaluations.
+# Failed evaluations are skipped: they are reported, count against the budget and leave no sample behind, so serial runs
+# (batch_size = 1) carry on past them as well instead of aborting as Bayesian did before.
+class BayesianOptimizer:
+    method = 'Bayesian'
+    def __init__(self,y,tags,maxIts,tol,weight = [], scale = [], **extraParams):
+        import sys
+        sys.path.append('.')
+        from BayesianOptimization.bayes_opt import BayesianOptimization, SequentialDomainReductionTransformer, UtilityFunction
 
-    if not len(scale) == n:
-        scale = np.ones(n)
+        self.y = np.asarray(y, dtype = float)
+        self.tags = tags
+        self.maxIts = maxIts
+        self.tol = tol
+        self.done = False
+        self.result = None
 
-    # check that we have enough data to go ahead
-    if n == 0:
-        print('No tags with unknown values')
-        return
-    if m == 0:
-        print('No validation points')
-        return
-    for tag in tags:
-        # Check and adjust tags to be legal
-        if tags[tag][0] > tags[tag][1]:
-            print('Cannot run Bayesian solver with bound 1 > bound 2')
-            print(f'Check tag {tag}')
-            print('Bounds will be swapped automatically')
-            tempbound = tags[tag][0]
-            tags[tag][0] = tags[tag][1]
-            tags[tag][1] = tempbound
-        elif tags[tag][0] == tags[tag][1]:
-            print('Cannot run Bayesian solver with bound 1 == bound 2')
-            print(f'Check tag {tag}')
-            print('Upper bound will be increased automatically')
-            if tags[tag][1] == 0:
-                tags[tag][1] = 7
-            else:
-                tags[tag][1] += abs(tags[tag][1])
-
-    # Use provided functional to get trial values, then calculate R2 score
-    # Need to take an unknown number of tag+value pairs as arguments.
-    def functionalR2(**pairs):
-        beta = list(pairs.values())
-        f = functional(tags, beta)
-        score = r2_score(y, f, sample_weight = weight)
-        return score
-
-    def functionalNormNegative(**pairs):
-        beta = list(pairs.values())
-        f = functional(tags, beta)
-        rscale = 1e6
-        r = rscale * (f - y) / abs(y)
-        norm = functionalNorm(r / rscale)
-        return -norm
+        # Set default values for optional parameters
+        acq = 'ucb'
+        self.init_points = 10
+        eta = 1
+        kappa = 2.576
+        kappa_decay = 1
+        kappa_decay_delay = 0
+        self.batch_size = 1
+        self.processes = 0
+        self.checkpoint = None
+        self.checkpointInterval = 1
+        self.resume = False
+        self.failures = FailurePolicy()
+        for param, value in extraParams.items():
+            if param == 'acq':
+                acq = value
+            elif param == 'init_points':
+                self.init_points = value
+            elif param == 'eta':
+                eta = value
+            elif param == 'kappa':
+                kappa = value
+            elif param == 'kappa_decay':
+                kappa_decay = value
+            elif param == 'kappa_decay_delay':
+                kappa_decay_delay = value
+            elif param == 'batch_size':
+                self.batch_size = max(int(value), 1)
+            elif param == 'processes':
+                self.processes = value
+            elif param == 'checkpoint':
+                self.checkpoint = value
+            elif param == 'checkpointInterval':
+                self.checkpointInterval = max(int(value), 1)
+            elif param == 'resume':
+                self.resume = value
+            elif param == 'minConverged':
+                self.failures.minConverged = value
+            elif param == 'failurePenalty':
+                self.failures.penalty = value
 
-    def functionalInverseNorm(**pairs):
-        beta = list(pairs.values())
-        f = functional(tags, beta)
-        rscale = 1e6
-        r = rscale * (f - y) / abs(y)
-        norm = functionalNorm(r / rscale)
-        return 1/norm
+        # Get problem dimensions
+        m = len(y)
+        n = len(tags)
 
-    def functionalLogNorm(**pairs):
-        beta = list(pairs.values())
-        f = functional(tags, beta)
-        rscale = 1e6
-        r = rscale * (f - y) / abs(y)
-        norm = functionalNorm(r / rscale)
-        return -np.log(norm)
+        self.observers = optimaEvents.getObservers(extraParams)
 
-    # Create a BayesianOptimization optimizer and optimize the given black_box_function.
-    try:
-        bounds_transformer = SequentialDomainReductionTransformer(eta = eta)
-        optimizer = BayesianOptimization(f = functionalInverseNorm, pbounds = tags, bounds_transformer = bounds_transformer)
-        optimizer.maximize(init_points = init_points,
-                           n_iter = max(maxIts - init_points,0),
-                           acq = acq,
-                           kappa = kappa,
-                           kappa_decay = kappa_decay,
-                           kappa_decay_delay = kappa_decay_delay,
-                           y_limit = 0,
-                           tol = 1/tol)
-    except OptimaException:
-        return
-    except ValueError:
-        print('Internal bayes_opt error, run cancelled (retry may yield different results)')
-    # Format for output
-    results = list(optimizer.max['params'].items())
+        # check that we have enough data to go ahead
+        if n == 0:
+            optimaEvents.notify(self.observers, 'message', text = 'No tags with unknown values')
+            self.done = True
+            return
+        if m == 0:
+            optimaEvents.notify(self.observers, 'message', text = 'No validation points')
+            self.done = True
+            return
+        for tag in tags:
+            # Check and adjust tags to be legal
+            if tags[tag][0] > tags[tag][1]:
+                optimaEvents.notify(self.observers, 'message', text = 'Cannot run Bayesian solver with bound 1 > bound 2')
+                optimaEvents.notify(self.observers, 'message', text = f'Check tag {tag}')
+                optimaEvents.notify(self.observers, 'message', text = 'Bounds will be swapped automatically')
+                tempbound = tags[tag][0]
+                tags[tag][0] = tags[tag][1]
+                tags[tag][1] = tempbound
+            elif tags[tag][0] == tags[tag][1]:
+                optimaEvents.notify(self.observers, 'message', text = 'Cannot run Bayesian solver with bound 1 == bound 2')
+                optimaEvents.notify(self.observers, 'message', text = f'Check tag {tag}')
+                optimaEvents.notify(self.observers, 'message', text = 'Upper bound will be increased automatically')
+                if tags[tag][1] == 0:
+                    tags[tag][1] = 7
+                else:
+                    tags[tag][1] += abs(tags[tag][1])
 
-    beta = []
-    print('Best result:')
-    for i in range(n):
-        print(f'{results[i][0]} = {results[i][1]}')
-        beta.append(results[i][1])
-    print(f'f(x) = {optimizer.max["target"]}')
+        # Successful evaluations (including restored ones) and their (beta, target) history for checkpoints
+        self.evaluations = 0
+        self.history = []
+        # Points asked for but not told yet, as (beta, params, time asked)
+        self.outstanding = []
 
-    return 1/optimizer.max["target"], optimizer.iteration + init_points, beta
+        # Create a BayesianOptimization optimizer; targets are registered with it as they are told
+        self.utility = UtilityFunction(kind = acq, kappa = kappa, xi = 0.0, kappa_decay = kappa_decay, kappa_decay_delay = kappa_decay_delay)
+        bounds_transformer = SequentialDomainReductionTransformer(eta = eta)
+        self.optimizer = BayesianOptimization(f = None, pbounds = tags, bounds_transformer = bounds_transformer)
+        self.start()
 
-# Combined Bayesian+Broyden optimization
-def Combined(y,tags,functional,maxIts,tol,weight = [], scale = [], **extraParams):
-    from sklearn.metrics import r2_score
-    import sys
-    sys.path.append('.')
-    from BayesianOptimization.bayes_opt import BayesianOptimization, SequentialDomainReductionTransformer
-
-    # Save original tags to pass to Broyden
-    broydenTags = copy.deepcopy(tags)
-
-    # Set default values for optional parameters
-    acq = 'ucb'
-    init_points = 10
-    eta = 1
-    kappa = 2.576
-    kappa_decay = 1
-    kappa_decay_delay = 0
-    for param, value in extraParams.items():
-        if param == 'acq':
-            acq = value
-        elif param == 'init_points':
-            init_points = value
-        elif param == 'eta':
-            eta = value
-        elif param == 'kappa':
-            kappa = value
-        elif param == 'kappa_decay':
-            kappa_decay = value
-        elif param == 'kappa_decay_delay':
-            kappa_decay_delay = value
-
-    # Get problem dimensions
-    m = len(y)
-    n = len(tags)
+    def start(self):
+        # Restore previous samples and count them against the iteration budget
+        if self.resume and optimaCheckpoint.exists(self.checkpoint):
+            state = optimaCheckpoint.load(self.checkpoint)
+            if state['method'] == self.method:
+                self.restore(state)
+                optimaEvents.notify(self.observers, 'message', text = f'Resuming from {self.checkpoint} after {self.evaluations} evaluations')
+        self.restored = self.evaluations
+        initRemaining = max(self.init_points - self.restored, 0)
+        iterRemaining = max(self.maxIts - self.init_points, 0) - max(self.restored - self.init_points, 0)
+        self.startStage(initRemaining, iterRemaining)
 
-    if not len(weight) == m:
-        weight = np.ones(m)
+    # Begins a stage of initPoints random points followed by up to nIter proposed points
+    def startStage(self, initPoints, nIter, stagnationIterations = 0, stagnationThreshold = 0):
+        space = self.optimizer.space
+        self.startup = [space.array_to_params(space.random_sample()) for _ in range(initPoints)]
+        self.budget = initPoints + nIter
+        self.stagnationIterations = stagnationIterations
+        self.stagnationThreshold = stagnationThreshold
+        # Points asked for in this stage
+        self.proposed = 0
+        self.bestTarget = -np.Inf
+        self.lastImprovement = initPoints
+        self.transformBounds = False
+        self.stageDone = False
 
-    if not len(scale) == n:
-        scale = np.ones(n)
+    def ask(self):
+        if self.done:
+            return []
+        betas = self.askStage()
+        if self.stageDone and len(self.outstanding) == 0:
+            self.finishStage()
+        return betas
 
-    # check that we have enough data to go ahead
-    if n == 0:
-        print('No tags with unknown values')
-        return
-    if m == 0:
-        print('No validation points')
-        return
-    for tag in tags:
-        # Check and adjust tags to be legal
-        if tags[tag][0] > tags[tag][1]:
-            print('Cannot run Bayesian solver with bound 1 > bound 2')
-            print(f'Check tag {tag}')
-            print('Bounds will be swapped automatically')
-            tempbound = tags[tag][0]
-            tags[tag][0] = tags[tag][1]
-            tags[tag][1] = tempbound
-        elif tags[tag][0] == tags[tag][1]:
-            print('Cannot run Bayesian solver with bound 1 == bound 2')
-            print(f'Check tag {tag}')
-            print('Upper bound will be increased automatically')
-            if tags[tag][1] == 0:
-                tags[tag][1] = 7
+    # Points for the current stage, setting stageDone once it should stop
+    def askStage(self):
+        available = self.batch_size - len(self.outstanding)
+        if self.stageDone or available < 1:
+            return []
+        if len(self.startup) > 0:
+            # Random startup points
+            batch = self.startup[:available]
+            self.startup = self.startup[available:]
+        else:
+            optimizer = self.optimizer
+            if self.proposed >= self.budget:
+                self.stageDone = True
+            elif len(optimizer.space) > 0:
+                if optimizer.max['target'] > 1/self.tol:
+                    self.stageDone = True
+                elif optimizer.max['target'] > self.bestTarget + self.stagnationThreshold:
+                    self.bestTarget = optimizer.max['target']
+                    self.lastImprovement = self.proposed
+                elif self.stagnationIterations > 0 and self.proposed - self.lastImprovement >= self.stagnationIterations:
+                    self.stageDone = True
+            if self.stageDone:
+                return []
+            if optimizer._bounds_transformer and self.transformBounds:
+                optimizer.set_bounds(optimizer._bounds_transformer.transform(optimizer.space))
+                self.transformBounds = False
+            # Propose against a liar copy when it has to be told about points that aren't evaluated yet: the outstanding
+            # ones and earlier proposals of this batch. A single proposal with nothing outstanding (every serial ask)
+            # comes from the optimizer itself, saving a copy of its samples and Gaussian process.
+            count = min(available, self.budget - self.proposed)
+            liar = optimizer
+            if len(self.outstanding) > 0 or count > 1:
+                liar = copy.deepcopy(optimizer)
+            if len(optimizer.space) > 0:
+                lie = np.min(optimizer.space.target)
             else:
-                tags[tag][1] += abs(tags[tag][1])
-
-    # Use provided functional to get trial values, then calculate R2 score
-    # Need to take an unknown number of tag+value pairs as arguments.
-    def functionalR2(**pairs):
-        beta = list(pairs.values())
-        f = functional(tags, beta)
-        score = r2_score(y, f, sample_weight = weight)
-        return score
-
-    def functionalNormNegative(**pairs):
-        beta = list(pairs.values())
-        f = functional(tags, beta)
-        rscale = 1e6
-        r = rscale * (f - y) / abs(y)
-        norm = functionalNorm(r / rscale)
-        return -norm
+                lie = 0
+            for beta, params, askTime in self.outstanding:
+                try:
+                    liar.register(params = params, target = lie)
+                except KeyError:
+                    pass
+            batch = []
+            try:
+                for _ in range(count):
+                    params = liar.suggest(self.utility)
+                    self.utility.update_params()
+                    if liar is optimizer:
+                        # Nothing to tell, but a point it already has can't be proposed either
+                        if optimizer.space.params_to_array(params) in optimizer.space:
+                            break
+                    else:
+                        try:
+                            liar.register(params = params, target = lie)
+                        except KeyError:
+                            # The liar proposed a point it already has, so the batch can't be filled any further
+                            break
+                    batch.append(params)
+            except ValueError:
+                optimaEvents.notify(self.observers, 'message', text = 'Internal bayes_opt error, run cancelled (retry may yield different results)')
+                self.stageDone = True
+                return []
+            if len(batch) == 0:
+                if len(self.outstanding) == 0:
+                    self.stageDone = True
+                return []
+            self.transformBounds = True
+        self.proposed += len(batch)
+        askTime = time.perf_counter()
+        betas = []
+        for params in batch:
+            beta = [params[tag] for tag in self.tags]
+            self.outstanding.append((beta, params, askTime))
+            betas.append(beta)
+        return betas
 
-    def functionalInverseNorm(**pairs):
-        beta = list(pairs.values())
-        f = functional(tags, beta)
+    def tell(self, beta, f):
+        askTime = None
+        for k, (point, params, pointTime) in enumerate(self.outstanding):
+            if np.array_equal(point, beta):
+                del self.outstanding[k]
+                askTime = pointTime
+                break
+        else:
+            # Evaluated elsewhere, but still worth registering
+            params = dict(zip(self.tags, beta))
+        f = self.failures.check(f, self.observers)
+        if isinstance(f, Exception):
+            optimaEvents.notify(self.observers, 'message', text = 'Evaluation failed, point skipped')
+            return
+        target = self.inverseNorm(f)
+        evaluationTime = None if askTime is None else time.perf_counter() - askTime
+        self.reportEvaluation([params[tag] for tag in self.tags], target, evaluationTime)
+        try:
+            self.optimizer.register(params = params, target = target)
+        except KeyError:
+            # Point already registered
+            pass
+
+    def inverseNorm(self, f):
         rscale = 1e6
-        r = rscale * (f - y) / abs(y)
-        norm = functionalNorm(r / rscale)
+        r = rscale * (f - self.y) / abs(self.y)
+        norm = self.failures.norm(r / rscale)
         return 1/norm
 
-    def functionalLogNorm(**pairs):
-        beta = list(pairs.values())
-        f = functional(tags, beta)
-        rscale = 1e6
-        r = rscale * (f - y) / abs(y)
-        norm = functionalNorm(r / rscale)
-        return -np.log(norm)
+    # Report each evaluation to observers and keep the sample history for checkpoints
+    def reportEvaluation(self, beta, target, evaluationTime):
+        self.evaluations += 1
+        self.history.append((list(beta), target))
+        optimaEvents.notify(self.observers, 'iteration', method = self.method, iteration = self.evaluations,
+                            beta = np.array(beta), norm = 1/target, steplength = None, damping = None,
+                            evaluationTime = evaluationTime, linearAlgebraTime = None)
+        if self.checkpoint and self.evaluations % self.checkpointInterval == 0:
+            self.saveCheckpoint()
+
+    def restore(self, state):
+        self.history.extend(restoreBayesianSamples(self.optimizer, self.tags, state))
+        self.evaluations = len(self.history)
+
+    def checkpointState(self):
+        return dict([('method', self.method),
+                     ('samples', [sample[0] for sample in self.history]),
+                     ('targets', [sample[1] for sample in self.history]),
+                     ('bounds', self.optimizer.space.bounds)])
+
+    def saveCheckpoint(self):
+        optimaCheckpoint.save(self.checkpoint, **self.checkpointState())
+
+    # Best point so far, as (tags, beta, target) in the optimizer's parameter order, or None without any evaluations
+    def best(self):
+        if len(self.optimizer.space) == 0:
+            return None
+        results = list(self.optimizer.max['params'].items())
+        return [result[0] for result in results], [result[1] for result in results], self.optimizer.max['target']
 
-    totalIts = init_points
-    init     = init_points
+    def finishStage(self):
+        self.done = True
+        best = self.best()
+        if best is None:
+            optimaEvents.notify(self.observers, 'message', text = 'No successful evaluations')
+            return
+        bestTags, beta, target = best
+        optimaEvents.notify(self.observers, 'best', method = self.method, tags = bestTags, beta = beta, target = target)
+        self.result = (1/target, self.restored + self.proposed, beta)
 
-    # First run with Bayesian:
-    bounds_transformer = SequentialDomainReductionTransformer(eta = eta)
-    optimizer = BayesianOptimization(f = functionalInverseNorm, pbounds = tags, bounds_transformer = bounds_transformer)
+# Combined Bayesian+Broyden optimization
+def Combined(y,tags,functional,maxIts,tol,weight = [], scale = [], **extraParams):
+    return runOptimizer(CombinedOptimizer(y,tags,maxIts,tol,weight = weight, scale = scale, **extraParams), functional)
 
+# Ask/tell version of Combined.
+# Each stage is a Bayesian phase followed by a LevenbergMarquardtBroyden phase started from the best Bayesian point.
+# The Bayesian phases share one optimizer, so later phases build on earlier samples.
+class CombinedOptimizer(BayesianOptimizer):
+    method = 'Combined'
     nIterMethods = 4
-    for n in range(nIterMethods):
-        optimizer.maximize(init_points = init,
-                           n_iter = maxIts,
-                           acq = acq,
-                           kappa = kappa,
-                           kappa_decay = kappa_decay,
-                           kappa_decay_delay = kappa_decay_delay,
-                           y_limit = 0,
-                           tol = 1/tol,
-                           stagnationIterations = 51,
-                           stagnationThreshold = 0)
-
-        totalIts += optimizer.iteration
-        # Set init points to 0 for future iterations
-        init = 0
+    def __init__(self,y,tags,maxIts,tol,weight = [], scale = [], **extraParams):
+        # Save original tags to pass to Broyden
+        self.broydenTags = copy.deepcopy(tags)
+        super().__init__(y,tags,maxIts,tol,weight = weight, scale = scale, **extraParams)
 
-        print(f'Bayesian {n+1}: {optimizer.iteration}, {optimizer.max["target"]}')
-        results = list(optimizer.max['params'].items())
-        # Check if converged during Bayesian
-        if 1/optimizer.max["target"] < tol:
-            beta = []
-            print('Best result:')
-            for i in range(n):
-                print(f'{results[i][0]} = {results[i][1]}')
-                beta.append(results[i][1])
-            print(f'f(x) = {optimizer.max["target"]}')
+    def start(self):
+        self.init = self.init_points
+        # Iterations are counted as Bayesian evaluations plus Broyden iterations
+        self.broydenIts = 0
+        self.restored = 0
+        self.stage = 0
+        self.phase = 'bayesian'
+        self.stageStart = 0
+        self.broydenStart = []
+        self.broydenBeta = []
+        self.broyden = None
+        resumeBroyden = False
+        if self.resume and optimaCheckpoint.exists(self.checkpoint):
+            state = optimaCheckpoint.load(self.checkpoint)
+            if state['method'] == self.method:
+                self.restore(state)
+                self.stage = state['stage']
+                self.phase = state['phase']
+                self.stageStart = state['stageStart']
+                self.init = state['init']
+                self.broydenIts = state['broydenIts']
+                self.broydenStart = list(state['broydenStart'])
+                resumeBroyden = self.phase == 'broyden'
+                optimaEvents.notify(self.observers, 'message', text = f'Resuming from {self.checkpoint} in stage {self.stage + 1} ({self.phase})')
+        if self.stage >= self.nIterMethods:
+            self.finishCombined()
+        elif self.phase == 'bayesian':
+            self.startBayesian()
+        else:
+            self.startBroyden(resumeBroyden)
 
-            return 1/optimizer.max["target"], totalIts, beta
+    def startBayesian(self):
+        # Evaluations already made in this stage (when resuming) count against its budget
+        stageEvaluations = self.evaluations - self.stageStart
+        initRemaining = max(self.init - stageEvaluations, 0)
+        iterRemaining = self.maxIts - max(stageEvaluations - self.init, 0)
+        self.startStage(initRemaining, iterRemaining, stagnationIterations = 51, stagnationThreshold = 0)
 
+    def startBroyden(self, resumeBroyden = False):
         # Get best guess at tags for Broyden
         i = 0
-        for tag in broydenTags:
-            broydenTags[tag][0] = results[i][1]
-            broydenTags[tag][1] = results[i][1]
+        for tag in self.broydenTags:
+            self.broydenTags[tag][0] = self.broydenStart[i]
+            self.broydenTags[tag][1] = self.broydenStart[i]
             i += 1
 
-        broydenNorm, broydenIterations, broydenBeta = LevenbergMarquardtBroyden(y,broydenTags,functional,maxIts,tol)
+        broydenParams = dict([('observers', self.observers),
+                              ('minConverged', self.failures.minConverged),
+                              ('failurePenalty', self.failures.penalty)])
+        if self.checkpoint:
+            broydenParams['checkpoint'] = f'{self.checkpoint}.broyden'
+            broydenParams['checkpointInterval'] = self.checkpointInterval
+            broydenParams['resume'] = resumeBroyden
+        self.broyden = LevenbergMarquardtBroydenOptimizer(self.y,self.broydenTags,self.maxIts,self.tol,**broydenParams)
+
+    def ask(self):
+        betas = []
+        while not self.done and len(betas) == 0:
+            if self.phase == 'broyden':
+                betas = self.broyden.ask()
+                if self.broyden.done:
+                    self.finishBroyden()
+                elif len(betas) == 0:
+                    break
+            else:
+                betas = self.askStage()
+                if self.stageDone and len(self.outstanding) == 0:
+                    self.finishStage()
+                elif len(betas) == 0:
+                    break
+        return betas
+
+    def tell(self, beta, f):
+        if self.phase == 'broyden':
+            self.broyden.tell(beta, f)
+        else:
+            super().tell(beta, f)
+
+    # End of a Bayesian phase
+    def finishStage(self):
+        bayesianIterations = self.evaluations - self.stageStart
+
+        # Set init points to 0 for future iterations
+        self.init = 0
+
+        best = self.best()
+        if best is None:
+            optimaEvents.notify(self.observers, 'message', text = 'No successful evaluations')
+            self.done = True
+            return
+        bestTags, beta, target = best
+        optimaEvents.notify(self.observers, 'message', text = f'Bayesian {self.stage+1}: {bayesianIterations}, {target}')
+        # Check if converged during Bayesian
+        if 1/target < self.tol:
+            optimaEvents.notify(self.observers, 'best', method = self.method, tags = bestTags, beta = beta, target = target)
+            self.result = (1/target, self.evaluations + self.broydenIts, beta)
+            self.done = True
+            return
 
-        totalIts += broydenIterations
+        self.broydenStart = beta
+        self.phase = 'broyden'
+        if self.checkpoint:
+            # The Broyden phase of an earlier stage left its checkpoint behind, which must not be resumed in this one
+            optimaCheckpoint.remove(f'{self.checkpoint}.broyden')
+            self.saveCheckpoint()
+        self.startBroyden()
 
-        print(f'Broyden: {broydenIterations}, {broydenNorm}')
+    # End of a Broyden phase
+    def finishBroyden(self):
+        broydenNorm, broydenIterations, self.broydenBeta = self.broyden.result
+        self.broyden = None
+        self.broydenIts += broydenIterations
+
+        optimaEvents.notify(self.observers, 'message', text = f'Broyden: {broydenIterations}, {broydenNorm}')
 
         # Check if converged during Broyden
-        if broydenNorm < tol:
-            return broydenNorm, totalIts, broydenBeta
+        if broydenNorm < self.tol:
+            self.result = (broydenNorm, self.evaluations + self.broydenIts, self.broydenBeta)
+            self.done = True
+            return
+
+        self.phase = 'bayesian'
+        self.stageStart = self.evaluations
+        self.stage += 1
+        if self.checkpoint:
+            self.saveCheckpoint()
+        if self.stage >= self.nIterMethods:
+            self.finishCombined()
+        else:
+            self.startBayesian()
+
+    def finishCombined(self):
+        self.result = (1/self.optimizer.max["target"], self.evaluations + self.broydenIts, self.broydenBeta)
+        self.done = True
+
+    def checkpointState(self):
+        state = super().checkpointState()
+        state.update(dict([('stage', self.stage), ('phase', self.phase), ('stageStart', self.stageStart), ('init', self.init),
+                           ('broydenIts', self.broydenIts), ('broydenStart', self.broydenStart)]))
+        return state
+
+# Continues an interrupted run from the checkpoint file given in extraParams, using the method that wrote it.
+# The remaining arguments must describe the same problem as the interrupted run.
+def Resume(y,tags,functional,maxIts,tol,weight = [], scale = [], **extraParams):
+    checkpoint = None
+    for param, value in extraParams.items():
+        if param == 'checkpoint':
+            checkpoint = value
+    if not optimaCheckpoint.exists(checkpoint):
+        optimaEvents.notify(optimaEvents.getObservers(extraParams), 'message', text = f'No checkpoint to resume from: {checkpoint}')
+        return
+    methods = dict([('LevenbergMarquardtBroyden', LevenbergMarquardtBroyden), ('Bayesian', Bayesian), ('Combined', Combined)])
+    method = methods[optimaCheckpoint.load(checkpoint)['method']]
+    extraParams['resume'] = True
+    return method(y,tags,functional,maxIts,tol,weight = weight, scale = scale, **extraParams)
+
+# Registers the samples saved in a Bayesian checkpoint with optimizer and restores its bounds.
+# Returns the samples as a list of (beta, target) pairs.
+def restoreBayesianSamples(optimizer, tags, state):
+    history = []
+    for beta, target in zip(state['samples'], state['targets']):
+        try:
+            optimizer.register(params = dict(zip(tags, beta)), target = target)
+        except KeyError:
+            # Point already registered
+            pass
+        history.append((list(beta), target))
+    if len(state['bounds']) == len(optimizer.space.keys):
+        optimizer.set_bounds(dict(zip(optimizer.space.keys, state['bounds'])))
+    return history
+
+# Multi-start Levenberg-Marquardt + Broyden
+# Runs independent LevenbergMarquardtBroyden fits from sampled starting points concurrently on worker processes.
+# The first start uses tags as given; later starts draw both initial values uniformly between the two values of each tag.
+# Optional parameters:
+#   starts: number of starts (default: number of processes)
+#   processes: number of worker processes (default: number of cores)
+#   cancelAfter, cancelRatio: a start is cancelled after cancelAfter iterations if its best norm is more than
+#   cancelRatio times the best norm of all starts. All starts are cancelled once any start converges.
+# Other parameters are passed through to LevenbergMarquardtBroyden.
+# Returns the best norm and beta found, with the total number of iterations over all starts.
+def MultiStart(y,tags,functional,maxIts,tol,weight = [], scale = [], **extraParams):
+    import multiprocessing
+    import optimaParallel
+
+    m = len(y)
+    n = len(tags)
+    observers = optimaEvents.getObservers(extraParams)
+    if n == 0:
+        optimaEvents.notify(observers, 'message', text = 'No tags with unknown values')
+        return
+    if m == 0:
+        optimaEvents.notify(observers, 'message', text = 'No validation points')
+        return
+
+    processes = optimaParallel.defaultProcesses()
+    starts = 0
+    cancelAfter = 2 * (n + 1)
+    cancelRatio = 100
+    broydenParams = {}
+    for param, value in extraParams.items():
+        if param == 'processes':
+            processes = value
+        elif param == 'starts':
+            starts = value
+        elif param == 'cancelAfter':
+            cancelAfter = value
+        elif param == 'cancelRatio':
+            cancelRatio = value
+        else:
+            broydenParams[param] = value
+    # As everywhere else, processes < 1 means all cores
+    if processes < 1:
+        processes = optimaParallel.defaultProcesses()
+    if starts < 1:
+        starts = processes
+    if starts < 1:
+        optimaEvents.notify(observers, 'message', text = 'MultiStart needs at least one start')
+        raise OptimaException
+    # Each start runs its own seeding serially; the starts themselves use the workers
+    broydenParams['processes'] = 1
 
-    return 1/optimizer.max["target"], totalIts, broydenBeta
+    # Sample starting points up front so every worker gets a different one
+    startTags = [copy.deepcopy(tags)]
+    for _ in range(starts - 1):
+        sampled = dict([])
+        for tag in tags:
+            low = min(float(tags[tag][0]), float(tags[tag][1]))
+            high = max(float(tags[tag][0]), float(tags[tag][1]))
+            if low == high:
+                # No range given, sample around the single value provided
+                spread = abs(low) if low != 0 else 1
+                low, high = low - 0.1 * spread, high + 0.1 * spread
+            sampled[tag] = [np.random.uniform(low, high), np.random.uniform(low, high)]
+        startTags.append(sampled)
 
+    # Best norm over all starts, shared with the workers
+    context = optimaParallel.forkContext() or multiprocessing
+    globalBest = context.Value('d', np.Inf)
+
+    def cancel(iterations, bestNorm):
+        with globalBest.get_lock():
+            if bestNorm < globalBest.value:
+                globalBest.value = bestNorm
+            best = globalBest.value
+        if best < tol:
+            return True
+        return iterations > cancelAfter and bestNorm > cancelRatio * best
+
+    def runStart(startIndex):
+        optimaEvents.notify(observers, 'message', text = f'Starting run {startIndex + 1} of {starts}')
+        return LevenbergMarquardtBroyden(y,startTags[startIndex],functional,maxIts,tol,weight = weight, scale = scale, cancel = cancel, **broydenParams)
+
+    # What a caching functional learns in each start comes back with it
+    results = optimaParallel.mapWithUpdates(functional, runStart, [(i,) for i in range(starts)], processes)
+
+    bestNorm = np.Inf
+    bestBeta = np.zeros(n)
+    totalIts = 0
+    for startIndex, result in enumerate(results):
+        if isinstance(result, Exception) or result is None:
+            optimaEvents.notify(observers, 'message', text = f'Run {startIndex + 1} failed: {result}')
+            continue
+        norm, iterations, beta = result
+        totalIts += iterations
+        optimaEvents.notify(observers, 'message', text = f'Run {startIndex + 1}: {iterations} iterations, norm {norm}')
+        if norm < bestNorm:
+            bestNorm = norm
+            bestBeta = beta
+    return bestNorm, totalIts, bestBeta
 
 class OptimaException(Exception):
     pass
@@ -0,0 +1,128 @@
+import collections
+import hashlib
+import os
+import sqlite3
+import numpy as np
+import optima
+import optimaEvents
+
+# Memoizing wrapper for a functional(tags, beta) as used by the optima solvers.
+# Entries are keyed on a problem key supplied by the caller (e.g. hashes of database and validation data)
+# together with beta quantized to a number of significant digits.
+# Recent entries are held in memory with LRU eviction; if filename is given, every entry is also
+# written to an SQLite store so that later runs of the same problem can reuse them.
+# Failed evaluations (OptimaException) are cached too, and raise again on a hit.
+# Entries added and counts in forked workers are passed back with takeUpdates/mergeUpdates, which
+# optimaParallel.evaluateConcurrently does, so that report() covers lookups made in every process.
+class EvaluationCache:
+    def __init__(self, functional, problemKey = '', maxEntries = 1024, digits = 12, filename = None):
+        self.functional = functional
+        self.problemKey = problemKey
+        self.maxEntries = maxEntries
+        self.digits = digits
+        self.filename = filename
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.storeHits = 0
+        self.misses = 0
+        self.connection = None
+        self.connectionPid = None
+        # Entries put in memory since takeUpdates
+        self.added = []
+    def __call__(self, tags, beta):
+        key = self.key(tags, beta)
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.result(self.entries[key])
+        value = self.load(key)
+        if value is not None:
+            self.storeHits += 1
+            self.remember(key, value)
+            return self.result(value)
+        self.misses += 1
+        try:
+            f = np.array(self.functional(tags, beta), dtype = float)
+            value = f.tobytes()
+        except optima.OptimaException:
+            value = b''
+        self.remember(key, value)
+        self.save(key, value)
+        return self.result(value)
+    def key(self, tags, beta):
+        quantized = ','.join([f'{float(b):.{self.digits}e}' for b in beta])
+        text = f'{self.problemKey}|{",".join([str(tag) for tag in tags])}|{quantized}'
+        return hashlib.sha1(text.encode()).hexdigest()
+    def result(self, value):
+        # Empty entries record failed evaluations
+        if len(value) == 0:
+            raise optima.OptimaException
+        return np.frombuffer(value, dtype = float).copy()
+    def remember(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        self.added.append((key, value))
+        del self.added[:-self.maxEntries]
+        while len(self.entries) > self.maxEntries:
+            self.entries.popitem(last = False)
+    def connect(self):
+        if not self.filename:
+            return None
+        # SQLite connections can't be shared with forked workers, so open one per process
+        if self.connectionPid != os.getpid():
+            self.connection = sqlite3.connect(self.filename, timeout = 60)
+            self.connection.execute('CREATE TABLE IF NOT EXISTS evaluations (key TEXT PRIMARY KEY, value BLOB)')
+            self.connection.commit()
+            self.connectionPid = os.getpid()
+        return self.connection
+    def load(self, key):
+        connection = self.connect()
+        if connection is None:
+            return None
+        row = connection.execute('SELECT value FROM evaluations WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        return bytes(row[0])
+    def save(self, key, value):
+        connection = self.connect()
+        if connection is None:
+            return
+        connection.execute('INSERT OR REPLACE INTO evaluations (key, value) VALUES (?, ?)', (key, value))
+        connection.commit()
+    def close(self):
+        if self.connection is not None and self.connectionPid == os.getpid():
+            self.connection.close()
+        self.connection = None
+        self.connectionPid = None
+    # Entries and counts gathered since the last call, to pass back from a worker process with mergeUpdates
+    def takeUpdates(self):
+        updates = (self.added, self.hits, self.storeHits, self.misses)
+        self.added = []
+        self.hits = 0
+        self.storeHits = 0
+        self.misses = 0
+        return updates
+    def mergeUpdates(self, updates):
+        added, hits, storeHits, misses = updates
+        # Workers have saved their entries to the store already
+        for key, value in added:
+            self.remember(key, value)
+        self.hits += hits
+        self.storeHits += storeHits
+        self.misses += misses
+    # Sends the counts to observers (see optimaEvents) as a message
+    def report(self, observers):
+        total = self.hits + self.storeHits + self.misses
+        optimaEvents.notify(observers, 'message', text = f'Evaluation cache: {total} requests, {self.hits} memory hits, '
+                                                         f'{self.storeHits} store hits, {self.misses} misses')
+
+# Hash of strings or bytes, e.g. file contents, for building problem keys
+def contentHash(*items):
+    digest = hashlib.sha1()
+    for item in items:
+        if isinstance(item, str):
+            item = item.encode()
+        digest.update(item)
+        # Separate items so that ('ab','c') and ('a','bc') differ
+        digest.update(b'\0')
+    return digest.hexdigest()
@@ -0,0 +1,33 @@
+import os
+import numpy as np
+
+# Checkpoint files for the optima solvers.
+# State is a flat dict of arrays, numbers and strings written as a compressed NumPy .npz archive.
+# Files are written to a temporary name and then renamed, so an interrupted write never replaces a good checkpoint.
+
+def save(filename, **state):
+    temporary = f'{filename}.tmp'
+    with open(temporary, 'wb') as f:
+        np.savez_compressed(f, **dict([(key, np.asarray(value)) for key, value in state.items()]))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, filename)
+
+# Returns the saved state, with 0-d arrays turned back into Python numbers and strings
+def load(filename):
+    state = dict([])
+    with np.load(filename, allow_pickle = False) as data:
+        for key in data.files:
+            value = data[key]
+            if value.ndim == 0:
+                value = value.item()
+            state[key] = value
+    return state
+
+def exists(filename):
+    return bool(filename) and os.path.isfile(filename)
+
+# Removes a checkpoint that no longer applies, if there is one
+def remove(filename):
+    if exists(filename):
+        os.remove(filename)
@@ -0,0 +1,73 @@
+import json
+import time
+import numpy as np
+
+# Progress reporting for the optima solvers.
+# Solvers call notify(observers, event, **data) and every observer's notify(event, data) is called in turn.
+# Events and their data:
+#   iteration: method, iteration, beta, norm, steplength, damping, evaluationTime, linearAlgebraTime
+#              (steplength, damping and linearAlgebraTime are None where a method doesn't use them)
+#   converged: method, iteration, beta, norm
+#   finished:  method, iteration, beta, norm, reason ('maxIterations', 'cancelled' or 'failed')
+#   best:      method, tags, beta, target
+#   message:   text
+# Observers are passed to a solver in the 'observers' entry of extraParams.
+# Without one, a ConsoleObserver is used so that progress is printed as before.
+
+def notify(observers, event, **data):
+    for observer in observers:
+        observer.notify(event, data)
+
+# Observers from extraParams, defaulting to console output
+def getObservers(extraParams):
+    if 'observers' in extraParams.keys():
+        return list(extraParams['observers'])
+    return [ConsoleObserver()]
+
+# Prints progress to screen
+class ConsoleObserver:
+    def notify(self, event, data):
+        if event == 'iteration':
+            print(f'Iteration: {data["iteration"]}')
+            print(f'Current coefficients: {data["beta"]}')
+            print(f'Norm: {data["norm"]}')
+            print()
+        elif event == 'converged':
+            print()
+            print('Converged')
+            print(f'{data["beta"]} after {data["iteration"]}')
+        elif event == 'finished':
+            if data['reason'] == 'maxIterations':
+                print('Reached maximum iterations without converging')
+            elif data['reason'] == 'cancelled':
+                print('Run cancelled')
+        elif event == 'best':
+            print('Best result:')
+            for tag, value in zip(data['tags'], data['beta']):
+                print(f'{tag} = {value}')
+            print(f'f(x) = {data["target"]}')
+        elif event == 'message':
+            print(data['text'])
+
+# Appends one JSON object per event to a file, with the event name and a timestamp
+class JsonLinesObserver:
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, 'a', buffering = 1)
+    def notify(self, event, data):
+        record = dict([('event', event), ('time', time.time())])
+        for key, value in data.items():
+            record[key] = jsonValue(value)
+        self.file.write(json.dumps(record) + '\n')
+    def close(self):
+        self.file.close()
+
+# Converts NumPy values to something json can write
+def jsonValue(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (list, tuple)):
+        return [jsonValue(item) for item in value]
+    return value
@@ -0,0 +1,99 @@
+import concurrent.futures
+import multiprocessing
+import os
+
+# Concurrent execution helpers for the optima solvers.
+# Workers are forked so that the function run (usually a closure over problem data) does not have to be picklable.
+# A functional evaluated concurrently must be safe to do so, i.e. it must not share scratch files between calls.
+
+# Function handed to each worker process when the pool starts
+_function = None
+# Number of processes sharing the cores with this one: a worker of a pool of 4 runs alongside 3 others, so pools it
+# starts in turn (e.g. for the validation sets of an evaluation in a Bayesian batch) get a quarter of the cores
+_sharing = 1
+
+def _initializeWorker(function, sharing):
+    global _function, _sharing
+    _function = function
+    _sharing = sharing
+
+def _call(arguments):
+    return _function(*arguments)
+
+# Number of worker processes to use when none is requested: this process's share of the cores
+def defaultProcesses():
+    return max((os.cpu_count() or 1) // _sharing, 1)
+
+# Context used for pools and shared state, or None if processes can't be forked on this platform
+def forkContext():
+    try:
+        return multiprocessing.get_context('fork')
+    except ValueError:
+        return None
+
+# Returns a pool executor running function, or None if processes can't be forked on this platform
+def createPool(function, processes = 0):
+    if processes < 1:
+        processes = defaultProcesses()
+    context = forkContext()
+    if context is None:
+        return None
+    return concurrent.futures.ProcessPoolExecutor(max_workers = processes,
+                                                  mp_context = context,
+                                                  initializer = _initializeWorker,
+                                                  initargs = (function, _sharing * processes))
+
+# Calls function(*arguments) for each tuple in argumentList, returning results in the same order.
+# An exception raised by a call is returned in place of its result so the caller can decide what a failure means.
+def mapConcurrently(function, argumentList, processes = 0):
+    if processes < 1:
+        processes = defaultProcesses()
+    processes = min(processes, len(argumentList))
+    pool = None
+    if processes > 1:
+        pool = createPool(function, processes)
+    if pool is None:
+        # Serial fallback
+        results = []
+        for arguments in argumentList:
+            try:
+                results.append(function(*arguments))
+            except Exception as e:
+                results.append(e)
+        return results
+    with pool:
+        futures = [pool.submit(_call, arguments) for arguments in argumentList]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(e)
+    return results
+
+# As mapConcurrently, for calls that add to what source holds (e.g. an optimaCache.EvaluationCache).
+# If source has takeUpdates() and mergeUpdates(updates), what each call adds is passed back from its worker
+# and merged into source, which would otherwise lose it with the worker.
+def mapWithUpdates(source, function, argumentList, processes = 0):
+    if not hasattr(source, 'takeUpdates'):
+        return mapConcurrently(function, argumentList, processes)
+    # Set aside what source holds already, so that workers only return what they add
+    pending = source.takeUpdates()
+    def call(*arguments):
+        try:
+            result = function(*arguments)
+        except Exception as e:
+            result = e
+        return result, source.takeUpdates()
+    results = []
+    for result in mapConcurrently(call, argumentList, processes):
+        if not isinstance(result, Exception):
+            result, updates = result
+            source.mergeUpdates(updates)
+        results.append(result)
+    source.mergeUpdates(pending)
+    return results
+
+# Evaluates functional at each beta in betas, returning results (or exceptions) in the same order
+def evaluateConcurrently(functional, tags, betas, processes = 0):
+    return mapWithUpdates(functional, functional, [(tags, beta) for beta in betas], processes)
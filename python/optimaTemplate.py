@@ -0,0 +1,57 @@
+import os
+import re
+
+# Database templates with <tag> placeholders, as used by thermoOptima.
+# A template is parsed once, recording the byte offsets of every placeholder, and can then be rendered with values
+# for any of its tags in a single pass. Placeholders without a value are left as they are.
+# This replaces running one sed substitution per tag over the whole file.
+
+# Same pattern the tag editor uses to find tags, limited to one line like sed
+placeholderPattern = re.compile(rb'<([^>\n]*)>')
+
+class DatabaseTemplate:
+    def __init__(self, text):
+        self.text = text
+        # (start, end, tag) of each placeholder, in order
+        self.offsets = [(match.start(), match.end(), match.group(1).decode()) for match in placeholderPattern.finditer(text)]
+        # Literal text between placeholders: there is always one more piece than placeholders
+        self.pieces = []
+        position = 0
+        for start, end, tag in self.offsets:
+            self.pieces.append(text[position:start])
+            position = end
+        self.pieces.append(text[position:])
+    def tags(self):
+        return list(dict.fromkeys([tag for start, end, tag in self.offsets]))
+    # Filled database as bytes, with values a dict of tag: value
+    def render(self, values):
+        strings = dict([(tag, f'{value}'.encode()) for tag, value in values.items()])
+        chunks = [self.pieces[0]]
+        for (start, end, tag), piece in zip(self.offsets, self.pieces[1:]):
+            if tag in strings:
+                chunks.append(strings[tag])
+            else:
+                chunks.append(self.text[start:end])
+            chunks.append(piece)
+        return b''.join(chunks)
+    def write(self, filename, values):
+        rendered = self.render(values)
+        with open(filename, 'wb') as f:
+            f.write(rendered)
+        forget(filename)
+
+# Compiled templates by filename, reused until the file changes
+templates = dict([])
+
+def load(filename):
+    status = os.stat(filename)
+    key = (status.st_mtime_ns, status.st_size)
+    if filename in templates and templates[filename][0] == key:
+        return templates[filename][1]
+    with open(filename, 'rb') as f:
+        template = DatabaseTemplate(f.read())
+    templates[filename] = (key, template)
+    return template
+
+def forget(filename):
+    templates.pop(filename, None)
@@ -0,0 +1,76 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import optima
+import thermoDatabase
+import thermoOptimaBatch
+
+# Behaviour tests for thermoOptimaBatch.
+# Run with python testBatch.py (or pytest testBatch.py).
+
+repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Project in directory using copies of the example database and validation data, with tags changed by changes
+def writeProject(directory, **changes):
+    shutil.copy(os.path.join(repository, 'kayetest.dat'), directory)
+    shutil.copy(os.path.join(repository, 'combinedPoint+Mixture.json'), directory)
+    project = dict([('datafile', 'kayetest.dat'),
+                    ('tags', dict([('mix 0', dict([('initial', [-1000, -2000]), ('scale', 2.0)])),
+                                   ('mix 1', dict([('initial', [5, 6])])),
+                                   ('bob', dict([('initial', [1, 1]), ('optimize', False)]))])),
+                    ('validation', 'combinedPoint+Mixture.json'),
+                    ('method', 'Combined'),
+                    ('maxIts', 12),
+                    ('validationProcesses', 2),
+                    ('extraParams', dict([('init_points', 3)]))])
+    project.update(changes)
+    filename = os.path.join(directory, 'project.json')
+    with open(filename, 'w') as f:
+        json.dump(project, f)
+    return filename
+
+def testNoGUI():
+    # The batch runner loads without PySimpleGUI or the GUI's windows
+    script = 'import sys, thermoOptimaBatch; print(any([name in sys.modules for name in ["PySimpleGUI", "dataThermoOptima"]]))'
+    result = subprocess.run([sys.executable, '-c', script], capture_output = True, text = True,
+                            cwd = os.path.dirname(os.path.abspath(__file__)))
+    assert result.returncode == 0 and result.stdout.strip() == 'False'
+
+def testLoadProject():
+    cacheDirectory = thermoDatabase.cacheDirectory
+    with tempfile.TemporaryDirectory() as path:
+        # Database models are cached with the project rather than wherever the tests run
+        thermoDatabase.cacheDirectory = os.path.join(path, 'cache')
+        try:
+            fit = thermoOptimaBatch.loadProject(writeProject(path))
+            # Paths are taken from the project's directory
+            assert fit.datafile == os.path.join(path, 'kayetest.dat')
+            assert fit.method is optima.Combined
+            assert fit.maxIts == 12 and fit.validationProcesses == 2 and fit.extraParams == dict([('init_points', 3)])
+            assert fit.tags['mix 0'] == dict([('initial', [-1000.0, -2000.0]), ('optimize', True), ('scale', 2.0)])
+            assert fit.tags['bob']['optimize'] is False and fit.tags['mix 1']['scale'] == 1.0
+            assert fit.elements == ['Pd', 'Ru', 'Tc', 'Mo']
+            assert [validationSet['type'] for validationSet in fit.validationPoints] == ['mixing', 'point']
+            # Projects that can't be run are refused before anything runs
+            with open(os.path.join(path, 'empty.json'), 'w') as f:
+                f.write('[]')
+            tags = dict([('mix 0', dict([('initial', [1, 2])])), ('mix 1', dict([('initial', [1, 2])]))])
+            for changes in [dict([('method', 'Newton')]), dict([('tags', tags)]), dict([('speed', 'fast')]),
+                            dict([('tags', dict(tags, bob = dict([('initial', [1])])))]),
+                            dict([('datafile', 'missing.dat')]), dict([('validation', ['empty.json'])])]:
+                try:
+                    thermoOptimaBatch.loadProject(writeProject(path, **changes))
+                except optima.OptimaException:
+                    continue
+                assert False, changes
+        finally:
+            thermoDatabase.cacheDirectory = cacheDirectory
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith('test') and callable(test):
+            test()
+            print(f'{name} passed')
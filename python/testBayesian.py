@@ -0,0 +1,93 @@
+import os
+import sys
+import tempfile
+import unittest
+import numpy as np
+import optima
+
+# Behaviour tests for the Bayesian and Combined solvers in optima.
+# These need the BayesianOptimization submodule, and are skipped without it.
+# Run with python testBayesian.py (or pytest testBayesian.py).
+
+# Slightly nonlinear problem with a known solution at beta = [3, -2]
+rng = np.random.default_rng(2)
+A = rng.normal(size = (30, 2))
+trueBeta = np.array([3.0, -2.0])
+
+def curvedValues(tags, beta):
+    f = A @ np.asarray(beta, dtype = float) + 10
+    return f + 0.2 * f**2
+
+y = curvedValues([], trueBeta)
+
+def requireBayesian():
+    # Where optima looks for it
+    sys.path.append('.')
+    try:
+        import BayesianOptimization.bayes_opt
+    except ImportError:
+        raise unittest.SkipTest('BayesianOptimization submodule not available')
+
+def bounds():
+    return dict([('a', [0.0, 5.0]), ('b', [-4.0, 0.0])])
+
+def testBatchedAsk():
+    # Batches hold batch_size distinct new points, outstanding points are not proposed again, and the budget is kept
+    requireBayesian()
+    bayesian = optima.BayesianOptimizer(y, bounds(), 14, 1e-300, init_points = 3, batch_size = 4, observers = [])
+    betas = bayesian.ask()
+    # Startup points first, then proposals for the rest of the batch on the next ask
+    assert len(betas) == 3
+    assert len(bayesian.ask()) == 1
+    assert bayesian.ask() == []
+    evaluated = []
+    while not bayesian.done:
+        for beta in bayesian.outstanding[:]:
+            bayesian.tell(beta[0], curvedValues([], beta[0]))
+            evaluated.append(tuple(beta[0]))
+        betas = bayesian.ask()
+        assert len(betas) <= 4
+        assert len(set([tuple(beta) for beta in betas])) == len(betas)
+        assert not any([tuple(beta) in evaluated for beta in betas])
+    assert len(evaluated) == 14 and len(bayesian.optimizer.space) == 14
+    norm, iterations, beta = bayesian.result
+    assert iterations == 14 and norm == min([1 / bayesian.inverseNorm(curvedValues([], point)) for point in evaluated])
+    # Run on workers, a batched search spends the same budget
+    norm, iterations, beta = optima.Bayesian(y, bounds(), curvedValues, 12, 1e-300, init_points = 4, batch_size = 4,
+                                             processes = 2, observers = [])
+    assert iterations == 12
+
+def testCombinedResumeStage2():
+    # A run stopped as the Broyden phase of stage 2 begins resumes that phase from its start,
+    # not from what the Broyden phase of stage 1 left behind
+    requireBayesian()
+    with tempfile.TemporaryDirectory() as path:
+        checkpoint = os.path.join(path, 'fit.npz')
+        settings = dict([('checkpoint', checkpoint), ('init_points', 3), ('observers', [])])
+        combined = optima.CombinedOptimizer(y, bounds(), 4, 1e-300, **settings)
+        while not combined.done:
+            betas = combined.ask()
+            if combined.stage == 1 and combined.phase == 'broyden':
+                break
+            for beta in betas:
+                combined.tell(beta, curvedValues([], beta))
+        assert combined.stage == 1 and combined.phase == 'broyden'
+        assert not os.path.exists(f'{checkpoint}.broyden')
+        resumed = optima.CombinedOptimizer(y, bounds(), 4, 1e-300, resume = True, **settings)
+        assert resumed.stage == 1 and resumed.phase == 'broyden'
+        assert not resumed.broyden.done and resumed.broyden.iteration == 0
+        assert np.array_equal(resumed.broydenStart, combined.broydenStart)
+        norm, iterations, beta = optima.runOptimizer(resumed, curvedValues)
+        # Every stage ran its Broyden phase in full
+        assert resumed.stage == optima.CombinedOptimizer.nIterMethods
+        assert resumed.broydenIts == 4 * optima.CombinedOptimizer.nIterMethods
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith('test') and callable(test):
+            try:
+                test()
+            except unittest.SkipTest as e:
+                print(f'{name} skipped: {e}')
+                continue
+            print(f'{name} passed')
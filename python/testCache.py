@@ -0,0 +1,86 @@
+import os
+import tempfile
+import numpy as np
+import optima
+import optimaCache
+
+# Behaviour tests for optimaCache.
+# Run with python testCache.py (or pytest testCache.py).
+
+# Functional counting its calls, failing for negative first coefficients
+class CountingValues:
+    def __init__(self):
+        self.calls = 0
+    def __call__(self, tags, beta):
+        self.calls += 1
+        if beta[0] < 0:
+            raise optima.OptimaException
+        return np.array([beta[0] + 2 * beta[1], beta[0] * beta[1]])
+
+def testMemoryHits():
+    # Repeats and points equal to the cache's digits are hits, recent entries are kept and failures raise again
+    values = CountingValues()
+    cache = optimaCache.EvaluationCache(values, 'problem', maxEntries = 2, digits = 6)
+    assert np.array_equal(cache(['a', 'b'], [1.0, 2.0]), [5.0, 2.0])
+    assert np.array_equal(cache(['a', 'b'], [1.0 + 1e-9, 2.0]), [5.0, 2.0])
+    assert values.calls == 1 and cache.hits == 1
+    # A different point or different tags are different entries
+    cache(['a', 'b'], [1.001, 2.0])
+    cache(['a', 'c'], [1.0, 2.0])
+    assert values.calls == 3
+    # [1, 2] was used least recently and is evicted, the other two are held
+    assert len(cache.entries) == 2
+    cache(['a', 'c'], [1.0, 2.0])
+    cache(['a', 'b'], [1.0, 2.0])
+    assert values.calls == 4 and cache.hits == 2
+    for rounds in range(2):
+        try:
+            cache(['a', 'b'], [-1.0, 2.0])
+        except optima.OptimaException:
+            pass
+        else:
+            assert False
+    assert values.calls == 5 and cache.misses == 5 and cache.hits == 3
+    # Results can't be changed through the cache
+    f = cache(['a', 'b'], [1.0, 2.0])
+    f[0] = 0
+    assert cache(['a', 'b'], [1.0, 2.0])[0] == 5.0
+
+def testStore():
+    # Entries stored by one run are found by the next run of the same problem only
+    with tempfile.TemporaryDirectory() as path:
+        filename = os.path.join(path, 'cache.sqlite')
+        values = CountingValues()
+        cache = optimaCache.EvaluationCache(values, optimaCache.contentHash('database', 'validation'), filename = filename)
+        cache(['a', 'b'], [1.0, 2.0])
+        try:
+            cache(['a', 'b'], [-1.0, 2.0])
+        except optima.OptimaException:
+            pass
+        cache.close()
+        cache = optimaCache.EvaluationCache(values, optimaCache.contentHash('database', 'validation'), filename = filename)
+        assert np.array_equal(cache(['a', 'b'], [1.0, 2.0]), [5.0, 2.0])
+        try:
+            cache(['a', 'b'], [-1.0, 2.0])
+        except optima.OptimaException:
+            pass
+        else:
+            assert False
+        assert values.calls == 2 and cache.storeHits == 2 and cache.misses == 0
+        # Then from memory
+        cache(['a', 'b'], [1.0, 2.0])
+        assert cache.hits == 1 and cache.storeHits == 2
+        cache.close()
+        # A changed database or validation data is a different problem
+        for problemKey in [optimaCache.contentHash('database2', 'validation'), optimaCache.contentHash('databasev', 'alidation')]:
+            cache = optimaCache.EvaluationCache(values, problemKey, filename = filename)
+            cache(['a', 'b'], [1.0, 2.0])
+            assert cache.misses == 1 and cache.storeHits == 0
+            cache.close()
+        assert values.calls == 4
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith('test') and callable(test):
+            test()
+            print(f'{name} passed')
@@ -0,0 +1,99 @@
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import thermoDatabase
+
+# Behaviour tests for thermoDatabase models and their cache.
+# Run with python testDatabase.py (or pytest testDatabase.py).
+
+repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Stands in for Thermochimica's ParseDataOnly, counting its runs in a file next to it
+fakeParseDataOnly = '''
+import json, os, sys
+path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+runs = os.path.join(path, 'runs')
+count = int(open(runs).read()) if os.path.exists(runs) else 0
+open(runs, 'w').write(str(count + 1))
+json.dump({'solution phases': {'FCCN': {'species': ['Pd', 'Mo']}}}, open(os.path.join(path, 'phaseLists.json'), 'w'))
+'''
+
+# Counts the databases parsed by load
+class ParseCounter:
+    def __init__(self):
+        self.count = 0
+        self.parseDatabase = thermoDatabase.parseDatabase
+    def __call__(self, text, contentHash):
+        self.count += 1
+        return self.parseDatabase(text, contentHash)
+
+# Forgets what this session has loaded, as a new session would
+def newSession():
+    thermoDatabase.models.clear()
+    thermoDatabase.fileHashes.clear()
+
+def testModelCache():
+    counter = ParseCounter()
+    cacheDirectory = thermoDatabase.cacheDirectory
+    cacheVersion = thermoDatabase.cacheVersion
+    try:
+        thermoDatabase.parseDatabase = counter
+        with tempfile.TemporaryDirectory() as path:
+            thermoDatabase.cacheDirectory = os.path.join(path, 'cache')
+            newSession()
+            datafile = os.path.join(path, 'kayetest.dat')
+            shutil.copy(os.path.join(repository, 'kayetest.dat'), datafile)
+            model = thermoDatabase.load(datafile)
+            assert model.elements == ['Pd', 'Ru', 'Tc', 'Mo'] and model.tags == ['mix 0', 'mix 1', 'bob']
+            assert model.tagPhases == dict([('mix 0', ['FCCN']), ('mix 1', ['FCCN']), ('bob', ['FCCN'])])
+            # Loaded again from memory, and the same contents under another name are the same model
+            copy = os.path.join(path, 'copy.dat')
+            shutil.copy(datafile, copy)
+            assert thermoDatabase.load(datafile) is model and thermoDatabase.load(copy) is model
+            assert counter.count == 1
+            # A later session finds the model in the cache directory
+            newSession()
+            cached = thermoDatabase.load(datafile)
+            assert counter.count == 1 and cached.state() == model.state()
+            # Changed contents are parsed again, and changed back they are the model already known
+            with open(datafile, 'a') as f:
+                f.write('\n')
+            assert thermoDatabase.load(datafile) is not cached and counter.count == 2
+            shutil.copy(copy, datafile)
+            assert thermoDatabase.load(datafile) is cached and counter.count == 2
+            # Cached models of another format version, or damaged ones, are parsed again
+            newSession()
+            thermoDatabase.cacheVersion = cacheVersion + 1
+            assert thermoDatabase.load(datafile).state() == dict(model.state(), version = cacheVersion + 1)
+            assert counter.count == 3
+            newSession()
+            with open(thermoDatabase.cacheFilename(model.contentHash), 'w') as f:
+                f.write('{"version": ')
+            thermoDatabase.load(datafile)
+            assert counter.count == 4
+            # Phase data is filled in once ParseDataOnly has been run, and kept with the model
+            thermochimica_path = os.path.join(path, 'thermochimica')
+            os.makedirs(os.path.join(thermochimica_path, 'bin'))
+            binary = os.path.join(thermochimica_path, 'bin', 'ParseDataOnly')
+            with open(binary, 'w') as f:
+                f.write(f'#!{sys.executable}\n' + fakeParseDataOnly)
+            os.chmod(binary, os.stat(binary).st_mode | stat.S_IEXEC)
+            assert 'FCCN' in thermoDatabase.load(datafile, thermochimica_path).phaseData['solution phases']
+            newSession()
+            assert thermoDatabase.load(datafile, thermochimica_path).phaseData is not None
+            with open(os.path.join(thermochimica_path, 'runs')) as f:
+                assert f.read() == '1'
+            assert counter.count == 4
+    finally:
+        thermoDatabase.parseDatabase = counter.parseDatabase
+        thermoDatabase.cacheDirectory = cacheDirectory
+        thermoDatabase.cacheVersion = cacheVersion
+        newSession()
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith('test') and callable(test):
+            test()
+            print(f'{name} passed')
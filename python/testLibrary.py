@@ -0,0 +1,185 @@
+import os
+import tempfile
+import time
+import numpy as np
+import optima
+import thermochimicaLibrary
+
+# Behaviour tests for the in-process Thermochimica backend, through a fake of Thermochimica's C API.
+# Run with python testLibrary.py (or pytest testLibrary.py).
+
+# Stands in for the loaded Thermochimica library, as far as ThermochimicaLibrary relies on it.
+# The database holds one coefficient, 'A = value'; a calculation gives A * T + the sum of element masses as the moles
+# of any solution phase. As in Thermochimica, every step is skipped while the error code (INFOThermo) is set, and
+# resetThermo clears it along with the state set up for the calculation. Reinitialization data given with
+# setReinitData stays until resetThermoAll, and is used by every calculation that asks for reinitialization.
+# Warm starts at a temperature in failWarm fail, and so do all calculations at one in failAt; calculations at hangAt
+# never return, and ones at crashAt end the process.
+class FakeLibrary:
+    def __init__(self, failWarm = (), failAt = (), hangAt = None, crashAt = None):
+        self.failWarm = set(failWarm)
+        self.failAt = set(failAt)
+        self.hangAt = hangAt
+        self.crashAt = crashAt
+        self.info = 0
+        self.filename = None
+        self.coefficient = None
+        self.reinitRequested = False
+        self.reinit = None
+        self.iterationCount = 0
+        self.resetThermo()
+    def resetThermo(self):
+        self.temperature = None
+        self.masses = dict([])
+        self.result = None
+    def TCAPI_resetThermo(self):
+        self.info = 0
+        self.resetThermo()
+    def TCAPI_resetThermoAll(self):
+        self.TCAPI_resetThermo()
+        self.coefficient = None
+        self.reinit = None
+        self.reinitRequested = False
+    def TCAPI_setThermoFilename(self, filename, length):
+        self.filename = filename.value.decode()
+    def TCAPI_sSParseCSDataFile(self):
+        if self.info != 0:
+            return
+        try:
+            with open(self.filename) as f:
+                self.coefficient = float(f.read().split('=')[1])
+        except (OSError, IndexError, ValueError):
+            self.info = 6
+    def TCAPI_checkInfoThermo(self, info):
+        info._obj.value = self.info
+    def TCAPI_setUnitTemperature(self, unit, length):
+        pass
+    def TCAPI_setUnitPressure(self, unit, length):
+        pass
+    def TCAPI_setUnitMass(self, unit, length):
+        pass
+    def TCAPI_setTemperaturePressure(self, temperature, pressure):
+        self.temperature = temperature._obj.value
+    def TCAPI_setElementMass(self, element, mass):
+        self.masses[element._obj.value] = mass._obj.value
+    def TCAPI_thermochimica(self):
+        if self.info != 0:
+            return
+        if self.temperature is None or self.coefficient is None:
+            self.info = 1
+            return
+        if self.temperature == self.hangAt:
+            time.sleep(600)
+        if self.temperature == self.crashAt:
+            os._exit(1)
+        if self.temperature in self.failAt:
+            self.info = 12
+            return
+        warm = self.reinitRequested and self.reinit is not None
+        if warm and self.temperature in self.failWarm:
+            self.info = 12
+            return
+        self.iterationCount = 3 if warm else 10
+        self.result = self.coefficient * self.temperature + sum(self.masses.values())
+    def TCAPI_getMolesPhase(self, name, length, value, info):
+        if self.result is None:
+            info._obj.value = 1
+            return
+        value._obj.value = self.result
+        info._obj.value = 0
+    def TCAPI_getNumberIterations(self, iterations):
+        iterations._obj.value = self.iterationCount
+    def TCAPI_saveReinitData(self):
+        pass
+    def TCAPI_getReinitDataSizes(self, nElements, nSpecies):
+        nElements._obj.value = 1
+        nSpecies._obj.value = 1
+    def TCAPI_getReinitData(self, assemblage, molesPhase, elementPotential, chemicalPotential, molFraction,
+                            elementsUsed, available):
+        if self.result is None:
+            available._obj.value = 0
+            return
+        molesPhase[0] = self.result
+        available._obj.value = 1
+    def TCAPI_setReinitData(self, nElements, nSpecies, assemblage, molesPhase, elementPotential, chemicalPotential,
+                            molFraction, elementsUsed):
+        self.reinit = molesPhase[0]
+    def TCAPI_setReinitRequested(self, requested):
+        self.reinitRequested = requested._obj.value != 0
+
+# Point validation set at the given temperatures, asking for the moles of a phase
+def pointSet(temperatures):
+    validationSet = dict([('type', 'point')])
+    for i, temperature in enumerate(temperatures):
+        validationSet[str(i)] = dict([('state', [temperature, 1, 0.5, 0.25]),
+                                      ('values', dict([('solution phases', dict([('LIQN', dict([('moles', 0)]))]))]))])
+    return validationSet
+
+def expectedValues(temperatures, coefficient):
+    return np.array([coefficient * temperature + 0.75 for temperature in temperatures])
+
+def backend(library, path, coefficient = 2.0):
+    database = os.path.join(path, 'database.dat')
+    with open(database, 'w') as f:
+        f.write(f'A = {coefficient}\n')
+    thermochimica = thermochimicaLibrary.ThermochimicaLibrary(library, [46, 42], 'K', 'atm', 'moles')
+    thermochimica.parse(database)
+    return thermochimica
+
+def testCalculate():
+    # Values come from the library in validation set order, a state that doesn't converge gives NaN without holding up
+    # the next, and sets asking for values the library can't give are left to RunCalculationList
+    temperatures = [500, 600, 700]
+    library = FakeLibrary(failAt = [600])
+    with tempfile.TemporaryDirectory() as path:
+        thermochimica = backend(library, path, coefficient = 3.0)
+        validationSet = pointSet(temperatures)
+        assert thermochimica.supports(validationSet)
+        f = thermochimica.calculate(validationSet)
+        expected = expectedValues(temperatures, 3.0)
+        expected[1] = np.nan
+        assert np.array_equal(f, expected, equal_nan = True)
+        # A set of both moles and values without a getter, and one of Gibbs energies
+        validationSet['1']['values']['elements'] = dict([('Pd', dict([('element potential', 0)]))])
+        assert not thermochimica.supports(validationSet)
+        assert not thermochimica.supports(dict([('type', 'point'), ('0', dict([('state', [500, 1, 1, 1]),
+                                                ('values', dict([('integral Gibbs energy', 0)]))]))]))
+        # A changed database is parsed again, and one that can't be parsed fails the evaluation
+        database = os.path.join(path, 'database.dat')
+        with open(database, 'w') as f:
+            f.write('A = 4.0\n')
+        thermochimica.parse(database)
+        assert np.array_equal(thermochimica.calculate(pointSet([500])), expectedValues([500], 4.0))
+        with open(database, 'w') as f:
+            f.write('no coefficients\n')
+        try:
+            thermochimica.parse(database)
+        except optima.OptimaException:
+            pass
+        else:
+            assert False
+
+def testWarmStartFallback():
+    # A warm start that fails is calculated again from a cold start, and the state is warm started again after that
+    temperatures = [500, 600, 700]
+    library = FakeLibrary(failWarm = [600])
+    with tempfile.TemporaryDirectory() as path:
+        thermochimica = backend(library, path)
+        assert thermochimica.warmStart
+        validationSet = pointSet(temperatures)
+        assert np.array_equal(thermochimica.calculate(validationSet), expectedValues(temperatures, 2.0))
+        assert thermochimica.takeStatistics().startswith('0 of 3')
+        assert np.array_equal(thermochimica.calculate(validationSet), expectedValues(temperatures, 2.0))
+        statistics = thermochimica.statistics
+        assert statistics['calculations'] == 3 and statistics['warm starts'] == 2
+        # The failed state's data was replaced by that of its cold start
+        assert (600, 1, 0.5, 0.25) in thermochimica.reinitData
+        library.failWarm = set()
+        thermochimica.calculate(validationSet)
+        assert thermochimica.statistics['warm starts'] == 5
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith('test') and callable(test):
+            test()
+            print(f'{name} passed')
@@ -0,0 +1,73 @@
+import io
+import json
+import os
+import tempfile
+import numpy as np
+import optima
+import thermoOutput
+
+# Behaviour tests for reading thermoout.json.
+# Run with python testOutput.py (or pytest testOutput.py).
+
+# Output of four calculations, with numbers of many lengths (and exponents) for reads to split
+outputText = json.dumps(dict([
+    ('2', dict([('integral Gibbs energy', -123456.789012345), ('x', dict([('a', 1.5e-10), ('b', 0.25)]))])),
+    ('3', dict([])),
+    ('4', dict([('integral Gibbs energy', 7), ('solution phases', dict([('LIQN', dict([('moles', -3.0e+21)]))])),
+                ('list', [1, 2.5, [3, 'x']])])),
+    ('5', 1234567.125e-30),
+]), indent = 2)
+
+def testSplitReads():
+    # Every read size gives the same calculations as decoding the whole file, including numbers split between reads
+    expected = list(json.loads(outputText).items())
+    readSize = thermoOutput.readSize
+    try:
+        for size in list(range(1, 40)) + [len(outputText) - 1, len(outputText), len(outputText) + 1]:
+            thermoOutput.readSize = size
+            assert list(thermoOutput.iterateCalculations(io.StringIO(outputText))) == expected
+        thermoOutput.readSize = 3
+        assert list(thermoOutput.iterateCalculations(io.StringIO(' { } '))) == []
+        for malformed in ['[1, 2]', '{"2": 1 "3": 2}', '{"2": 1,']:
+            try:
+                list(thermoOutput.iterateCalculations(io.StringIO(malformed)))
+            except ValueError:
+                continue
+            assert False, malformed
+    finally:
+        thermoOutput.readSize = readSize
+
+def testExtract():
+    # Values come out in validation set order; calculations that failed are NaN and missing ones fail the load
+    validationSet = dict([
+        ('type', 'point'),
+        ('0', dict([('state', []), ('values', dict([('x', dict([('b', 0), ('a', 0)])), ('integral Gibbs energy', 0)]))])),
+        ('1', dict([('state', []), ('values', dict([('integral Gibbs energy', 0)]))])),
+        ('2', dict([('state', []), ('values', dict([('solution phases', dict([('LIQN', dict([('moles', 0)]))]))]))])),
+    ])
+    plan = thermoOutput.ExtractionPlan(validationSet)
+    readSize = thermoOutput.readSize
+    try:
+        thermoOutput.readSize = 5
+        with tempfile.TemporaryDirectory() as path:
+            outputFile = os.path.join(path, 'thermoout.json')
+            with open(outputFile, 'w') as f:
+                f.write(outputText)
+            f = plan.extract(outputFile)
+            assert np.array_equal(f, [0.25, 1.5e-10, -123456.789012345, np.nan, -3.0e+21], equal_nan = True)
+            with open(outputFile, 'w') as f:
+                f.write(outputText[:outputText.index('"4"')].rstrip().rstrip(',') + '}')
+            try:
+                plan.extract(outputFile)
+            except optima.OptimaException:
+                pass
+            else:
+                assert False
+    finally:
+        thermoOutput.readSize = readSize
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith('test') and callable(test):
+            test()
+            print(f'{name} passed')
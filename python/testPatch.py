@@ -0,0 +1,160 @@
+import ctypes
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+import numpy as np
+import optimaTemplate
+import thermochimicaLibrary
+from testLibrary import pointSet
+
+# Behaviour tests for patching coefficients into a parsed database (ThermochimicaLibrary.mapCoefficients and patch).
+# These build a small stand-in for the Thermochimica library with gfortran and a C compiler, so that the coefficients
+# live in allocatable module arrays laid out as gfortran lays out Thermochimica's, and are skipped without them.
+# Run with python testPatch.py (or pytest testPatch.py).
+
+# Coefficient arrays named as in Thermochimica's ModuleParseCS. Tag A is in two places, B in one.
+fakeModule = '''
+module ModuleParseCS
+    implicit none
+    real(8), allocatable :: dGibbsCoeffSpeciesTemp(:,:)
+    real(8), allocatable :: dRegularParamCS(:,:)
+end module ModuleParseCS
+
+subroutine fakeStore(a, b) bind(C, name = 'fakeStore')
+    use iso_c_binding
+    use ModuleParseCS
+    real(c_double), intent(in) :: a, b
+    if (allocated(dGibbsCoeffSpeciesTemp)) deallocate(dGibbsCoeffSpeciesTemp)
+    if (allocated(dRegularParamCS)) deallocate(dRegularParamCS)
+    allocate(dGibbsCoeffSpeciesTemp(2, 3), dRegularParamCS(4, 1))
+    dGibbsCoeffSpeciesTemp = 1d0
+    dGibbsCoeffSpeciesTemp(1, 2) = a
+    dGibbsCoeffSpeciesTemp(2, 3) = b
+    dRegularParamCS = 0.5d0
+    dRegularParamCS(3, 1) = a
+end subroutine fakeStore
+
+subroutine fakeCoefficients(a, b) bind(C, name = 'fakeCoefficients')
+    use iso_c_binding
+    use ModuleParseCS
+    real(c_double), intent(out) :: a, b
+    a = (dGibbsCoeffSpeciesTemp(1, 2) + dRegularParamCS(3, 1)) / 2
+    b = dGibbsCoeffSpeciesTemp(2, 3)
+end subroutine fakeCoefficients
+'''
+
+# The calculation: the moles of any solution phase are A T + B + the sum of element masses. With fakeCopyOnFirst set,
+# the first calculation after parsing copies the coefficients and later ones use the copy, as a library that patching
+# can't work with would.
+fakeAPI = '''
+#include <stdio.h>
+#include <string.h>
+void fakeStore(const double *a, const double *b);
+void fakeCoefficients(double *a, double *b);
+static int info = 0, copyOnFirst = 0, copied = 0;
+static char filename[4096];
+static double temperature = 0, masses = 0, result = 0, copyA = 0, copyB = 0;
+void fakeCopyOnFirst(const int *flag) { copyOnFirst = *flag; }
+void TCAPI_setThermoFilename(const char *name, const int *length) {
+    int n = *length < 4095 ? *length : 4095;
+    memcpy(filename, name, n);
+    filename[n] = 0;
+}
+void TCAPI_sSParseCSDataFile(void) {
+    char line[256], tag[64];
+    double value, a = 0, b = 0;
+    int found = 0;
+    FILE *file;
+    if (info) return;
+    file = fopen(filename, "r");
+    if (!file) { info = 6; return; }
+    while (fgets(line, sizeof line, file)) {
+        if (sscanf(line, " %63s = %lf", tag, &value) != 2) continue;
+        if (strcmp(tag, "A") == 0) { a = value; found |= 1; }
+        if (strcmp(tag, "B") == 0) { b = value; found |= 2; }
+    }
+    fclose(file);
+    if (found != 3) { info = 6; return; }
+    fakeStore(&a, &b);
+    copied = 0;
+}
+void TCAPI_checkInfoThermo(int *value) { *value = info; }
+void TCAPI_setUnitTemperature(const char *unit, const int *length) {}
+void TCAPI_setUnitPressure(const char *unit, const int *length) {}
+void TCAPI_setUnitMass(const char *unit, const int *length) {}
+void TCAPI_setTemperaturePressure(const double *t, const double *p) { temperature = *t; }
+void TCAPI_setElementMass(const int *element, const double *mass) { masses += *mass; }
+void TCAPI_thermochimica(void) {
+    double a, b;
+    if (info) return;
+    if (!copyOnFirst || !copied) fakeCoefficients(&a, &b);
+    if (copyOnFirst) {
+        if (!copied) { copyA = a; copyB = b; copied = 1; }
+        a = copyA;
+        b = copyB;
+    }
+    result = a * temperature + b + masses;
+}
+void TCAPI_getMolesPhase(const char *name, const int *length, double *value, int *status) { *value = result; *status = 0; }
+void TCAPI_resetThermo(void) { info = 0; masses = 0; result = 0; }
+void TCAPI_resetThermoAll(void) { TCAPI_resetThermo(); copied = 0; }
+'''
+
+# Builds the stand-in library in directory and loads it
+def buildLibrary(directory):
+    if shutil.which('gfortran') is None or shutil.which('cc') is None:
+        raise unittest.SkipTest('gfortran and a C compiler are needed to build the test library')
+    for name, text in [('module.f90', fakeModule), ('api.c', fakeAPI)]:
+        with open(os.path.join(directory, name), 'w') as f:
+            f.write(text)
+    library = os.path.join(directory, 'libthermochimica.so')
+    try:
+        subprocess.run(['gfortran', '-fPIC', '-c', 'module.f90'], cwd = directory, check = True)
+        subprocess.run(['cc', '-fPIC', '-c', 'api.c'], cwd = directory, check = True)
+        subprocess.run(['gfortran', '-shared', '-o', library, 'module.o', 'api.o'], cwd = directory, check = True)
+    except subprocess.CalledProcessError as e:
+        raise unittest.SkipTest(f'Could not build the test library: {e}')
+    return ctypes.CDLL(library)
+
+def values(temperatures, A, B):
+    return np.array([A * temperature + B + 0.75 for temperature in temperatures])
+
+def testPatchCoefficients():
+    temperatures = [500, 600]
+    with tempfile.TemporaryDirectory() as path:
+        library = buildLibrary(path)
+        database = os.path.join(path, 'database.dat')
+        with open(database, 'w') as f:
+            f.write('A = <A>\nB = <B>\n')
+        template = optimaTemplate.load(database)
+        tags = dict([('A', [1.0, 2.0]), ('B', [-3.0, -1.0])])
+        validationSet = pointSet(temperatures)
+        thermochimica = thermochimicaLibrary.ThermochimicaLibrary(library, [46, 42], 'K', 'atm', 'moles')
+        # Every place a tag is in is found, in the arrays' memory order
+        assert thermochimica.mapCoefficients(template, tags, validationSet, path)
+        gibbs, regular = thermochimicaLibrary.coefficientArrays[0], thermochimicaLibrary.coefficientArrays[2]
+        assert thermochimica.slots == dict([('A', [(gibbs, 2), (regular, 2)]), ('B', [(gibbs, 5)])])
+        assert not os.path.exists(os.path.join(path, f'optima-probe-{os.getpid()}.dat'))
+        # Patched values give what parsing a database with them would
+        template.write(database, dict([('A', 1.0), ('B', -3.0)]))
+        thermochimica.parse(database)
+        thermochimica.patch(dict([('A', 2.5), ('B', 4.0)]))
+        assert np.allclose(thermochimica.calculate(validationSet), values(temperatures, 2.5, 4.0))
+        thermochimica.patch(dict([('B', -2.0)]))
+        assert np.allclose(thermochimica.calculate(validationSet), values(temperatures, 2.5, -2.0))
+        # A library that doesn't read its arrays again after the first calculation fails the check, and isn't patched
+        library.fakeCopyOnFirst(ctypes.byref(ctypes.c_int(1)))
+        assert not thermochimica.mapCoefficients(template, tags, validationSet, path)
+        assert thermochimica.slots is None
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith('test') and callable(test):
+            try:
+                test()
+            except unittest.SkipTest as e:
+                print(f'{name} skipped: {e}')
+                continue
+            print(f'{name} passed')
@@ -0,0 +1,282 @@
+import contextlib
+import io
+import os
+import tempfile
+import numpy as np
+import optima
+import optimaCache
+import optimaParallel
+
+# Behaviour tests for the solvers in optima.
+# Run with python testSolver.py (or pytest testSolver.py).
+
+# Linear problem with a known solution: f = A beta + 10 at beta = [3, -2]
+rng = np.random.default_rng(1)
+A = rng.normal(size = (40, 2))
+trueBeta = np.array([3.0, -2.0])
+y = A @ trueBeta + 10
+
+def linearValues(tags, beta):
+    return A @ np.asarray(beta, dtype = float) + 10
+
+def testMultiStartAllCores():
+    # processes = 0 means all cores, and has to give at least one start rather than none
+    norm, iterations, beta = optima.MultiStart(y, dict([('a', [1, 1.5]), ('b', [1, 1.5])]), linearValues, 30, 1e-10,
+                                               processes = 0, starts = 0, observers = [])
+    assert iterations > 0
+    assert norm < 1e-10
+    assert np.allclose(beta, trueBeta)
+
+def testMultiStartBest():
+    # Starts spread over a problem with a local minimum (near a = -2) and the solution (a = 2, b = 0) end in either,
+    # and the best of them is returned
+    def values(tags, beta):
+        a, b = beta
+        return np.array([a**2 + b, 0.1 * (a - 2), b])
+    np.random.seed(1)
+    observer = RecordingObserver()
+    norm, iterations, beta = optima.MultiStart(np.array([4.0, 0.0, 0.0]), dict([('a', [-3, 3]), ('b', [-1, 1])]), values,
+                                               50, 1e-12, processes = 2, starts = 6, observers = [observer])
+    norms = [float(data['text'].split('norm ')[1]) for event, data in observer.events
+             if event == 'message' and data['text'].startswith('Run ')]
+    assert len(norms) == 6
+    assert max(norms) > 0.1
+    assert norm == min(norms) and norm < 1e-10
+    assert np.allclose(beta, [2, 0], atol = 1e-6)
+
+def testNestedProcesses():
+    # Pools started by the workers of a pool share the cores between them, rather than each taking all of them
+    cores = os.cpu_count() or 1
+    def nested(i):
+        return optimaParallel.defaultProcesses()
+    outer = optimaParallel.mapConcurrently(nested, [(i,) for i in range(2)], 2)
+    assert optimaParallel.defaultProcesses() == cores
+    if optimaParallel.forkContext() is not None:
+        assert outer == [max(cores // 2, 1)] * 2
+
+def testFiniteDifferenceSeed():
+    # Seeded columns match the analytic Jacobian of f = g + 0.2 g^2 with g = A beta + 10: central differences exactly
+    # (f is quadratic), forward ones to within the curvature over the step
+    def curvedValues(tags, beta):
+        g = A @ np.asarray(beta, dtype = float) + 10
+        return g + 0.2 * g**2
+    target = curvedValues([], trueBeta)
+    beta0 = np.array([2.0, -1.0])
+    g = A @ beta0 + 10
+    # The Broyden matrix approximates -dr/dbeta, with r relative to target
+    analytic = -optima.residualScale * ((1 + 0.4 * g) / np.abs(target))[:,np.newaxis] * A
+    bounds = [[-10, 10], [-10, 10]]
+    for jacobian, tolerance in [('central', 1e-6), ('forward', 0.05)]:
+        points = optima.finiteDifferencePoints(beta0, beta0 + 0.01, bounds, jacobian)
+        assert len(points) == 1 + (2 if jacobian == 'central' else 1) * 2
+        results = [curvedValues([], point) for point in points]
+        beta, r, norm, broydenMatrix = optima.finiteDifferenceSeed(target, points, results, np.ones(2), np.ones(len(target)),
+                                                                   jacobian, 0, [])
+        assert np.array_equal(beta, beta0)
+        assert np.allclose(broydenMatrix.matrix, analytic, rtol = tolerance)
+    # A failed seed point leaves the default column for its coefficient only
+    results[2] = optima.OptimaException()
+    broydenMatrix = optima.finiteDifferenceSeed(target, points, results, np.ones(2), np.ones(len(target)), 'forward', 0, [])[3]
+    assert np.allclose(broydenMatrix.matrix[:,0], analytic[:,0], rtol = 0.05) and np.all(broydenMatrix.matrix[:,1] == 1)
+    # Seeding asks for every seed point at once, and the fit converges from it
+    optimizer = optima.LevenbergMarquardtBroydenOptimizer(y, dict([('a', [1, 1.5]), ('b', [1, 1.5])]), 30, 1e-10,
+                                                          jacobian = 'central', observers = [])
+    betas = optimizer.ask()
+    assert len(betas) == 5
+    for beta in betas:
+        optimizer.tell(beta, linearValues([], beta))
+    norm, iterations, beta = optima.runOptimizer(optimizer, linearValues)
+    assert norm < 1e-10 and np.allclose(beta, trueBeta)
+
+def testAskTell():
+    # Evaluated outside the optimizer, points give the same fit as runOptimizer; results for points that weren't asked
+    # for are ignored, NaN values are masked with the failure penalty, and an evaluation with too few values is retried
+    # with a shorter step
+    tags = dict([('a', [1, 1.5]), ('b', [1, 1.5])])
+    expected = optima.runOptimizer(optima.LevenbergMarquardtBroydenOptimizer(y, tags, 30, 1e-10, observers = []), linearValues)
+    observer = RecordingObserver()
+    optimizer = optima.LevenbergMarquardtBroydenOptimizer(y, tags, 30, 1e-10, observers = [observer], failurePenalty = 5.0)
+    told = 0
+    while not optimizer.done:
+        betas = optimizer.ask()
+        assert len(betas) == 1 and optimizer.ask() == []
+        beta = np.array(betas[0])
+        optimizer.tell(beta + 1, linearValues([], beta))
+        f = linearValues([], beta)
+        told += 1
+        if told == 4:
+            f[:3] = np.nan
+        elif told == 5:
+            f[:20] = np.nan
+        optimizer.tell(beta, f)
+        if told == 4:
+            norm = [data['norm'] for event, data in observer.events if event == 'iteration'][-1]
+            r = (linearValues([], beta) - y) / np.abs(y)
+            assert np.isclose(norm, optima.functionalNorm(r[3:]) + 3 * 5.0)
+        elif told == 5:
+            retry = np.array(optimizer.ask()[0])
+            assert np.allclose(retry, 0.999 * optimizer.betaOld + 0.001 * beta)
+            optimizer.tell(retry, linearValues([], retry))
+    messages = [data['text'] for event, data in observer.events if event == 'message']
+    assert messages.count('Result for a point that was not asked for, ignored') == told
+    norm, iterations, beta = optimizer.result
+    assert norm < 1e-10 and np.allclose(beta, expected[2])
+
+def testMaskedDirection():
+    # A step with failed (NaN) residual rows is the step for the problem without those rows
+    matrix = rng.normal(size = (12, 3))
+    weight = rng.uniform(0.5, 2, size = 12)
+    residual = rng.normal(size = 12)
+    residual[[2, 7, 8]] = np.nan
+    coefficient = rng.normal(size = 3)
+    broydenMatrix = optima.BroydenMatrix(matrix, weight)
+    converged = ~np.isnan(residual)
+    expected = optima.directionVector(residual[converged], matrix[converged], coefficient, 0.1, 1, weight[converged])
+    assert np.allclose(broydenMatrix.direction(residual, coefficient, 0.1, 1), expected)
+    # The factor of the full Gram matrix is still the one used without failures
+    residual[[2, 7, 8]] = 1.0
+    expected = optima.directionVector(residual, matrix, coefficient, 0.1, 1, weight)
+    assert np.allclose(broydenMatrix.direction(residual, coefficient, 0.1, 1), expected)
+
+def testMaskedUpdate():
+    # Rows without a change in residual are left as they are by a Broyden update
+    matrix = rng.normal(size = (6, 2))
+    broydenMatrix = optima.BroydenMatrix(matrix, np.ones(6))
+    dependent = rng.normal(size = 6)
+    dependent[4] = np.nan
+    broydenMatrix.update(dependent, np.array([0.5, -1.0]))
+    assert np.array_equal(broydenMatrix.matrix[4], matrix[4])
+    assert not np.array_equal(broydenMatrix.matrix[0], matrix[0])
+    assert np.allclose(broydenMatrix.gram, broydenMatrix.matrix.T @ broydenMatrix.matrix)
+
+def testFailurePolicy():
+    failures = optima.FailurePolicy(minConverged = 0.75, penalty = 2.0)
+    f = np.arange(8, dtype = float)
+    assert not isinstance(failures.check(f, []), Exception)
+    f[:2] = np.nan
+    assert not isinstance(failures.check(f, []), Exception)
+    f[2] = np.nan
+    assert isinstance(failures.check(f, []), optima.OptimaException)
+    assert isinstance(failures.check(np.full(4, np.nan), []), optima.OptimaException)
+    # Each failed value adds the penalty to the norm, or the norm is scaled up to all values
+    residual = np.array([1.0, np.nan, 2.0, np.nan])
+    assert failures.norm(residual) == 5.0 + 2 * 2.0
+    assert optima.FailurePolicy(penalty = 'rescale').norm(residual) == 5.0 * 4 / 2
+    assert failures.norm(np.array([1.0, 2.0])) == optima.functionalNorm(np.array([1.0, 2.0]))
+
+def testMaskedFit():
+    # Some evaluations lose a few values and one loses most; the fit still converges to the solution
+    calls = [0]
+    def values(tags, beta):
+        calls[0] += 1
+        f = linearValues(tags, beta)
+        if calls[0] % 2 == 0:
+            f[[calls[0] % 40, (calls[0] * 7) % 40]] = np.nan
+        if calls[0] == 3:
+            f[:30] = np.nan
+        return f
+    for damping in ['schedule', 'adaptive']:
+        calls[0] = 0
+        norm, iterations, beta = optima.LevenbergMarquardtBroyden(y, dict([('a', [1, 1.5]), ('b', [1, 1.5])]), values, 60, 1e-10,
+                                                                  damping = damping, observers = [])
+        assert calls[0] > 4
+        assert norm < 1e-10
+        assert np.allclose(beta, trueBeta)
+
+def testCacheWorkers():
+    # Entries and counts of evaluations in worker processes make it back to the cache
+    def values(tags, beta):
+        if beta[0] < 0:
+            raise optima.OptimaException
+        return linearValues(tags, beta)
+    cache = optimaCache.EvaluationCache(values)
+    betas = [[1.0, 2.0], [3.0, -2.0], [-1.0, 0.0], [0.5, 0.5]]
+    for rounds in range(2):
+        results = optimaParallel.evaluateConcurrently(cache, ['a', 'b'], betas, 3)
+        assert isinstance(results[2], optima.OptimaException)
+        assert np.allclose(results[1], y)
+        assert cache.misses == 4 and cache.hits == 4 * rounds
+    # The workers of the second round found everything the workers of the first added
+    assert len(cache.entries) == 4
+    assert np.allclose(cache(['a', 'b'], betas[0]), linearValues([], betas[0]))
+    assert cache.hits == 5
+
+# Keeps the events a solver sends
+class RecordingObserver:
+    def __init__(self):
+        self.events = []
+    def notify(self, event, data):
+        self.events.append((event, data))
+
+def testSolverMessages():
+    # A direction that can't be solved for, and the cache counts, go to observers rather than straight to the console
+    broydenMatrix = optima.BroydenMatrix(np.full((4, 2), np.inf), np.ones(4))
+    try:
+        broydenMatrix.direction(np.ones(4), np.zeros(2), 0.1, 1)
+    except optima.OptimaException as e:
+        assert str(e) == optima.linearSolveMessage
+    else:
+        assert False
+    observer = RecordingObserver()
+    direction = optima.BroydenMatrix.direction
+    def failingDirection(self, residual, coefficient, l, steplength):
+        raise optima.OptimaException(optima.linearSolveMessage)
+    output = io.StringIO()
+    try:
+        optima.BroydenMatrix.direction = failingDirection
+        cache = optimaCache.EvaluationCache(linearValues)
+        with contextlib.redirect_stdout(output):
+            optima.LevenbergMarquardtBroyden(y, dict([('a', [1, 1.5]), ('b', [1, 1.5])]), cache, 30, 1e-10,
+                                             observers = [observer])
+            cache.report([observer])
+    finally:
+        optima.BroydenMatrix.direction = direction
+    assert output.getvalue() == ''
+    messages = [data['text'] for event, data in observer.events if event == 'message']
+    assert messages[0] == optima.linearSolveMessage and messages[1].startswith('Evaluation cache: 3 requests')
+    assert [data['reason'] for event, data in observer.events if event == 'finished'] == ['failed']
+
+class Interrupted(Exception):
+    pass
+
+def testCheckpointResume():
+    # A run stopped part way and resumed from its checkpoint evaluates the same points as one left to run
+    def curvedValues(tags, beta):
+        f = linearValues(tags, beta)
+        return f + 0.2 * f**2
+    yCurved = curvedValues([], trueBeta)
+    for damping in ['schedule', 'adaptive']:
+        evaluated = []
+        def values(tags, beta):
+            evaluated.append(np.array(beta, dtype = float))
+            return curvedValues(tags, beta)
+        settings = dict([('damping', damping), ('observers', [])])
+        full = optima.LevenbergMarquardtBroyden(yCurved, dict([('a', [1, 1.5]), ('b', [1, 1.5])]), values, 30, 1e-10, **settings)
+        fullPoints = evaluated
+        assert len(fullPoints) > 6
+        with tempfile.TemporaryDirectory() as path:
+            checkpoint = os.path.join(path, 'fit.npz')
+            evaluated = []
+            def interrupted(tags, beta):
+                if len(evaluated) == 5:
+                    raise Interrupted
+                return values(tags, beta)
+            try:
+                optima.LevenbergMarquardtBroyden(yCurved, dict([('a', [1, 1.5]), ('b', [1, 1.5])]), interrupted, 30, 1e-10,
+                                                 checkpoint = checkpoint, **settings)
+            except Interrupted:
+                pass
+            else:
+                assert False
+            resumed = optima.Resume(yCurved, dict([('a', [1, 1.5]), ('b', [1, 1.5])]), values, 30, 1e-10,
+                                    checkpoint = checkpoint, **settings)
+        assert len(evaluated) == len(fullPoints)
+        assert all([np.array_equal(a, b) for a, b in zip(evaluated, fullPoints)])
+        assert resumed[0] == full[0] and resumed[1] == full[1]
+        assert np.array_equal(resumed[2], full[2])
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith('test') and callable(test):
+            test()
+            print(f'{name} passed')
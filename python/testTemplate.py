@@ -0,0 +1,65 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import optimaTemplate
+
+# Behaviour tests for optimaTemplate.
+# Run with python testTemplate.py (or pytest testTemplate.py).
+
+# Database-like text with repeated tags, several on one line, a tag that is a prefix of another, a tag without a value
+# and an angle bracket pair across lines
+templateText = ''' System <A>
+   4  1  <A>  <B>  <AB>
+ <B><B>  -<A>
+ <C> left alone, as is < this
+ > and <>
+'''
+
+values = dict([('A', -12.5), ('B', 3e-07), ('AB', 1234567.0)])
+
+# The old way: one sed substitution per tag on a copy of the file
+def sedRender(filename, values):
+    with tempfile.TemporaryDirectory() as path:
+        copy = os.path.join(path, 'optima.dat')
+        shutil.copy(filename, copy)
+        for tag, value in values.items():
+            subprocess.call(['sed', '-i', '-e', f's/<{tag}>/{value}/g', copy])
+        with open(copy, 'rb') as f:
+            return f.read()
+
+def testRenderMatchesSed():
+    with tempfile.TemporaryDirectory() as path:
+        filename = os.path.join(path, 'database.dat')
+        with open(filename, 'w') as f:
+            f.write(templateText)
+        template = optimaTemplate.load(filename)
+        assert template.tags() == ['A', 'B', 'AB', 'C', '']
+        rendered = template.render(values)
+        if shutil.which('sed') is not None:
+            assert rendered == sedRender(filename, values)
+        assert rendered.startswith(b' System -12.5\n   4  1  -12.5  3e-07  1234567.0\n 3e-073e-07  --12.5\n <C>')
+        # Partial values leave the other tags for a later fill, as createIntermediateDat does
+        intermediate = os.path.join(path, 'optima-inter.dat')
+        template.write(intermediate, dict([('B', values['B'])]))
+        assert optimaTemplate.load(intermediate).render(values) == rendered
+
+def testLoadReuse():
+    # A template is compiled once, and again when its file changes
+    with tempfile.TemporaryDirectory() as path:
+        filename = os.path.join(path, 'database.dat')
+        with open(filename, 'w') as f:
+            f.write(templateText)
+        template = optimaTemplate.load(filename)
+        assert optimaTemplate.load(filename) is template
+        with open(filename, 'w') as f:
+            f.write(templateText + ' <D>\n')
+        changed = optimaTemplate.load(filename)
+        assert changed is not template
+        assert 'D' in changed.tags()
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith('test') and callable(test):
+            test()
+            print(f'{name} passed')
@@ -0,0 +1,306 @@
+import os
+import stat
+import sys
+import tempfile
+import numpy as np
+import optimaTemplate
+import thermoDatabase
+import thermoOptima
+import thermoValidation
+
+# Behaviour tests for evaluateValidation, through a fake RunCalculationList.
+# Run with python testValidation.py (or pytest testValidation.py).
+
+# Stands in for Thermochimica's RunCalculationList: reads coefficients A and B from the database and gives each state
+# (T, P, a, b) values that depend on the state and coefficients, so that values out of order or from the wrong
+# database show up. The Gibbs energy T + A a + B b + C a b T^2 has a mixing term, for MixingPlan to derive from. Reads the nCalc state lines after nCalc, and fails without output if there are fewer.
+# Writes to the file given by 'json out' if present, else to outputs/thermoout.json. States at T = 777 hang.
+fakeRunCalculationList = '''
+import json, os, re, sys, time
+path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+text = open(sys.argv[1]).read()
+database = re.search(r'data file\\s*=\\s*(.*)', text).group(1).strip()
+coefficients = dict(re.findall(r'(\\w+) = (\\S+)', open(database).read()))
+A, B = float(coefficients['A']), float(coefficients['B'])
+C = %r
+lines = [line for line in text.splitlines() if line.strip()]
+start = [i for i in range(len(lines)) if re.match(r'^nCalc\\s*=', lines[i])][0]
+nCalc = int(lines[start].split('=')[1])
+if len(lines) - start - 1 < nCalc or not all([re.match(r'^[0-9.\\se+-]+$', line) for line in lines[start + 1:start + 1 + nCalc]]):
+    sys.exit(1)
+states = [[float(v) for v in line.split()] for line in lines[start + 1:start + 1 + nCalc]]
+if any([state[0] == 777 for state in states]):
+    time.sleep(60)
+output = re.search(r'json out\\s*=\\s*(.*)', text)
+output = output.group(1).strip() if output else os.path.join(path, 'outputs', 'thermoout.json')
+data = dict([(str(i + 2), {'integral Gibbs energy': T + A * a + B * b + C * a * b * T**2, 'x': {'a': A * a, 'b': B * b / T}})
+             for i, (T, P, a, b) in enumerate(states)])
+with open(output, 'w') as f:
+    json.dump(data, f)
+'''
+
+# Mixing coefficient of the fake's Gibbs energy
+C = 1e-3
+
+def fakeThermochimica(directory):
+    os.makedirs(os.path.join(directory, 'bin'))
+    os.makedirs(os.path.join(directory, 'outputs'))
+    binary = os.path.join(directory, 'bin', 'RunCalculationList')
+    with open(binary, 'w') as f:
+        f.write(f'#!{sys.executable}\n' + fakeRunCalculationList % C)
+    os.chmod(binary, os.stat(binary).st_mode | stat.S_IEXEC)
+    database = os.path.join(directory, 'database.dat')
+    with open(database, 'w') as f:
+        f.write('A = <A>\nB = <B>\n')
+    return optimaTemplate.load(database)
+
+# Point validation set of n states and its input; every other point only asks for the Gibbs energy
+def pointSet(rng, n, temperatures = None, amounts = None):
+    validationSet = dict([('type', 'point')])
+    lines = []
+    for i in range(n):
+        state = [float(rng.integers(300, 2000)), 1.0, float(rng.random()), float(rng.random())]
+        if temperatures is not None:
+            state[0] = temperatures[i]
+        if amounts is not None:
+            state[2:] = amounts[i]
+        values = dict([('integral Gibbs energy', 0)])
+        if i % 2 == 0:
+            values['x'] = dict([('a', 0), ('b', 0)])
+        validationSet[str(i)] = dict([('state', state), ('values', values)])
+        lines.append(' '.join([f'{value}' for value in state]))
+    return validationSet, 'data file = x\nnCalc = ' + f'{n}\n' + '\n'.join(lines) + '\n'
+
+# Values expected from fakeRunCalculationList
+def expectedValues(validationSet, A, B):
+    f = []
+    for key in validationSet.keys():
+        if key == 'type':
+            continue
+        T, P, a, b = validationSet[key]['state']
+        values = validationSet[key]['values']
+        f.append(T + A * a + B * b + C * a * b * T**2)
+        if 'x' in values:
+            f.extend([A * a, B * b / T])
+    return f
+
+def evaluate(path, template, sets, beta, **settings):
+    validation = [validationSet for validationSet, inputText in sets]
+    inputTexts = [inputText for validationSet, inputText in sets]
+    return thermoValidation.evaluateValidation(template, validation, inputTexts, dict([('A', [1]), ('B', [2])]), beta,
+                                               path, scratchRoot = path, **settings)
+
+def testChunkedValues():
+    # Serial, ordered, chunked and chunked and ordered evaluations all give the values in the original order
+    rng = np.random.default_rng(3)
+    with tempfile.TemporaryDirectory() as path:
+        template = fakeThermochimica(path)
+        sets = [pointSet(rng, 13), pointSet(rng, 2), pointSet(rng, 6)]
+        beta = [1.5, -2.0]
+        expected = np.concatenate([expectedValues(validationSet, *beta) for validationSet, inputText in sets])
+        outputKeyword = thermoValidation.outputKeyword
+        try:
+            for keyword in [None, 'json out']:
+                thermoValidation.outputKeyword = keyword
+                for processes in [1, 3]:
+                    for order in [False, True]:
+                        planner = thermoValidation.ChunkPlanner()
+                        limits = thermoValidation.RunLimits()
+                        f = evaluate(path, template, sets, beta, processes = processes, orderCalculations = order,
+                                     planner = planner, limits = limits)
+                        assert np.allclose(f, expected)
+                        # Sets are only split with somewhere of their own to write
+                        chunked = keyword is not None and processes > 1
+                        assert limits.counts['runs'] == (3 + 2 + 3 if chunked else 3)
+        finally:
+            thermoValidation.outputKeyword = outputKeyword
+
+def testSplitParts():
+    # Chunks keep type first and their points in order, and together hold every point once
+    rng = np.random.default_rng(4)
+    validationSet, inputText = pointSet(rng, 10)
+    parts = thermoValidation.splitParts(validationSet, inputText, 3)
+    assert len(parts) == 3
+    keys = []
+    for part, text in parts:
+        assert list(part.keys())[0] == 'type'
+        lines = thermoValidation.calculationLines(part, text)
+        assert lines is not None
+        keys.extend([key for key in part.keys() if key != 'type'])
+        states = [[float(value) for value in line.split()] for line in lines[1]]
+        assert states == [part[key]['state'] for key in part.keys() if key != 'type']
+    assert keys == [key for key in validationSet.keys() if key != 'type']
+    # More chunks than points gives one point per chunk, and an input that can't be split stays whole
+    assert len(thermoValidation.splitParts(validationSet, inputText, 20)) == 10
+    assert thermoValidation.splitParts(validationSet, 'nCalc = 10\n', 3) == [(validationSet, 'nCalc = 10\n')]
+
+def testWrittenInput():
+    # Inputs written for the validation data give nCalc as their number of states, as the lists derived from them do
+    rng = np.random.default_rng(8)
+    validationSet, inputText = pointSet(rng, 4)
+    fit = thermoOptima.ThermochimicaFit()
+    fit.elements = ['Pd', 'Ru']
+    fit.validationPoints = [validationSet]
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as path:
+        try:
+            os.chdir(path)
+            fit.writeFile()
+            with open('validationPoints-0.ti') as f:
+                written = f.read()
+        finally:
+            os.chdir(cwd)
+    header, stateLines = thermoValidation.calculationLines(validationSet, written)
+    assert len(stateLines) == 4 and 'nCalc             = 4\n' in written
+    for part, text in thermoValidation.splitParts(validationSet, written, 3):
+        assert thermoValidation.calculationLines(part, text) is not None
+    # A count that doesn't match the states isn't split or reordered
+    miscounted = written.replace('= 4\n', '= 5\n')
+    assert thermoValidation.calculationLines(validationSet, miscounted) is None
+
+def testOrderPointSet():
+    # The ordered set runs its states along a shorter path, and its permutation takes its values back to the original order
+    rng = np.random.default_rng(5)
+    validationSet, inputText = pointSet(rng, 15)
+    orderedSet, orderedText, permutation = thermoValidation.orderPointSet(validationSet, inputText)
+    assert list(orderedSet.keys())[0] == 'type'
+    assert sorted(orderedSet.keys()) == sorted(validationSet.keys())
+    header, stateLines = thermoValidation.calculationLines(orderedSet, orderedText)
+    states = [[float(value) for value in line.split()] for line in stateLines]
+    assert states == [orderedSet[key]['state'] for key in orderedSet.keys() if key != 'type']
+    originalStates = [validationSet[key]['state'] for key in validationSet.keys() if key != 'type']
+    order = thermoValidation.calculationOrder(originalStates)
+    assert thermoValidation.pathLength(originalStates, order) <= thermoValidation.pathLength(originalStates, np.arange(15))
+    assert states[0][0] == min([state[0] for state in originalStates])
+    orderedValues = np.array(expectedValues(orderedSet, 2.0, 3.0))
+    assert np.array_equal(orderedValues[permutation], expectedValues(validationSet, 2.0, 3.0))
+    # The same set is ordered once, and an input that can't be ordered is left alone
+    assert thermoValidation.orderPointSet(validationSet, inputText)[2] is permutation
+    assert thermoValidation.orderPointSet(validationSet, 'nCalc = 15\n') == (validationSet, 'nCalc = 15\n', None)
+
+def testHangingState():
+    # A state that never finishes is found by splitting its run, and only its values are NaN
+    rng = np.random.default_rng(6)
+    with tempfile.TemporaryDirectory() as path:
+        template = fakeThermochimica(path)
+        sets = [pointSet(rng, 5, temperatures = [500, 600, 777, 800, 900]), pointSet(rng, 3)]
+        beta = [1.0, 2.0]
+        expected = np.concatenate([expectedValues(validationSet, *beta) for validationSet, inputText in sets])
+        # The third state of the first set has values 4 to 6, after three of the first state and one of the second
+        failed = np.zeros(len(expected), dtype = bool)
+        failed[4:7] = True
+        limits = thermoValidation.RunLimits(startup = 0.5, calculation = 0.25, retries = 1)
+        f = evaluate(path, template, sets, beta, processes = 2, limits = limits)
+        assert np.array_equal(np.isnan(f), failed)
+        assert np.allclose(np.array(f)[~failed], expected[~failed])
+        # The set times out twice, then states 0-2 (split into 0-1 and 2) and 3-4 run, and state 2 times out on its own
+        counts = limits.takeCounts()
+        assert counts['failed states'] == 1
+        assert counts['retries'] == 1
+        assert counts['runs'] == 7 and counts['timeouts'] == 4
+        # Without isolation the whole set fails
+        limits = thermoValidation.RunLimits(startup = 0.5, calculation = 0.25, retries = 0, isolate = False)
+        f = evaluate(path, template, sets, beta, processes = 2, limits = limits)
+        assert np.all(np.isnan(f[:len(expectedValues(sets[0][0], *beta))]))
+        assert limits.counts['failed states'] == 5
+
+def testMixingPlan():
+    # Mixing properties derived from the Gibbs energies of the planned states match those of the fake's Gibbs energy:
+    # along a = 1 - x, b = x, G mixes as C x (1 - x) T^2, so S mixes as -2 C x (1 - x) T and H = G + TS as -C x (1 - x) T^2
+    mixtures = [0.25, 0.5, 0.8]
+    point = dict([('temperature', 900), ('phase', 'LIQN'), ('endpoints', [dict([('H', 1)]), dict([('He', 1)])]),
+                  ('mixtures', mixtures), ('properties', ['integral Gibbs energy', 'enthalpy', 'entropy'])])
+    # Points at the same temperature share their states, also across sets and units
+    celsius = dict(point)
+    celsius['temperature'] = 900 - 273.15
+    celsius['tunit'] = 'C'
+    mixingSet = dict([('type', 'mixing'), ('0', point), ('1', dict(point)), ('2', dict(point, temperature = 1200))])
+    validation = [mixingSet, dict([('type', 'mixing'), ('0', celsius)])]
+    plan = thermoValidation.mixingPlan(validation)
+    assert plan.sets == [0, 1] and len(plan.groups) == 1
+    # Endpoints and mixtures, each at T - 1, T and T + 1, at 900 K and 1200 K
+    assert len(plan.states[0]) == 2 * 5 * 3
+    assert thermoValidation.mixingPlan(validation) is plan
+    pointSet, text = plan.calculationLists()[0]
+    assert thermoValidation.calculationLines(pointSet, text) is not None
+    beta = [2.0, -3.0]
+    with tempfile.TemporaryDirectory() as path:
+        template = fakeThermochimica(path)
+        f = thermoValidation.evaluateValidation(template, validation, [None, None], dict([('A', [1]), ('B', [2])]), beta,
+                                                path, scratchRoot = path)
+    x = np.array(mixtures)
+    expected = []
+    for T in [900, 900, 1200, 900]:
+        expected.extend(C * x * (1 - x) * T**2)
+        expected.extend(-C * x * (1 - x) * T**2)
+        expected.extend(-2 * C * x * (1 - x) * T)
+    assert np.allclose(f, expected, rtol = 1e-6, atol = 1e-9)
+
+# Tag A is in a phase of element a only, B in one of b only; a third phase has both
+model = thermoDatabase.DatabaseModel('', ['a', 'b'], ['A', 'B'], dict([('A', [0]), ('B', [1])]),
+                                     phases = dict([('APhase', [['a']]), ('BPhase', [['b']]), ('ABPhase', [['a', 'b']])]),
+                                     tagPhases = dict([('A', ['APhase']), ('B', ['BPhase'])]))
+
+def testDependencyIndex():
+    index = thermoValidation.DependencyIndex(model, ['a', 'b'])
+    assert index.phases(['A']) == set(['APhase'])
+    assert index.phases(['A', 'B']) == set(['APhase', 'BPhase'])
+    assert index.phases(['A', 'C']) is None
+    assert index.pointPhases([1000, 1, 0.5, 0]) == set(['APhase'])
+    assert index.pointPhases([1000, 1, 0, 0.5]) == set(['BPhase'])
+    assert index.pointPhases([1000, 1, 0.5, 0.5]) == set(['APhase', 'BPhase', 'ABPhase'])
+
+def testPreviousEvaluation():
+    # After a change to B, only points with some b are calculated again, and values match a full evaluation
+    rng = np.random.default_rng(7)
+    amounts = [[1, 0], [0, 1], [0.5, 0.5], [1, 0], [0.2, 0], [0, 0.3]]
+    with tempfile.TemporaryDirectory() as path:
+        template = fakeThermochimica(path)
+        sets = [pointSet(rng, 6, amounts = amounts), pointSet(rng, 2, amounts = [[1, 0], [2, 0]])]
+        # Previous values are only used for the same validation data
+        validation = [validationSet for validationSet, inputText in sets]
+        inputTexts = [inputText for validationSet, inputText in sets]
+        previous = thermoValidation.PreviousEvaluation(thermoValidation.DependencyIndex(model, ['a', 'b']))
+        for beta, calculated in [([1.0, 2.0], 8), ([1.0, 3.0], 3), ([1.0, 3.0], 0), ([4.0, 3.0], 6)]:
+            f = thermoValidation.evaluateValidation(template, validation, inputTexts, dict([('A', [1]), ('B', [2])]), beta,
+                                                    path, scratchRoot = path, previous = previous)
+            assert np.allclose(f, np.concatenate([expectedValues(validationSet, *beta) for validationSet, inputText in sets]))
+            counts = previous.counts
+            assert counts['calculated'] == calculated and counts['reused'] == 8 - calculated
+            previous.takeStatistics()
+        # The subset of points calculated again is a set of its own, with its states in order
+        validationSet, inputText = sets[0]
+        keep = previous.keep(0, validationSet, set(['BPhase']))
+        assert keep == (True, False, False, True, True, False)
+        subset, text = previous.subset(0, validationSet, inputText, keep)
+        assert list(subset.keys()) == ['type', '1', '2', '5']
+        header, stateLines = thermoValidation.calculationLines(subset, text)
+        assert [[float(value) for value in line.split()] for line in stateLines] == [subset[key]['state'] for key in ['1', '2', '5']]
+        assert previous.subset(0, validationSet, inputText, keep)[0] is subset
+
+def testFailedNotReused():
+    # A point that didn't finish in time is calculated again, even where the tags changed since can't affect it
+    rng = np.random.default_rng(9)
+    amounts = [[1, 0], [1, 0], [0, 1], [1, 0]]
+    with tempfile.TemporaryDirectory() as path:
+        template = fakeThermochimica(path)
+        validationSet, inputText = pointSet(rng, 4, temperatures = [500, 777, 900, 1000], amounts = amounts)
+        previous = thermoValidation.PreviousEvaluation(thermoValidation.DependencyIndex(model, ['a', 'b']))
+        limits = thermoValidation.RunLimits(startup = 0.5, calculation = 0.25, retries = 0)
+        validation = [validationSet]
+        for beta, calculated in [([1.0, 2.0], 4), ([1.0, 3.0], 2)]:
+            f = thermoValidation.evaluateValidation(template, validation, [inputText], dict([('A', [1]), ('B', [2])]),
+                                                    beta, path, scratchRoot = path, previous = previous, limits = limits)
+            expected = np.array(expectedValues(validationSet, *beta))
+            # The second point's one value follows the first point's three
+            failed = np.zeros(len(expected), dtype = bool)
+            failed[3] = True
+            assert np.array_equal(np.isnan(f), failed) and np.allclose(np.array(f)[~failed], expected[~failed])
+            assert previous.counts['calculated'] == calculated and previous.counts['reused'] == 4 - calculated
+            previous.takeStatistics()
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith('test') and callable(test):
+            test()
+            print(f'{name} passed')
@@ -0,0 +1,85 @@
+import os
+import tempfile
+import time
+import numpy as np
+import optima
+import thermoValidation
+import thermoWorkers
+from testLibrary import FakeLibrary, pointSet, expectedValues, backend
+
+# Behaviour tests for thermoWorkers.WorkerPool, with workers running a fake Thermochimica library.
+# Run with python testWorkers.py (or pytest testWorkers.py).
+
+def testRequestLimits():
+    # A request that hangs is stopped at the limit for its states, and split until only the hanging state is NaN
+    temperatures = [500, 600, 700, 800, 900]
+    library = FakeLibrary(hangAt = 700)
+    with tempfile.TemporaryDirectory() as path:
+        thermochimica = backend(library, path)
+        database = os.path.join(path, 'database.dat')
+        limits = thermoValidation.RunLimits(startup = 0.5, calculation = 0.25, retries = 1)
+        pool = thermoWorkers.WorkerPool(thermochimica, 2, limits)
+        try:
+            if not pool.usable():
+                return
+            requests = [('hangs', pointSet(temperatures)), ('other', pointSet([300, 400]))]
+            f = pool.calculate(requests, database)
+            expected = expectedValues(temperatures, 2.0)
+            failed = np.array(temperatures) == 700
+            assert np.array_equal(np.isnan(f[0]), failed)
+            assert np.array_equal(np.array(f[0])[~failed], expected[~failed])
+            assert np.array_equal(f[1], expectedValues([300, 400], 2.0))
+            # The set times out twice, then states 0-2 (split into 0-1 and 2) and 3-4 run, and state 2 times out on its own;
+            # with the other set, that is seven runs
+            counts = limits.takeCounts()
+            assert counts['failed states'] == 1 and counts['retries'] == 1
+            assert counts['runs'] == 7 and counts['timeouts'] == 4
+            # A pool still within the deadline gives its values, and one that goes over it stops the evaluation
+            assert np.array_equal(pool.calculate(requests[1:], database, deadline = time.monotonic() + 60)[0],
+                                  expectedValues([300, 400], 2.0))
+            start = time.monotonic()
+            try:
+                pool.calculate(requests, database, deadline = time.monotonic() + 0.5)
+            except optima.OptimaException:
+                pass
+            else:
+                assert False
+            assert time.monotonic() - start < 5
+        finally:
+            pool.close()
+
+def testRespawn():
+    # A worker that dies between rounds is replaced before the next, and one that crashes on a state is replaced,
+    # its request retried once and then split, and only the crashing state is NaN
+    temperatures = [500, 600, 700, 800]
+    library = FakeLibrary(crashAt = 700)
+    with tempfile.TemporaryDirectory() as path:
+        thermochimica = backend(library, path)
+        database = os.path.join(path, 'database.dat')
+        limits = thermoValidation.RunLimits(retries = 1)
+        pool = thermoWorkers.WorkerPool(thermochimica, 2, limits)
+        try:
+            if not pool.usable():
+                return
+            pool.workers[1].process.kill()
+            pool.workers[1].process.join()
+            f = pool.calculate([('other', pointSet([300, 400])), ('crashes', pointSet(temperatures))], database)
+            assert np.array_equal(f[0], expectedValues([300, 400], 2.0))
+            failed = np.array(temperatures) == 700
+            assert np.array_equal(np.isnan(f[1]), failed)
+            assert np.array_equal(np.array(f[1])[~failed], expectedValues(temperatures, 2.0)[~failed])
+            # The dead worker, then crashes on the set, its retry, states 2-3 and state 2 on its own
+            assert pool.respawns == 5
+            counts = limits.takeCounts()
+            assert counts['retries'] == 1 and counts['failed states'] == 1 and counts['timeouts'] == 0
+            # Sets keep going to their workers, which carry on from their replacements
+            assert np.array_equal(pool.calculate([('crashes', pointSet([500, 800]))], database)[0],
+                                  expectedValues([500, 800], 2.0))
+        finally:
+            pool.close()
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith('test') and callable(test):
+            test()
+            print(f'{name} passed')
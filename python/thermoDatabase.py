@@ -0,0 +1,218 @@
+import json
+import math
+import os
+import re
+import subprocess
+import tempfile
+import optimaCache
+import optimaTemplate
+import thermoValidation
+
+# Parsed Thermochimica databases, shared by thermoOptima, findTransition and dataThermoOptima.
+# A .dat file is parsed once into a DatabaseModel: its elements, the tags in it and the lines they are on, the phase
+# each tag is in and the elements of each phase's species, and (when a Thermochimica path is given) its phases and
+# species as listed by ParseDataOnly.
+# Models are kept in memory and in cacheDirectory, keyed by a hash of the file contents, so choosing a database
+# that has been seen before (in this or an earlier session) doesn't parse it again.
+
+# Directory for cached models, or None to only keep them in memory
+cacheDirectory = '.optimaCache'
+# Bumped when the model format changes, so that older cached models are not used
+cacheVersion = 2
+# Seconds ParseDataOnly may take before it is killed
+parseTimeout = 300
+
+class DatabaseModel:
+    def __init__(self, contentHash, elements, tags, tagLines, phases = None, tagPhases = None, phaseData = None):
+        self.contentHash = contentHash
+        self.elements = elements
+        # Tags in order of first appearance, and the (0-based) lines each one is on
+        self.tags = tags
+        self.tagLines = tagLines
+        # Elements of each species in each phase (phase: [[element, ...], ...]; pure condensed species are phases of
+        # their own), and the phases each tag is in. Both None if the layout of the database wasn't understood.
+        self.phases = phases
+        self.tagPhases = tagPhases
+        # Phase and species names as in Thermochimica's phaseLists.json, or None until ParseDataOnly has been run
+        self.phaseData = phaseData
+    def state(self):
+        return dict([('version', cacheVersion),
+                     ('elements', self.elements),
+                     ('tags', self.tags),
+                     ('tagLines', self.tagLines),
+                     ('phases', self.phases),
+                     ('tagPhases', self.tagPhases),
+                     ('phaseData', self.phaseData)])
+
+# Element names from the header of a database, leaving out any that aren't real elements (e.g. e(phase))
+def parseElements(lines):
+    elements = []
+    if len(lines) < 2:
+        return elements
+    nElements = int(lines[1][1:5])
+    # Skip the rest of the # species to the first line with letters in it
+    start = 2
+    while start < len(lines) and not any(c.isalpha() for c in lines[start]):
+        start += 1
+    elLen = 25 # element names are formatted 25 wide
+    for i in range(math.ceil(nElements/3)):
+        if start + i >= len(lines):
+            break
+        for j in range(3):
+            elements.append(lines[start + i][1+j*elLen:(1+j)*elLen].strip())
+    elements = elements[:nElements]
+    for el in list(elements):
+        if el not in thermoValidation.atomic_number_map:
+            if len(el) > 0:
+                if el[0] != 'e':
+                    print(el+' not in list') # if the name is bogus (or e(phase)), discard
+            elements = list(filter(lambda a: a != el, elements))
+    return elements
+
+# Model names that start a solution phase block
+solutionModels = ['IDMX', 'QKTO', 'RKMP', 'RKMPM', 'SUBL', 'SUBLM', 'SUBG', 'SUBQ', 'SUBI', 'SUBM']
+
+# Phases of a database and the phase each tag line is in, as (phases, tagPhases) for DatabaseModel,
+# or (None, None) if the layout isn't as expected.
+# Solution phases start with a line holding the phase name followed by one holding its model. Species start with
+# a line holding their name followed by one with their Gibbs energy equation type, number of intervals and
+# stoichiometry. The header gives the number of species in each solution phase; the species after those are pure
+# condensed phases.
+def parsePhaseBlocks(lines, tagLines):
+    try:
+        numbers = []
+        start = 1
+        while start < len(lines) and not any(c.isalpha() for c in lines[start]):
+            numbers.extend([int(number) for number in lines[start].split()])
+            start += 1
+        nElements, nSolutionPhases = numbers[0], numbers[1]
+        solutionSpecies = sum(numbers[2:2+nSolutionPhases])
+        # All element names in the header, including any that aren't real elements (e.g. e(phase))
+        names = []
+        for i in range(math.ceil(nElements/3)):
+            for j in range(3):
+                names.append(lines[start + i][1+j*25:(1+j)*25].strip())
+        names = names[:nElements]
+    except (IndexError, ValueError):
+        return None, None
+    stoichiometry = re.compile(r'^\s*\d+\s+\d+' + r'\s+-?\d*\.\d*' * nElements + r'\s*$')
+    phases = dict([])
+    # Phase that each line from there on is in
+    phaseStarts = []
+    phase = None
+    nSpecies = 0
+    for i in range(start, len(lines) - 1):
+        # A name, which may be followed by a # marking a dummy species
+        words = lines[i].split()
+        if len(words) == 0 or not any(c.isalpha() for c in words[0]) or not all([word == '#' for word in words[1:]]):
+            continue
+        name = words[0]
+        if lines[i+1].strip() in solutionModels and nSpecies < solutionSpecies:
+            phase = name
+            phases.setdefault(phase, [])
+            phaseStarts.append((i, phase))
+        elif stoichiometry.match(lines[i+1]):
+            amounts = [float(amount) for amount in lines[i+1].split()[2:]]
+            elements = [element for element, amount in zip(names, amounts)
+                        if amount != 0 and element in thermoValidation.atomic_number_map]
+            if nSpecies >= solutionSpecies:
+                # A pure condensed phase
+                phase = name
+                phases.setdefault(phase, [])
+                phaseStarts.append((i, phase))
+            elif phase is None:
+                return None, None
+            phases[phase].append(elements)
+            nSpecies += 1
+    if nSpecies != solutionSpecies + sum(numbers[2+nSolutionPhases:3+nSolutionPhases]):
+        return None, None
+    tagPhases = dict([])
+    for tag, lineNumbers in tagLines.items():
+        tagPhases[tag] = []
+        for line in lineNumbers:
+            inPhase = [phase for phaseStart, phase in phaseStarts if phaseStart <= line]
+            if len(inPhase) == 0:
+                return None, None
+            if inPhase[-1] not in tagPhases[tag]:
+                tagPhases[tag].append(inPhase[-1])
+    return phases, tagPhases
+
+def parseDatabase(text, contentHash):
+    template = optimaTemplate.DatabaseTemplate(text)
+    tagLines = dict([])
+    for start, end, tag in template.offsets:
+        line = text.count(b'\n', 0, start)
+        if line not in tagLines.setdefault(tag, []):
+            tagLines[tag].append(line)
+    lines = text.decode('latin-1').split('\n')
+    phases, tagPhases = parsePhaseBlocks(lines, tagLines)
+    return DatabaseModel(contentHash, parseElements(lines), template.tags(), tagLines, phases, tagPhases)
+
+# Phase and species names from ParseDataOnly, or None if it couldn't be run
+def parsePhases(datafile, thermochimica_path):
+    try:
+        subprocess.run([f'{thermochimica_path}/bin/ParseDataOnly', datafile], timeout = parseTimeout)
+        with open(f'{thermochimica_path}/phaseLists.json') as jsonFile:
+            return json.load(jsonFile)
+    except subprocess.TimeoutExpired:
+        print(f'ParseDataOnly did not finish within {parseTimeout} s')
+        return None
+    except (OSError, ValueError):
+        return None
+
+def cacheFilename(contentHash):
+    return os.path.join(cacheDirectory, f'database-{contentHash}.json')
+
+def loadCached(contentHash):
+    if not cacheDirectory:
+        return None
+    try:
+        with open(cacheFilename(contentHash)) as cacheFile:
+            state = json.load(cacheFile)
+    except (OSError, ValueError):
+        return None
+    if state.get('version') != cacheVersion:
+        return None
+    return DatabaseModel(contentHash, state['elements'], state['tags'], state['tagLines'], state['phases'], state['tagPhases'],
+                         state['phaseData'])
+
+def saveCached(model):
+    if not cacheDirectory:
+        return
+    # Write to a temporary file first so that concurrent readers never see part of a model
+    try:
+        os.makedirs(cacheDirectory, exist_ok = True)
+        descriptor, temporary = tempfile.mkstemp(dir = cacheDirectory, suffix = '.tmp')
+        with os.fdopen(descriptor, 'w') as cacheFile:
+            json.dump(model.state(), cacheFile)
+        os.replace(temporary, cacheFilename(model.contentHash))
+    except OSError as e:
+        print(f'Could not cache database model: {e}')
+
+# Models by content hash, and the content hash of each file by filename until the file changes
+models = dict([])
+fileHashes = dict([])
+
+# Model of datafile. If thermochimica_path is given, phase data is filled in too.
+def load(datafile, thermochimica_path = None):
+    status = os.stat(datafile)
+    key = (status.st_mtime_ns, status.st_size)
+    if datafile in fileHashes and fileHashes[datafile][0] == key:
+        contentHash = fileHashes[datafile][1]
+    else:
+        with open(datafile, 'rb') as f:
+            text = f.read()
+        contentHash = optimaCache.contentHash(text)
+        fileHashes[datafile] = (key, contentHash)
+        if contentHash not in models:
+            model = loadCached(contentHash)
+            if model is None:
+                model = parseDatabase(text, contentHash)
+                saveCached(model)
+            models[contentHash] = model
+    model = models[contentHash]
+    if thermochimica_path is not None and model.phaseData is None:
+        model.phaseData = parsePhases(datafile, thermochimica_path)
+        if model.phaseData is not None:
+            saveCached(model)
+    return model
@@ -1,14 +1,16 @@
 import numpy as np
 import os
 import re
-import PySimpleGUI as sg
-import shutil
-import subprocess
 import json
-import dataThermoOptima
 import optima
-import math
 import dictTools
+import optimaCache
+import optimaEvents
+import optimaTemplate
+import thermoDatabase
+import thermochimicaLibrary
+import thermoValidation
+import thermoWorkers
 
 timeout = 50
 inputSize = 8,
@@ -19,133 +21,352 @@ futureBlue = '#003C71'
 simcoeBlue = '#0077CA'
 techTangerine = '#E75D2A'
 coolGrey = '#A7A8AA'
-sg.theme_add_new('OntarioTech', {'BACKGROUND': futureBlue,
-                                 'TEXT': 'white',
-                                 'INPUT': 'white',
-                                 'TEXT_INPUT': 'black',
-                                 'SCROLL': coolGrey,
-                                 'BUTTON': ('white', techTangerine),
-                                 'PROGRESS': ('#01826B', '#D0D0D0'),
-                                 'BORDER': 1,
-                                 'SLIDER_DEPTH': 0,
-                                 'PROGRESS_DEPTH': 0})
-sg.theme('OntarioTech')
 
-atomic_number_map = [
-    'H','He','Li','Be','B','C','N','O','F','Ne','Na','Mg','Al','Si','P',
-    'S','Cl','Ar','K','Ca','Sc','Ti','V','Cr','Mn','Fe','Co','Ni','Cu','Zn',
-    'Ga','Ge','As','Se','Br','Kr','Rb','Sr','Y','Zr','Nb','Mo','Tc','Ru','Rh',
-    'Pd','Ag','Cd','In','Sn','Sb','Te','I','Xe','Cs','Ba','La','Ce','Pr','Nd',
-    'Pm','Sm','Eu','Gd','Tb','Dy','Ho','Er','Tm','Yb','Lu','Hf','Ta','W','Re',
-    'Os','Ir','Pt','Au','Hg','Tl','Pb','Bi','Po','At','Rn','Fr','Ra','Ac','Th',
-    'Pa','U','Np','Pu','Am','Cm','Bk','Cf','Es','Fm','Md','No','Lr','Rf','Db',
-    'Sg','Bh','Hs','Mt','Ds','Rg','Cn','Nh','Fl','Mc','Lv','Ts', 'Og'
-]
+# The GUI modules are only imported (by importGUI) when windows are used, so that scripted and headless runs
+# (see thermoOptimaBatch.py) don't need PySimpleGUI or a display
+sg = None
+dataThermoOptima = None
 
-def getPointValidationValues(updateInputFunction, validation, tags, beta, thermochimica_path, database):
+def importGUI():
+    global sg, dataThermoOptima
+    if sg is not None:
+        return
+    import PySimpleGUI
+    import dataThermoOptima as dataWindows
+    sg = PySimpleGUI
+    dataThermoOptima = dataWindows
+    sg.theme_add_new('OntarioTech', {'BACKGROUND': futureBlue,
+                                     'TEXT': 'white',
+                                     'INPUT': 'white',
+                                     'TEXT_INPUT': 'black',
+                                     'SCROLL': coolGrey,
+                                     'BUTTON': ('white', techTangerine),
+                                     'PROGRESS': ('#01826B', '#D0D0D0'),
+                                     'BORDER': 1,
+                                     'SLIDER_DEPTH': 0,
+                                     'PROGRESS_DEPTH': 0})
+    sg.theme('OntarioTech')
+
+atomic_number_map = thermoValidation.atomic_number_map
+
+# Evaluates all validation sets in turn on the shared database and Thermochimica output
+# backend may be a thermochimicaLibrary.ThermochimicaLibrary to run point calculations in-process where it can,
+# and workers a thermoWorkers.WorkerPool made with it to run them on resident workers instead
+def getPointValidationValues(updateInputFunction, validation, tags, beta, thermochimica_path, database, backend = None, workers = None):
     # Call update function
     updateInputFunction(tags, beta)
+    # The database was just updated, so the backend has to parse it again
+    if backend is not None:
+        backend.database = None
 
     # Run input files and store data
     f = []
     for n_val in range(len(validation)):
-        validationKeys = list(validation[n_val].keys())
+        inputFile = f'validationPoints-{n_val}.ti'
+        inputText = None
         if validation[n_val]['type'] == 'point':
-            subprocess.run([thermochimica_path + '/bin/RunCalculationList',f'validationPoints-{n_val}.ti'])
-
-            jsonFile = open(thermochimica_path + '/outputs/thermoout.json',)
-            try:
-                data = json.load(jsonFile)
-                jsonFile.close()
-            except:
-                jsonFile.close()
-                print('Data load failed')
-                raise optima.OptimaException
-
-            for i in range(len(validationKeys)):
-                if validationKeys[i] == 'type':
-                    continue
-                if len(data[str(i+1)].keys()) == 0:
-                    print('Thermochimica calculation failed to converge')
-                    raise optima.OptimaException
-                # Get all comparison values per calculation
-                calcValues = []
-                dictTools.getParallelDictValues(validation[n_val][validationKeys[i]]['values'],data[str(i+1)],calcValues)
-                f.extend(calcValues)
-        elif validation[n_val]['type'] == 'mixing':
-            import sys
-            sys.path.append(f'{thermochimica_path}/python')
-            import propertyOfMixing
-
-            for i in range(len(validationKeys)):
-                if validationKeys[i] == 'type':
-                    continue
-
-                phase = validation[n_val][validationKeys[i]]['phase']
-                temperature = validation[n_val][validationKeys[i]]['temperature']
-                # Get default values if not specified
-                if 'tunit' in validation[n_val][validationKeys[i]].keys():
-                    tunit = validation[n_val][validationKeys[i]]['tunit']
-                else:
-                    tunit = 'K'
-                if 'munit' in validation[n_val][validationKeys[i]].keys():
-                    munit = validation[n_val][validationKeys[i]]['munit']
-                else:
-                    munit = 'moles'
-                if 'punit' in validation[n_val][validationKeys[i]].keys():
-                    punit = validation[n_val][validationKeys[i]]['punit']
-                else:
-                    punit = 'atm'
-                if 'pressure' in validation[n_val][validationKeys[i]].keys():
-                    pressure = validation[n_val][validationKeys[i]]['pressure']
-                else:
-                    pressure = 1
-                endpoints = validation[n_val][validationKeys[i]]['endpoints']
-                mixtures = validation[n_val][validationKeys[i]]['mixtures']
-
-                # Loop over all properties used
-                for property in validation[n_val][validationKeys[i]]['properties']:
-                    calcValues = propertyOfMixing.propertyOfMixing(property,
-                                                                   phase,
-                                                                   temperature,
-                                                                   endpoints,
-                                                                   mixtures,
-                                                                   database,
-                                                                   tunit = tunit,
-                                                                   munit = munit,
-                                                                   punit = punit,
-                                                                   pressure = pressure,
-                                                                   thermochimica_path = thermochimica_path)
-                    f.extend(calcValues)
+            with open(inputFile) as inputFileObject:
+                inputText = inputFileObject.read()
+        if (workers is not None and workers.usable() and validation[n_val]['type'] == 'point'
+            and backend.supports(validation[n_val])):
+            values = workers.calculate([(n_val, validation[n_val])], database)[0]
+            if isinstance(values, Exception):
+                raise values
+            f.extend(values)
+            continue
+        f.extend(thermoValidation.validationSetValues(validation[n_val], inputText, inputFile, None, database, thermochimica_path, backend))
 
     f = np.array(f)
     return f
 
 def updateDat(tags, beta):
-    shutil.copy('optima-inter.dat','optima.dat')
-    keys = list(tags.keys())
-    for i in range(len(tags)):
-        subprocess.call(['sed', '-i', '-e',  f's/<{keys[i]}>/{beta[i]}/g', 'optima.dat'])
+    template = optimaTemplate.load('optima-inter.dat')
+    template.write('optima.dat', dict(zip(tags.keys(), beta)))
 
 def createIntermediateDat(tags,filename):
-    shutil.copy(filename,'optima-inter.dat')
     tagCheck = []
+    fixed = dict([])
     for tag in tags:
         if tags[tag]['optimize']:
             tagCheck.append((tag, tags[tag]['initial']))
         else:
-            subprocess.call(['sed', '-i', '-e',  f's/<{tag}>/{tags[tag]["initial"][0]}/g', 'optima-inter.dat'])
+            fixed[tag] = tags[tag]['initial'][0]
+    optimaTemplate.load(filename).write('optima-inter.dat', fixed)
     return dict(tagCheck)
 
-class ThermochimicaOptima:
+# Settings and data of a fit, and running it. Used without a GUI by thermoOptimaBatch.py, and as the base of
+# ThermochimicaOptima, which fills it in from its windows.
+class ThermochimicaFit:
     def __init__(self):
-        self.children = []
         # Default parameters
         self.tol = 1e-4
         self.maxIts = 30
+        self.datafile = ''
+        self.thermochimica_path = 'thermochimica'
+        self.elements = []
+        # Coefficient tags: dict of tag: dict of 'initial' (two guesses), 'optimize' and 'scale'
+        self.tags = dict([])
+        self.validationPoints = [] #dict([])
+        # Set default method to Levenberg-Marquardt + Broyden
+        self.method = optima.LevenbergMarquardtBroyden
+        # stuff for writing input file (hardcode values for now)
+        self.datfile = f'{os.getcwd()}/optima.dat'
+        self.tunit = 'K'
+        self.punit = 'atm'
+        self.munit = 'moles'
+        self.extraParams = {}
+        # Evaluation cache settings: set cacheFile to keep evaluations between runs
+        self.cacheEntries = 1024
+        self.cacheFile = None
+        # Set eventLog to also write solver progress as JSON lines to that file
+        self.eventLog = None
+        # Set checkpoint to save solver state to that file as the run goes
+        self.checkpoint = None
+        # Use the Thermochimica shared library for point calculations when it can be loaded
+        self.useLibrary = True
+        # Worker processes for evaluations (e.g. Bayesian batches) and for the validation sets of each evaluation
+        # (0 uses all cores, or for validation sets of evaluations running concurrently, their share of the cores)
+        self.processes = 0
+        self.validationProcesses = 0
+        # Run the calculations of each list in an order where consecutive states are close (see thermoValidation.calculationOrder)
+        self.orderCalculations = False
+        # Keep Thermochimica resident in worker processes between evaluations when the shared library is used
+        self.useWorkers = True
+        # Write coefficients straight into the library's parsed database when their places in it can be found
+        self.patchCoefficients = True
+        # Time limits in seconds for a RunCalculationList run or worker request (per state in its list) and for all the
+        # runs of one evaluation (None for no limit). With isolateTimeouts, lists that don't finish are split to find the
+        # states that hang. Calculations on the shared library in this process (without useWorkers, or where workers
+        # can't be forked) can't be stopped, and have no time limit.
+        self.calculationTimeout = 10
+        self.evaluationTimeout = None
+        self.isolateTimeouts = True
+        # Input keyword for RunCalculationList's output file, if the Thermochimica build has one
+        # (see thermoValidation.outputKeyword); without it, runs take turns on the shared output
+        self.outputKeyword = None
+        # Keep the values of validation points that the tags changed since the last evaluation can't affect
+        # (see thermoValidation.DependencyIndex)
+        self.reuseUnaffected = False
+    def getTags(self):
+        return self.tags
+    def run(self):
+        # Get initial problem dimensions
+        m = np.sum([len(points) for points in self.validationPoints])
+        n = len(self.getTags())
+        # Check that we have enough data to go ahead
+        if m == 0:
+            print('Validation points not completed')
+            return
+        if n == 0:
+            print('Initial estimates for coefficients not completed')
+            return
+        # Write input file
+        self.writeFile()
+        # Call tag preprocessor
+        intertags = createIntermediateDat(self.getTags(),self.datafile)
+        # Run point calculations in-process if Thermochimica is available as a shared library
+        backend = None
+        if self.useLibrary:
+            library = thermochimicaLibrary.loadLibrary(self.thermochimica_path)
+            if library is None:
+                print('Thermochimica shared library not found, using RunCalculationList')
+            else:
+                elementNumbers = [atomic_number_map.index(element)+1 for element in self.elements]
+                backend = thermochimicaLibrary.ThermochimicaLibrary(library, elementNumbers, self.tunit, self.punit, self.munit)
+        # Each evaluation fills the database into its own scratch directory, so evaluations and the validation sets
+        # within them can run concurrently
+        template = optimaTemplate.load('optima-inter.dat')
+        inputTexts = []
+        for n_val in range(len(self.validationPoints)):
+            inputTexts.append(None)
+            if self.validationPoints[n_val]['type'] == 'point':
+                with open(f'validationPoints-{n_val}.ti') as inputFile:
+                    inputTexts[-1] = inputFile.read()
+        # Apply coefficients to the library's parsed database directly if the tags can be found in it
+        if backend is not None and self.patchCoefficients:
+            supported = [points for points in self.validationPoints if points['type'] == 'point' and backend.supports(points)]
+            if len(supported) > 0:
+                if backend.mapCoefficients(template, intertags, supported[0], thermoValidation.defaultScratchRoot() or '.'):
+                    print('Coefficients are patched into the parsed database')
+                else:
+                    print('Coefficients not found in the parsed database, parsing it every evaluation')
+        previous = None
+        if self.reuseUnaffected:
+            model = thermoDatabase.load(self.datafile)
+            if model.tagPhases is None:
+                print('Phases of tags not found in the database, calculating every point every evaluation')
+            else:
+                previous = thermoValidation.PreviousEvaluation(thermoValidation.DependencyIndex(model, self.elements))
+        thermoValidation.outputKeyword = self.outputKeyword
+        if not self.outputKeyword and any([not (backend is not None and points['type'] == 'point' and backend.supports(points))
+                                           for points in self.validationPoints]):
+            print(f'outputKeyword is not set, so RunCalculationList runs all write {self.thermochimica_path}/outputs/thermoout.json: '
+                  'they run one at a time, also across concurrent evaluations, and point sets are not split into chunks')
+            thermoValidation.sharedOutputReported = True
+        limits = thermoValidation.RunLimits(calculation = self.calculationTimeout, evaluation = self.evaluationTimeout,
+                                            isolate = self.isolateTimeouts)
+        # Workers are forked after mapping, so that they start with the parsed database
+        workers = None
+        if backend is not None and self.useWorkers:
+            workers = thermoWorkers.WorkerPool(backend, self.validationProcesses, limits)
+        # Use currying to package validationPoints with evaluateValidation
+        def getValues(tags, beta):
+            try:
+                values = thermoValidation.evaluateValidation(template, self.validationPoints, inputTexts, tags, beta, self.thermochimica_path,
+                                                             processes = self.validationProcesses, backend = backend,
+                                                             orderCalculations = self.orderCalculations, workers = workers,
+                                                             limits = limits, previous = previous)
+            finally:
+                # Report on the runs of an evaluation that had any time out
+                if limits.counts['timeouts'] > 0:
+                    print(limits.takeStatistics())
+                limits.takeCounts()
+            if backend is not None and backend.warmStart:
+                print(backend.takeStatistics())
+            if previous is not None:
+                print(previous.takeStatistics())
+            return values
+        # Remember evaluations keyed on the database template (fixed tags filled in), validation data and units
+        problemKey = optimaCache.contentHash(template.text, json.dumps(self.validationPoints), self.tunit, self.punit, self.munit)
+        cachedValues = optimaCache.EvaluationCache(getValues, problemKey, maxEntries = self.cacheEntries, filename = self.cacheFile)
+        # Get validation value/weight pairs
+        validationPairs = []
+        for points in self.validationPoints:
+            validationKeys = list(points.keys())
+            if points['type'] == 'point':
+                for i in range(len(points)):
+                    if validationKeys[i] == 'type':
+                        continue
+                    calcValues = []
+                    dictTools.getParallelDictValues(points[validationKeys[i]]['values'],
+                                                    points[validationKeys[i]]['values'],
+                                                    calcValues)
+                    validationPairs.extend(calcValues)
+            elif points['type'] == 'mixing':
+                for i in range(len(points)):
+                    if validationKeys[i] == 'type':
+                        continue
+                    for property in points[validationKeys[i]]['values']:
+                        validationPairs.extend(property)
+        # Real problem size is number of value/weight pairs x number of tags to be optimized
+        m = len(validationPairs)
+        n = len(intertags)
+        # Setup validation and weights arrays
+        y = np.zeros(m)
+        weight = np.ones(m)
+        for i in range(m):
+            if isinstance(validationPairs[i],list):
+                y[i] = validationPairs[i][0]
+                weight[i] = validationPairs[i][1]
+            else:
+                y[i] = validationPairs[i]
+        # Get scale from tags dict
+        scale = []
+        for tag in intertags.keys():
+            scale.append(self.getTags()[tag]['scale'])
+        scale = np.array(scale)
+
+        self.extraParams['processes'] = self.processes
+        if self.checkpoint:
+            self.extraParams['checkpoint'] = self.checkpoint
+        observers = [optimaEvents.ConsoleObserver()]
+        if self.eventLog:
+            observers.append(optimaEvents.JsonLinesObserver(self.eventLog))
+
+        # Call Optima
+        try:
+            norm, iterations, beta = self.method(y,
+                                     intertags,
+                                     cachedValues,
+                                     self.maxIts,
+                                     self.tol,
+                                     weight = weight,
+                                     scale = scale,
+                                     observers = observers,
+                                     **self.extraParams)
+        finally:
+            if workers is not None:
+                workers.close()
+            # Also report the evaluations of a fit that failed
+            cachedValues.report(observers)
+            cachedValues.close()
+        for observer in observers:
+            if isinstance(observer, optimaEvents.JsonLinesObserver):
+                observer.close()
+        print(f'Best norm: {norm}')
+        print(f'With beta: {beta}')
+        return norm, iterations, beta
+    def saveValidation(self, filename):
+        if len(self.validationPoints) == 0:
+            print('Cannot save empty validation set')
+            return
+        with open(filename, 'w') as outfile:
+            json.dump(self.validationPoints, outfile, indent=4)
+    def loadValidation(self, filename):
+        jsonFile = open(filename,)
+        try:
+            newVal = json.load(jsonFile)
+            jsonFile.close()
+        except:
+            jsonFile.close()
+            print('Data load failed')
+            return
+        # Want to be able to save/load multiple validation dicts per file
+        # But also just the old single
+        # So if an old single dict, just turn it into an array
+        if isinstance(newVal,dict):
+            newVal = [newVal]
+        for newPoints in newVal:
+            if len(newPoints) > 0:
+                startIndex = 0
+                i = 0
+                oldKeys = list(newPoints.keys())
+                # create a new dict to edit the keys to avoid overlapping keys
+                rekeyedPoints = dict([])
+                for point in oldKeys:
+                    if point == 'type':
+                        rekeyedPoints['type'] = newPoints.pop(point)
+                    else:
+                        rekeyedPoints[startIndex + i] = newPoints.pop(point)
+                        i += 1
+                # Set default type as a point calculation
+                if 'type' not in rekeyedPoints.keys():
+                    rekeyedPoints['type'] = 'point'
+                self.validationPoints.append(rekeyedPoints)
+                print(f'{len(rekeyedPoints) - 1} validation points loaded')
+            else:
+                print('No entries in validation JSON')
+    def writeFile(self):
+        for n_val in range(len(self.validationPoints)):
+            if self.validationPoints[n_val]['type'] == 'point':
+                with open(f'validationPoints-{n_val}.ti', 'w') as inputFile:
+                    inputFile.write('! Optima-generated input file for validation points\n')
+                    inputFile.write(f'data file         = {self.datfile}\n')
+                    inputFile.write(f'temperature unit  = {self.tunit}\n')
+                    inputFile.write(f'pressure unit     = {self.punit}\n')
+                    inputFile.write(f'mass unit         = {self.munit}\n')
+                    inputFile.write(f'nEl               = {len(self.elements)} \n')
+                    inputFile.write(f'iEl               = {" ".join([str(atomic_number_map.index(element)+1) for element in self.elements])}\n')
+                    # nCalc counts the state lines, as in every list thermoValidation derives from this one
+                    inputFile.write(f'nCalc             = {len([point for point in self.validationPoints[n_val].keys() if point != "type"])}\n')
+                    for point in self.validationPoints[n_val].keys():
+                        if point == 'type':
+                            continue
+                        inputFile.write(f'{" ".join([str(self.validationPoints[n_val][point]["state"][i]) for i in range(len(self.elements)+2)])}\n')
+    def parseElements(self):
+        self.elements = []
+        if self.datafile == '':
+            return
+        # Get element names so that we can set up the calculation and windows
+        self.elements = list(thermoDatabase.load(self.datafile).elements)
+
+class ThermochimicaOptima(ThermochimicaFit):
+    def __init__(self):
+        importGUI()
+        ThermochimicaFit.__init__(self)
+        self.children = []
         # self.datafile = 'fcctest.dat'
         self.datafile = 'kaye-drivingForce.dat'
-        self.thermochimica_path = 'thermochimica'
         # Parse datafile
         self.parseDatabase()
         # Set up window
@@ -173,20 +394,13 @@ class ThermochimicaOptima:
                                    [sg.Text('Eta:', size = keyNameWidth),sg.Input(key = '-eta-', size = inputSize)],
                                    [sg.Text('Kappa:', size = keyNameWidth),sg.Input(key = '-kappa-', size = inputSize)],
                                    [sg.Text('Kappa Decay:', size = keyNameWidth),sg.Input(key = '-kappa_decay-', size = inputSize)],
-                                   [sg.Text('Kappa Decay Delay:', size = keyNameWidth),sg.Input(key = '-kappa_decay_delay-', size = inputSize)]
+                                   [sg.Text('Kappa Decay Delay:', size = keyNameWidth),sg.Input(key = '-kappa_decay_delay-', size = inputSize)],
+                                   [sg.Text('Batch Size:', size = keyNameWidth),sg.Input(key = '-batch_size-', size = inputSize)]
                                    ], expand_x=True, expand_y=True)
         methodLayout   = [[sg.Text('Select Optimization Method:')],[broydenLayout,bayesianLayout]]
         self.sgw = sg.Window('Optima', [buttonLayout,methodLayout], location = [0,0], finalize=True)
-
-        self.validationPoints = [] #dict([])
-        # Set default method to Levenberg-Marquardt + Broyden
-        self.method = optima.LevenbergMarquardtBroyden
-        # stuff for writing input file (hardcode values for now)
-        self.datfile = f'{os.getcwd()}/optima.dat'
-        self.tunit = 'K'
-        self.punit = 'atm'
-        self.munit = 'moles'
-        self.extraParams = {}
+    def getTags(self):
+        return self.tagWindow.tags
     def close(self):
         for child in self.children:
             child.close()
@@ -313,6 +527,12 @@ class ThermochimicaOptima:
                     self.extraParams['kappa_decay_delay'] = kappa_decay_delay
             except ValueError:
                 pass
+            try:
+                batch_size = int(values['-batch_size-'])
+                if batch_size > 0:
+                    self.extraParams['batch_size'] = batch_size
+            except ValueError:
+                pass
             if values['-acq-'] == 'Upper Confidence Bounds':
                 self.extraParams['acq'] = 'ucb'
             elif values['-acq-'] == 'Expected Improvement':
@@ -326,166 +546,13 @@ class ThermochimicaOptima:
         elif event == 'Bayes':
             # Set method to Bayesian optimization
             self.method = optima.Bayesian
-    def run(self):
-        # Get initial problem dimensions
-        m = np.sum([len(points) for points in self.validationPoints])
-        n = len(self.tagWindow.tags)
-        # Check that we have enough data to go ahead
-        if m == 0:
-            print('Validation points not completed')
-            return
-        if n == 0:
-            print('Initial estimates for coefficients not completed')
-            return
-        # Write input file
-        self.writeFile()
-        # Call tag preprocessor
-        intertags = createIntermediateDat(self.tagWindow.tags,self.datafile)
-        # Use currying to package validationPoints with getPointValidationValues
-        def getValues(tags, beta):
-            return getPointValidationValues(updateDat, self.validationPoints, tags, beta, self.thermochimica_path, self.datfile)
-        # Get validation value/weight pairs
-        validationPairs = []
-        for points in self.validationPoints:
-            validationKeys = list(points.keys())
-            if points['type'] == 'point':
-                for i in range(len(points)):
-                    if validationKeys[i] == 'type':
-                        continue
-                    calcValues = []
-                    dictTools.getParallelDictValues(points[validationKeys[i]]['values'],
-                                                    points[validationKeys[i]]['values'],
-                                                    calcValues)
-                    validationPairs.extend(calcValues)
-            elif points['type'] == 'mixing':
-                for i in range(len(points)):
-                    if validationKeys[i] == 'type':
-                        continue
-                    for property in points[validationKeys[i]]['values']:
-                        validationPairs.extend(property)
-        # Real problem size is number of value/weight pairs x number of tags to be optimized
-        m = len(validationPairs)
-        n = len(intertags)
-        # Setup validation and weights arrays
-        y = np.zeros(m)
-        weight = np.ones(m)
-        for i in range(m):
-            if isinstance(validationPairs[i],list):
-                y[i] = validationPairs[i][0]
-                weight[i] = validationPairs[i][1]
-            else:
-                y[i] = validationPairs[i]
-        # Get scale from tags dict
-        scale = []
-        for tag in intertags.keys():
-            scale.append(self.tagWindow.tags[tag]['scale'])
-        scale = np.array(scale)
-
-        # Call Optima
-        norm, iterations, beta = self.method(y,
-                                 intertags,
-                                 getValues,
-                                 self.maxIts,
-                                 self.tol,
-                                 weight = weight,
-                                 scale = scale,
-                                 **self.extraParams)
-        print(f'Best norm: {norm}')
-        print(f'With beta: {beta}')
-    def saveValidation(self, filename):
-        if len(self.validationPoints) == 0:
-            print('Cannot save empty validation set')
-            return
-        with open(filename, 'w') as outfile:
-            json.dump(self.validationPoints, outfile, indent=4)
-    def loadValidation(self, filename):
-        jsonFile = open(filename,)
-        try:
-            newVal = json.load(jsonFile)
-            jsonFile.close()
-        except:
-            jsonFile.close()
-            print('Data load failed')
-            return
-        # Want to be able to save/load multiple validation dicts per file
-        # But also just the old single
-        # So if an old single dict, just turn it into an array
-        if isinstance(newVal,dict):
-            newVal = [newVal]
-        for newPoints in newVal:
-            if len(newPoints) > 0:
-                startIndex = 0
-                i = 0
-                oldKeys = list(newPoints.keys())
-                # create a new dict to edit the keys to avoid overlapping keys
-                rekeyedPoints = dict([])
-                for point in oldKeys:
-                    if point == 'type':
-                        rekeyedPoints['type'] = newPoints.pop(point)
-                    else:
-                        rekeyedPoints[startIndex + i] = newPoints.pop(point)
-                        i += 1
-                # Set default type as a point calculation
-                if 'type' not in rekeyedPoints.keys():
-                    rekeyedPoints['type'] = 'point'
-                self.validationPoints.append(rekeyedPoints)
-                print(f'{len(rekeyedPoints) - 1} validation points loaded')
-            else:
-                print('No entries in validation JSON')
-    def writeFile(self):
-        for n_val in range(len(self.validationPoints)):
-            if self.validationPoints[n_val]['type'] == 'point':
-                with open(f'validationPoints-{n_val}.ti', 'w') as inputFile:
-                    inputFile.write('! Optima-generated input file for validation points\n')
-                    inputFile.write(f'data file         = {self.datfile}\n')
-                    inputFile.write(f'temperature unit  = {self.tunit}\n')
-                    inputFile.write(f'pressure unit     = {self.punit}\n')
-                    inputFile.write(f'mass unit         = {self.munit}\n')
-                    inputFile.write(f'nEl               = {len(self.elements)} \n')
-                    inputFile.write(f'iEl               = {" ".join([str(atomic_number_map.index(element)+1) for element in self.elements])}\n')
-                    inputFile.write(f'nCalc             = {len(self.validationPoints[n_val])}\n')
-                    for point in self.validationPoints[n_val].keys():
-                        if point == 'type':
-                            continue
-                        inputFile.write(f'{" ".join([str(self.validationPoints[n_val][point]["state"][i]) for i in range(len(self.elements)+2)])}\n')
     def parseDatabase(self):
-        self.elements = []
+        self.parseElements()
         if self.datafile == '':
             return
-        # Get element names so that we can set up the calculation and windows
-        with open(self.datafile) as f:
-            f.readline() # read comment line
-            line = f.readline() # read first data line (# elements, # phases, n*# species)
-            nElements = int(line[1:5])
-            nSoln = int(line[6:10])
-            while True:
-                line = f.readline() # read the rest of the # species but don't need them)
-                if any(c.isalpha() for c in line):
-                    break
-            elLen = 25 # element names are formatted 25 wide
-            els = line # get the first line with letters in it
-            for i in range(math.ceil(nElements/3)):
-                for j in range(3):
-                    self.elements.append(els[1+j*elLen:(1+j)*elLen].strip())
-                els = f.readline() # read a line of elements (3 per line)
-                # It doesn't matter now, but this reads one more line than required
-        for el in self.elements:
-            try:
-                index = atomic_number_map.index(el)+1 # get element indices in PT (i.e. # of protons)
-            except ValueError:
-                if len(el) > 0:
-                    if el[0] != 'e':
-                        print(el+' not in list') # if the name is bogus (or e(phase)), discard
-                self.elements = list(filter(lambda a: a != el, self.elements))
-
-        # Parse phase/species names
-        subprocess.run([f'{self.thermochimica_path}/bin/ParseDataOnly',self.datafile])
-        jsonFile = open(f'{self.thermochimica_path}/phaseLists.json',)
-        try:
-            self.phaseData = json.load(jsonFile)
-            jsonFile.close()
-        except:
-            jsonFile.close()
+        # Parse phase/species names (only run once per database contents)
+        self.phaseData = thermoDatabase.load(self.datafile, self.thermochimica_path).phaseData
+        if self.phaseData is None:
             print('Phase data load failed')
             return
 
@@ -0,0 +1,113 @@
+import time
+startTime = time.perf_counter()
+import json
+import os
+import sys
+import optima
+import thermoDatabase
+import thermoOptima
+
+# Runs a thermoOptima fit without the GUI, e.g. on batch nodes:
+#   python thermoOptimaBatch.py project.json
+# The project file is a JSON object of thermoOptima.ThermochimicaFit settings. Only datafile, tags and validation
+# are required, for example:
+# {
+#     "datafile": "kayetest.dat",
+#     "thermochimica_path": "thermochimica",
+#     "tags": {"A": {"initial": [-1000, -2000], "scale": 1.0}, "B": {"initial": [5, 5], "optimize": false}},
+#     "validation": ["combinedPoint+Mixture.json"],
+#     "method": "LevenbergMarquardtBroyden",
+#     "tol": 1e-4,
+#     "maxIts": 30,
+#     "extraParams": {"damping": "adaptive"},
+#     "processes": 0,
+#     "validationProcesses": 0
+# }
+# validation is a validation JSON file (as saved from the GUI) or a list of them.
+# Relative paths are taken from the directory of the project file.
+
+methods = dict([('LevenbergMarquardtBroyden', optima.LevenbergMarquardtBroyden),
+                ('Bayesian', optima.Bayesian),
+                ('Combined', optima.Combined),
+                ('MultiStart', optima.MultiStart),
+                ('Resume', optima.Resume)])
+
+# Settings copied to the fit as they are
+settings = ['tol', 'maxIts', 'tunit', 'punit', 'munit', 'extraParams', 'cacheEntries', 'useLibrary',
+            'processes', 'validationProcesses', 'orderCalculations', 'useWorkers', 'patchCoefficients',
+            'calculationTimeout', 'evaluationTimeout', 'isolateTimeouts', 'reuseUnaffected',
+            'outputKeyword']
+# Settings that are file names
+fileSettings = ['datafile', 'thermochimica_path', 'cacheFile', 'eventLog', 'checkpoint']
+
+def loadProject(filename):
+    try:
+        with open(filename) as projectFile:
+            project = json.load(projectFile)
+    except (OSError, ValueError) as e:
+        print(f'Project load failed: {e}')
+        raise optima.OptimaException
+    directory = os.path.dirname(os.path.abspath(filename))
+    def projectPath(path):
+        return os.path.join(directory, path)
+
+    fit = thermoOptima.ThermochimicaFit()
+    validationFiles = []
+    for setting, value in project.items():
+        if setting in settings:
+            setattr(fit, setting, value)
+        elif setting in fileSettings:
+            setattr(fit, setting, projectPath(value))
+        elif setting == 'method':
+            if value not in methods:
+                print(f'Unknown method {value}, choose from {", ".join(methods.keys())}')
+                raise optima.OptimaException
+            fit.method = methods[value]
+        elif setting == 'tags':
+            for tag, tagSettings in value.items():
+                if len(tagSettings.get('initial', [])) != 2:
+                    print(f'Tag {tag} needs two initial values')
+                    raise optima.OptimaException
+                fit.tags[tag] = dict([('initial', [float(v) for v in tagSettings['initial']]),
+                                      ('optimize', tagSettings.get('optimize', True)),
+                                      ('scale', float(tagSettings.get('scale', 1.0)))])
+        elif setting == 'validation':
+            if isinstance(value, str):
+                value = [value]
+            validationFiles = [projectPath(validationFile) for validationFile in value]
+        else:
+            print(f'Unknown project setting {setting}')
+            raise optima.OptimaException
+
+    if fit.datafile == '' or not os.path.isfile(fit.datafile):
+        print('Project needs an existing datafile')
+        raise optima.OptimaException
+    missing = [tag for tag in thermoDatabase.load(fit.datafile).tags if tag not in fit.tags]
+    if len(missing) > 0:
+        print(f'No initial values for tags {", ".join(missing)}')
+        raise optima.OptimaException
+    fit.parseElements()
+    for validationFile in validationFiles:
+        nSets = len(fit.validationPoints)
+        fit.loadValidation(validationFile)
+        if len(fit.validationPoints) == nSets:
+            print(f'No validation data loaded from {validationFile}')
+            raise optima.OptimaException
+    return fit
+
+def main():
+    if len(sys.argv) != 2:
+        print('Usage: python thermoOptimaBatch.py project.json')
+        return 2
+    try:
+        fit = loadProject(sys.argv[1])
+    except optima.OptimaException:
+        return 1
+    print(f'Startup time: {time.perf_counter() - startTime:.3f} s')
+    result = fit.run()
+    if result is None:
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+import json
+import numpy as np
+import dictTools
+import optima
+
+# Selective reading of Thermochimica's thermoout.json.
+# A point validation set is compiled once into an ExtractionPlan: the key path of every value it compares against,
+# grouped by calculation, with the offset of each value in the output array.
+# The output file is then read one calculation at a time, so only one calculation's data is held at once,
+# and only the planned paths are looked up in it.
+
+# Characters read from the output file at a time
+readSize = 1 << 20
+
+class ExtractionPlan:
+    def __init__(self, validationSet):
+        # Calculation number in the output: [(offset, key path), ...]
+        self.calculations = dict([])
+        self.size = 0
+        validationKeys = list(validationSet.keys())
+        for i in range(len(validationKeys)):
+            if validationKeys[i] == 'type':
+                continue
+            # Same numbering as getPointValidationValues has always used
+            calculation = str(i+1)
+            paths = []
+            dictTools.getDictKeyPaths(validationSet[validationKeys[i]]['values'], [], paths)
+            self.calculations[calculation] = [(self.size + k, path) for k, path in enumerate(paths)]
+            self.size += len(paths)
+    # Values from outputFile, in the order of the validation set; NaN for calculations that failed to converge
+    def extract(self, outputFile):
+        f = np.zeros(self.size)
+        found = set()
+        try:
+            with open(outputFile) as jsonFile:
+                for calculation, data in iterateCalculations(jsonFile):
+                    if calculation not in self.calculations:
+                        continue
+                    found.add(calculation)
+                    if len(data.keys()) == 0:
+                        # Left for the optimizer to mask
+                        print('Thermochimica calculation failed to converge')
+                        for offset, path in self.calculations[calculation]:
+                            f[offset] = np.nan
+                        continue
+                    for offset, path in self.calculations[calculation]:
+                        value = data
+                        for key in path:
+                            value = value[key]
+                        f[offset] = value
+        except (OSError, ValueError, KeyError, TypeError):
+            print('Data load failed')
+            raise optima.OptimaException
+        if len(found) < len(self.calculations):
+            print('Data load failed')
+            raise optima.OptimaException
+        return f
+
+# Compiled plans by validation set, kept with the set so that a reused id can't be mistaken for it
+compiledPlans = dict([])
+
+def extractionPlan(validationSet):
+    key = id(validationSet)
+    if key in compiledPlans and compiledPlans[key][0] is validationSet:
+        return compiledPlans[key][1]
+    plan = ExtractionPlan(validationSet)
+    compiledPlans[key] = (validationSet, plan)
+    return plan
+
+# Yields the (key, value) members of the top-level JSON object in jsonFile one at a time
+def iterateCalculations(jsonFile):
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    finished = False
+
+    # Makes sure there is more than whitespace left after position, reading more if needed
+    def fill():
+        nonlocal buffer, position, finished
+        while True:
+            while position < len(buffer) and buffer[position].isspace():
+                position += 1
+            if position < len(buffer) or finished:
+                return
+            buffer = jsonFile.read(readSize)
+            position = 0
+            finished = len(buffer) == 0
+
+    # Decodes the next JSON value, reading more of the file until it is complete
+    def decode():
+        nonlocal buffer, position, finished
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+                # A number may continue past the end of the buffer, also when the buffer ends on what decodes as a
+                # shorter number (1.5e split before its exponent)
+                incomplete = isinstance(value, (int, float)) and buffer[end:].strip('0123456789.eE+-') == ''
+                if (end < len(buffer) and not incomplete) or finished:
+                    position = end
+                    return value
+            except json.JSONDecodeError:
+                if finished:
+                    raise
+            more = jsonFile.read(readSize)
+            finished = len(more) == 0
+            buffer = buffer[position:] + more
+            position = 0
+
+    def expect(character):
+        nonlocal position
+        fill()
+        if position >= len(buffer) or buffer[position] != character:
+            raise ValueError(f'Expected {character} in Thermochimica output')
+        position += 1
+
+    expect('{')
+    fill()
+    if buffer[position:position+1] == '}':
+        return
+    while True:
+        key = decode()
+        expect(':')
+        fill()
+        value = decode()
+        yield key, value
+        fill()
+        if buffer[position:position+1] == ',':
+            position += 1
+            fill()
+        elif buffer[position:position+1] == '}':
+            return
+        else:
+            raise ValueError('Malformed Thermochimica output')
@@ -0,0 +1,835 @@
+import itertools
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+import numpy as np
+import dictTools
+import optima
+import optimaParallel
+import thermoOutput
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Evaluation of thermoOptima validation sets.
+# evaluateValidation fills the database for one functional evaluation into a scratch directory of its own, then runs
+# the validation sets concurrently and reassembles their values in the original order. Separate evaluations
+# (e.g. the points of a Bayesian batch) can therefore run at the same time as well.
+
+# Input keyword that sets where RunCalculationList writes its JSON output, or None if the Thermochimica build in use
+# always writes to its own outputs/thermoout.json. Without it, runs that go through that shared file (and mixing
+# calculations, which always do) take turns under a file lock, while everything else still runs concurrently.
+# Released Thermochimica builds write to outputs/thermoout.json only, so this is None by default; set it (through
+# ThermochimicaFit.outputKeyword) to the keyword of a build whose input parser takes an output file name.
+outputKeyword = None
+# Set once it has been reported that runs take turns on the shared output
+sharedOutputReported = False
+
+atomic_number_map = [
+    'H','He','Li','Be','B','C','N','O','F','Ne','Na','Mg','Al','Si','P',
+    'S','Cl','Ar','K','Ca','Sc','Ti','V','Cr','Mn','Fe','Co','Ni','Cu','Zn',
+    'Ga','Ge','As','Se','Br','Kr','Rb','Sr','Y','Zr','Nb','Mo','Tc','Ru','Rh',
+    'Pd','Ag','Cd','In','Sn','Sb','Te','I','Xe','Cs','Ba','La','Ce','Pr','Nd',
+    'Pm','Sm','Eu','Gd','Tb','Dy','Ho','Er','Tm','Yb','Lu','Hf','Ta','W','Re',
+    'Os','Ir','Pt','Au','Hg','Tl','Pb','Bi','Po','At','Rn','Fr','Ra','Ac','Th',
+    'Pa','U','Np','Pu','Am','Cm','Bk','Cf','Es','Fm','Md','No','Lr','Rf','Db',
+    'Sg','Bh','Hs','Mt','Ds','Rg','Cn','Nh','Fl','Mc','Lv','Ts', 'Og'
+]
+
+# Numbers scratch directories within a process so that their names are never reused
+scratchCounter = itertools.count()
+
+# Memory-backed directory that scratch directories go in by default, so that databases written for each evaluation
+# (and the outputs read back) don't touch the disk
+ramDirectory = '/dev/shm'
+
+def defaultScratchRoot():
+    if ramDirectory and os.path.isdir(ramDirectory) and os.access(ramDirectory, os.W_OK):
+        return ramDirectory
+    return None
+
+class Scratch:
+    def __init__(self, root = None):
+        if root is None:
+            root = defaultScratchRoot()
+        self.directory = tempfile.mkdtemp(prefix = f'optima-{os.getpid()}-{next(scratchCounter)}-', dir = root)
+        self.database = os.path.join(self.directory, 'optima.dat')
+    def inputFile(self, n_val):
+        return os.path.join(self.directory, f'validationPoints-{n_val}.ti')
+    def outputFile(self, n_val):
+        return os.path.join(self.directory, f'thermoout-{n_val}.json')
+    def close(self):
+        shutil.rmtree(self.directory, ignore_errors = True)
+
+# Holds a lock on the shared Thermochimica output while a calculation writes and reads it
+class SharedOutputLock:
+    def __init__(self, thermochimica_path):
+        self.filename = os.path.join(thermochimica_path, '.optima-output.lock')
+    def __enter__(self):
+        self.file = open(self.filename, 'w')
+        if fcntl is not None:
+            fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+    def __exit__(self, *exception):
+        if fcntl is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+
+# Input file text for a point validation set, pointed at database (and outputFile if the keyword is known)
+def scratchInput(inputText, database, outputFile):
+    text = re.sub(r'(?m)^data file\s*=.*$', lambda match: f'data file         = {database}', inputText)
+    if outputKeyword and outputFile:
+        text = text.rstrip('\n') + f'\n{outputKeyword} = {outputFile}\n'
+    return text
+
+# Values from a RunCalculationList JSON output, in the order of the validation set
+def pointOutputValues(outputFile, validationSet):
+    return list(thermoOutput.extractionPlan(validationSet).extract(outputFile))
+
+# Mixing properties through Thermochimica's propertyOfMixing, one set of runs per property.
+# Used for sets that MixingPlan can't evaluate.
+def mixingValues(validationSet, database, thermochimica_path):
+    import sys
+    if f'{thermochimica_path}/python' not in sys.path:
+        sys.path.append(f'{thermochimica_path}/python')
+    import propertyOfMixing
+
+    f = []
+    validationKeys = list(validationSet.keys())
+    for i in range(len(validationKeys)):
+        if validationKeys[i] == 'type':
+            continue
+        point = validationSet[validationKeys[i]]
+
+        phase = point['phase']
+        temperature = point['temperature']
+        # Get default values if not specified
+        if 'tunit' in point.keys():
+            tunit = point['tunit']
+        else:
+            tunit = 'K'
+        if 'munit' in point.keys():
+            munit = point['munit']
+        else:
+            munit = 'moles'
+        if 'punit' in point.keys():
+            punit = point['punit']
+        else:
+            punit = 'atm'
+        if 'pressure' in point.keys():
+            pressure = point['pressure']
+        else:
+            pressure = 1
+        endpoints = point['endpoints']
+        mixtures = point['mixtures']
+
+        # Loop over all properties used
+        for property in point['properties']:
+            calcValues = propertyOfMixing.propertyOfMixing(property,
+                                                           phase,
+                                                           temperature,
+                                                           endpoints,
+                                                           mixtures,
+                                                           database,
+                                                           tunit = tunit,
+                                                           munit = munit,
+                                                           punit = punit,
+                                                           pressure = pressure,
+                                                           thermochimica_path = thermochimica_path)
+            f.extend(calcValues)
+    return f
+
+# Mixing properties MixingPlan can derive from integral Gibbs energies
+mixingProperties = ['integral Gibbs energy', 'enthalpy', 'entropy']
+# Temperature step (K) of the central difference giving entropy (and from it enthalpy)
+mixingTemperatureStep = 1.0
+# Input keywords that limit a RunCalculationList input to one phase
+phaseKeywords = ('number excluded except', 'phases excluded except')
+
+def kelvin(temperature, tunit):
+    if tunit == 'C':
+        return temperature + 273.15
+    elif tunit == 'F':
+        return (temperature - 32) * 5 / 9 + 273.15
+    elif tunit == 'R':
+        return temperature * 5 / 9
+    return temperature
+
+# Evaluates all the mixing sets of a validation list together.
+# Every state their properties need (endpoints and mixtures, with temperatures either side for entropy and enthalpy)
+# goes into one calculation list per phase and units, so that a state shared by several properties, points or sets
+# is calculated once. Property values are then derived from the integral Gibbs energies of those calculations:
+#   S = -dG/dT by central difference, H = G + TS, and the mixing value at x is P(x) - (1 - x) P(0) - x P(1).
+# Sets asking for any other property are left out of the plan and go through mixingValues instead.
+class MixingPlan:
+    def __init__(self, validation):
+        self.validation = validation
+        self.validationSets = list(validation)
+        # Validation set indices evaluated by the plan
+        self.sets = []
+        # (phase, punit, munit) of each calculation list, with its states and the index of each state in it
+        self.groups = []
+        self.states = []
+        self.stateIndices = []
+        # Validation set index: [(property, mixtures, temperature, group, state indices), ...]
+        self.entries = dict([])
+        # Made once, so that their chunks and extraction plans are reused between evaluations
+        self.lists = None
+        for n_val in range(len(validation)):
+            validationSet = validation[n_val]
+            if validationSet['type'] != 'mixing' or not self.derivable(validationSet):
+                continue
+            self.sets.append(n_val)
+            self.entries[n_val] = []
+            for key in validationSet.keys():
+                if key == 'type':
+                    continue
+                point = validationSet[key]
+                temperature = kelvin(float(point['temperature']), point.get('tunit', 'K'))
+                pressure = float(point.get('pressure', 1))
+                group = self.group((point['phase'], point.get('punit', 'atm'), point.get('munit', 'moles')))
+                endpoints = point['endpoints']
+                mixtures = np.array(point['mixtures'], dtype = float)
+                compositions = [endpoints[0], endpoints[1]]
+                for x in mixtures:
+                    compositions.append(dict([(element, (1 - x) * endpoints[0].get(element, 0) + x * endpoints[1].get(element, 0))
+                                              for element in set(endpoints[0].keys()) | set(endpoints[1].keys())]))
+                for property in point['properties']:
+                    temperatures = [temperature]
+                    if property != 'integral Gibbs energy':
+                        temperatures.extend([temperature - mixingTemperatureStep, temperature + mixingTemperatureStep])
+                    indices = [[self.state(group, t, pressure, composition) for t in temperatures]
+                               for composition in compositions]
+                    self.entries[n_val].append((property, mixtures, temperature, group, np.array(indices)))
+    def derivable(self, validationSet):
+        for key in validationSet.keys():
+            if key == 'type':
+                continue
+            point = validationSet[key]
+            if not all([property in mixingProperties for property in point['properties']]):
+                return False
+            if len(point['endpoints']) != 2:
+                return False
+            elements = set(point['endpoints'][0].keys()) | set(point['endpoints'][1].keys())
+            if not all([element in atomic_number_map for element in elements]):
+                return False
+        return True
+    def group(self, groupKey):
+        if groupKey not in self.groups:
+            self.groups.append(groupKey)
+            self.states.append([])
+            self.stateIndices.append(dict([]))
+        return self.groups.index(groupKey)
+    def state(self, group, temperature, pressure, composition):
+        stateKey = (temperature, pressure, tuple(sorted([(element, float(amount)) for element, amount in composition.items()])))
+        if stateKey not in self.stateIndices[group]:
+            self.stateIndices[group][stateKey] = len(self.states[group])
+            self.states[group].append(stateKey)
+        return self.stateIndices[group][stateKey]
+    # True if the plan was made for this validation list as it is now
+    def matches(self, validation):
+        return (self.validation is validation and len(self.validationSets) == len(validation)
+                and all([a is b for a, b in zip(self.validationSets, validation)]))
+    # A point validation set and RunCalculationList input for each group, asking for the integral Gibbs energy of every state
+    def calculationLists(self):
+        if self.lists is not None:
+            return self.lists
+        calculationLists = []
+        for group in range(len(self.groups)):
+            phase, punit, munit = self.groups[group]
+            states = self.states[group]
+            elements = sorted(set([element for state in states for element, amount in state[2]]),
+                              key = lambda element: atomic_number_map.index(element))
+            pointSet = dict([('type', 'point')])
+            stateLines = []
+            for i in range(len(states)):
+                temperature, pressure, composition = states[i]
+                amounts = dict(composition)
+                state = [temperature, pressure] + [amounts.get(element, 0) for element in elements]
+                pointSet[str(i)] = dict([('state', state), ('values', dict([('integral Gibbs energy', 0)]))])
+                stateLines.append(' '.join([str(value) for value in state]))
+            text = ('! Optima-generated input file for mixing properties\n'
+                    + 'data file         = optima.dat\n'
+                    + 'temperature unit  = K\n'
+                    + f'pressure unit     = {punit}\n'
+                    + f'mass unit         = {munit}\n'
+                    + f'nEl               = {len(elements)} \n'
+                    + f'iEl               = {" ".join([str(atomic_number_map.index(element)+1) for element in elements])}\n'
+                    + f'{phaseKeywords[0]} = 1\n'
+                    + f'{phaseKeywords[1]} = {phase}\n'
+                    + f'nCalc             = {len(states)}\n'
+                    + '\n'.join(stateLines) + '\n')
+            calculationLists.append((pointSet, text))
+        self.lists = calculationLists
+        return calculationLists
+    # Values of validation set n_val from energies, the integral Gibbs energies of each group's states
+    def setValues(self, n_val, energies):
+        f = []
+        for property, mixtures, temperature, group, indices in self.entries[n_val]:
+            gibbs = np.array(energies[group])[indices]
+            if property == 'integral Gibbs energy':
+                values = gibbs[:, 0]
+            else:
+                entropy = -(gibbs[:, 2] - gibbs[:, 1]) / (2 * mixingTemperatureStep)
+                values = entropy if property == 'entropy' else gibbs[:, 0] + temperature * entropy
+            f.extend(values[2:] - (1 - mixtures) * values[0] - mixtures * values[1])
+        return f
+
+# Plans by validation list, remade when the list changes
+mixingPlans = dict([])
+
+def mixingPlan(validation):
+    key = id(validation)
+    if key in mixingPlans and mixingPlans[key].matches(validation):
+        return mixingPlans[key]
+    plan = MixingPlan(validation)
+    mixingPlans[key] = plan
+    return plan
+
+# Wall-clock limits on Thermochimica runs, and counts of the runs that went over them.
+# A RunCalculationList run may take startup + calculation seconds per state in its list, and all runs of one evaluation
+# together may take evaluation seconds (None for no limit). A run that goes over its limit is killed and run again
+# up to retries times; if it still doesn't finish and isolate is set, its list is split in half until the states
+# that don't finish are found, and only those are reported as failed.
+class RunLimits:
+    def __init__(self, startup = 60, calculation = 10, evaluation = None, retries = 1, isolate = True):
+        self.startup = startup
+        self.calculation = calculation
+        self.evaluation = evaluation
+        self.retries = retries
+        self.isolate = isolate
+        self.counts = dict([('runs', 0), ('timeouts', 0), ('retries', 0), ('failed states', 0)])
+    # Time limit for a run of nCalculations states
+    def runTimeout(self, nCalculations):
+        if self.calculation is None:
+            return None
+        return self.startup + self.calculation * nCalculations
+    # Deadline on time.monotonic() for an evaluation starting now
+    def deadline(self):
+        if self.evaluation is None:
+            return None
+        return time.monotonic() + self.evaluation
+    def takeCounts(self):
+        counts = self.counts
+        self.counts = dict([(key, 0) for key in counts.keys()])
+        return counts
+    def mergeCounts(self, counts):
+        for key, value in counts.items():
+            self.counts[key] += value
+    # Counts since the last call, as a line for the console
+    def takeStatistics(self):
+        counts = self.takeCounts()
+        return (f'{counts["timeouts"]} of {counts["runs"]} RunCalculationList runs timed out, '
+                f'{counts["retries"]} retried, {counts["failed states"]} states failed')
+
+# Shared by evaluations in this process
+runLimits = RunLimits()
+
+# Runs RunCalculationList on inputFile, returning False if it was killed for going over timeout
+def runCalculationList(thermochimica_path, inputFile, timeout):
+    try:
+        subprocess.run([thermochimica_path + '/bin/RunCalculationList', inputFile], timeout = timeout)
+    except subprocess.TimeoutExpired:
+        return False
+    return True
+
+# Values for a point validation set through RunCalculationList, within limits (a RunLimits) and before deadline.
+# The values of states that never finished are NaN, and counted in limits as failed states.
+def listValues(validationSet, inputText, inputFile, outputFile, database, thermochimica_path, limits, deadline):
+    # Values of one run, or None if it timed out
+    def run(part, text):
+        timeout = limits.runTimeout(len(part) - 1)
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                print('Evaluation went over its time limit')
+                raise optima.OptimaException
+            if timeout is None or remaining < timeout:
+                timeout = remaining
+        with open(inputFile, 'w') as f:
+            f.write(scratchInput(text, database, outputFile))
+        limits.counts['runs'] += 1
+        if outputKeyword and outputFile:
+            # Don't read what an earlier run of this file left behind
+            if os.path.exists(outputFile):
+                os.remove(outputFile)
+            if not runCalculationList(thermochimica_path, inputFile, timeout):
+                limits.counts['timeouts'] += 1
+                return None
+            return pointOutputValues(outputFile, part)
+        with SharedOutputLock(thermochimica_path):
+            if not runCalculationList(thermochimica_path, inputFile, timeout):
+                limits.counts['timeouts'] += 1
+                return None
+            return pointOutputValues(thermochimica_path + '/outputs/thermoout.json', part)
+    def isolate(part, text, retries):
+        values = run(part, text)
+        while values is None and retries > 0:
+            retries -= 1
+            limits.counts['retries'] += 1
+            values = run(part, text)
+        if values is not None:
+            return list(values)
+        halves = splitParts(part, text, 2) if limits.isolate else [(part, text)]
+        if len(halves) < 2:
+            states = [key for key in part.keys() if key != 'type']
+            print(f'Thermochimica did not finish state{"s" if len(states) > 1 else ""} {", ".join(states)} in time')
+            limits.counts['failed states'] += len(states)
+            return [np.nan] * thermoOutput.extractionPlan(part).size
+        values = []
+        for half, halfText in halves:
+            values.extend(isolate(half, halfText, 0))
+        return values
+    return isolate(validationSet, inputText, limits.retries)
+
+# Values for one validation set.
+# inputText is the set's RunCalculationList input; it is written to inputFile pointing at database.
+# outputFile is where the JSON output should go if outputKeyword allows it.
+# backend may be a thermochimicaLibrary.ThermochimicaLibrary to run point calculations in-process where it can.
+# limits is the RunLimits for RunCalculationList runs (runLimits if None), and deadline when the evaluation has to end.
+def validationSetValues(validationSet, inputText, inputFile, outputFile, database, thermochimica_path, backend = None,
+                        limits = None, deadline = None):
+    if limits is None:
+        limits = runLimits
+    if validationSet['type'] == 'point' and backend is not None and backend.supports(validationSet):
+        # Each evaluation has its own database, so it only needs parsing the first time this process sees it
+        if backend.database != database:
+            backend.parse(database)
+        return list(backend.calculate(validationSet))
+    elif validationSet['type'] == 'point':
+        return listValues(validationSet, inputText, inputFile, outputFile, database, thermochimica_path, limits, deadline)
+    elif validationSet['type'] == 'mixing':
+        with SharedOutputLock(thermochimica_path):
+            return mixingValues(validationSet, database, thermochimica_path)
+    return []
+
+# Chooses how many chunks to split a point validation set into, from the chunk runs seen so far.
+# Run time is fitted as startup + perPoint * points per validation set. Splitting into c chunks takes
+# startup + perPoint * points / c of wall time but c * startup of extra CPU time, which is shared by processes cores;
+# minimizing their sum gives c = sqrt(processes * perPoint * points / startup), limited to processes.
+# Until runs of more than one chunk size have been seen, startup can't be separated and all processes are used.
+class ChunkPlanner:
+    def __init__(self, history = 20):
+        self.history = history
+        self.runs = dict([])
+    def record(self, key, points, elapsed):
+        runs = self.runs.setdefault(key, [])
+        runs.append((points, elapsed))
+        del runs[:-self.history]
+    # (startup, perPoint) in seconds, or None if they can't be told apart yet
+    def costs(self, key):
+        runs = self.runs.get(key, [])
+        points = np.array([run[0] for run in runs], dtype = float)
+        times = np.array([run[1] for run in runs], dtype = float)
+        if len(np.unique(points)) < 2:
+            return None
+        perPoint, startup = np.polyfit(points, times, 1)
+        return max(startup, 0), max(perPoint, 0)
+    def chunks(self, key, points, processes):
+        if processes < 1:
+            processes = optimaParallel.defaultProcesses()
+        nChunks = min(processes, points)
+        costs = self.costs(key)
+        if costs is not None:
+            startup, perPoint = costs
+            if startup > 0:
+                nChunks = min(nChunks, int(round(np.sqrt(processes * perPoint * points / startup))))
+        return max(nChunks, 1)
+
+# Shared by evaluations in this process
+chunkPlanner = ChunkPlanner()
+
+# Splits by validation set and chunk count, kept so that chunks (and their extraction plans) are reused between evaluations
+splitSets = dict([])
+
+# Splits a point validation set and its input text into nChunks balanced parts, each a valid set and input of its own.
+# Returns the whole set as the only part if the input doesn't list one state line per calculation.
+def splitPointSet(validationSet, inputText, nChunks):
+    key = (id(validationSet), nChunks)
+    if key in splitSets and splitSets[key][0] is validationSet and splitSets[key][1] == inputText:
+        return splitSets[key][2]
+    parts = splitParts(validationSet, inputText, nChunks)
+    splitSets[key] = (validationSet, inputText, parts)
+    return parts
+
+# Header lines and one state line per calculation of a point set's input, or None if the input isn't laid out that way.
+# nCalc is the number of state lines, in inputs written by ThermochimicaFit.writeFile and in every list derived here.
+def calculationLines(validationSet, inputText):
+    lines = inputText.split('\n')
+    nCalcLines = [i for i in range(len(lines)) if re.match(r'^nCalc\s*=', lines[i])]
+    if len(nCalcLines) != 1:
+        return None
+    header = lines[:nCalcLines[0]]
+    stateLines = [line for line in lines[nCalcLines[0]+1:] if line.strip()]
+    if len(stateLines) != len(validationSet) - 1 or lines[nCalcLines[0]].split('=')[1].strip() != str(len(stateLines)):
+        return None
+    return header, stateLines
+
+def splitParts(validationSet, inputText, nChunks):
+    keys = [key for key in validationSet.keys() if key != 'type']
+    lines = calculationLines(validationSet, inputText)
+    if nChunks < 2 or lines is None:
+        return [(validationSet, inputText)]
+    header, stateLines = lines
+    parts = []
+    for indices in np.array_split(np.arange(len(keys)), nChunks):
+        if len(indices) == 0:
+            continue
+        chosen = set([keys[i] for i in indices])
+        # Keep keys (including type) in their original order so outputs line up the same way as for the whole set
+        chunk = dict([(key, validationSet[key]) for key in validationSet.keys() if key == 'type' or key in chosen])
+        text = '\n'.join(header + [f'nCalc             = {len(indices)}'] + [stateLines[i] for i in indices]) + '\n'
+        parts.append((chunk, text))
+    return parts
+
+# Order for a list of calculation states (temperature, pressure, amounts...) along a short path through state space,
+# so that each calculation starts close to the one before it.
+# Temperature, pressure and composition (as fractions of the total amount) are each scaled to unit range, and the
+# path is built by nearest neighbour from the lowest temperature state.
+def calculationOrder(states):
+    states = np.array(states, dtype = float)
+    if len(states) < 3:
+        return np.arange(len(states))
+    amounts = states[:, 2:]
+    totals = np.sum(amounts, axis = 1, keepdims = True)
+    totals[totals == 0] = 1
+    coordinates = np.hstack([states[:, :2], amounts / totals])
+    ranges = np.ptp(coordinates, axis = 0)
+    ranges[ranges == 0] = 1
+    coordinates = coordinates / ranges
+    order = [int(np.argmin(states[:, 0]))]
+    remaining = np.ones(len(states), dtype = bool)
+    remaining[order[0]] = False
+    for i in range(len(states) - 1):
+        distances = np.sum((coordinates - coordinates[order[-1]])**2, axis = 1)
+        distances[~remaining] = np.inf
+        order.append(int(np.argmin(distances)))
+        remaining[order[-1]] = False
+    return np.array(order)
+
+# Length of the path through the (scaled) states in the given order, as minimized by calculationOrder
+def pathLength(states, order):
+    states = np.array(states, dtype = float)[order]
+    amounts = states[:, 2:]
+    totals = np.sum(amounts, axis = 1, keepdims = True)
+    totals[totals == 0] = 1
+    coordinates = np.hstack([states[:, :2], amounts / totals])
+    ranges = np.ptp(coordinates, axis = 0)
+    ranges[ranges == 0] = 1
+    return np.sum(np.sqrt(np.sum(np.diff(coordinates / ranges, axis = 0)**2, axis = 1)))
+
+# Ordered sets by validation set, kept for the same reasons as splitSets
+orderedSets = dict([])
+
+# A point validation set and its input with the calculations in calculationOrder, and the permutation that takes
+# the values of the ordered set back to the order of the original: values = orderedValues[permutation].
+# Returns the set unchanged with no permutation if the input doesn't list one state line per calculation.
+def orderPointSet(validationSet, inputText):
+    key = id(validationSet)
+    if key in orderedSets and orderedSets[key][0] is validationSet and orderedSets[key][1] == inputText:
+        return orderedSets[key][2]
+    ordered = (validationSet, inputText, None)
+    lines = calculationLines(validationSet, inputText)
+    if lines is not None:
+        header, stateLines = lines
+        keys = [key for key in validationSet.keys() if key != 'type']
+        order = calculationOrder([[float(value) for value in line.split()] for line in stateLines])
+        # Keep type where it was, since it shifts the numbering of calculations in the output
+        orderedKeys = iter([keys[i] for i in order])
+        orderedSet = dict([])
+        for k in validationSet.keys():
+            if k == 'type':
+                orderedSet[k] = validationSet[k]
+            else:
+                k = next(orderedKeys)
+                orderedSet[k] = validationSet[k]
+        text = '\n'.join(header + [f'nCalc             = {len(keys)}'] + [stateLines[i] for i in order]) + '\n'
+        # Values per calculation, to find where each calculation's values end up
+        counts = dict([])
+        for k in keys:
+            paths = []
+            dictTools.getDictKeyPaths(validationSet[k]['values'], [], paths)
+            counts[k] = len(paths)
+        offsets = dict([])
+        offset = 0
+        for i in order:
+            offsets[keys[i]] = offset
+            offset += counts[keys[i]]
+        permutation = np.concatenate([np.arange(offsets[k], offsets[k] + counts[k]) for k in keys]).astype(int)
+        ordered = (orderedSet, text, permutation)
+    orderedSets[key] = (validationSet, inputText, ordered)
+    return ordered
+
+# Which validation points each tag can affect, from the phases a thermoDatabase.DatabaseModel puts tags in.
+# Mixing calculations are limited to their phase, so they depend on that phase only. A point calculation depends on
+# every phase with a species made only of elements the point has some of, as any of those may take part in its
+# equilibrium. elements are the elements of point states, in order.
+class DependencyIndex:
+    def __init__(self, model, elements):
+        self.tagPhases = model.tagPhases
+        self.elements = elements
+        self.phaseSpecies = dict([(phase, [set(species) for species in speciesList])
+                                  for phase, speciesList in model.phases.items()])
+        # Phases by the set of elements present
+        self.formable = dict([])
+    # Phases of tags, or None if any of them is in a phase that isn't known
+    def phases(self, tags):
+        phases = set()
+        for tag in tags:
+            if tag not in self.tagPhases or len(self.tagPhases[tag]) == 0:
+                return None
+            phases.update(self.tagPhases[tag])
+        return phases
+    # Phases a point calculation at state can depend on
+    def pointPhases(self, state):
+        present = frozenset([element for element, amount in zip(self.elements, state[2:]) if float(amount) != 0])
+        if present not in self.formable:
+            self.formable[present] = set([phase for phase, speciesList in self.phaseSpecies.items()
+                                          if any([species <= present for species in speciesList])])
+        return self.formable[present]
+
+# Values of the last evaluation, so that the next one only calculates again the points that the tags changed since
+# can affect (as told by a DependencyIndex), and those that failed. The rest keep their previous values.
+class PreviousEvaluation:
+    def __init__(self, index):
+        self.index = index
+        self.validation = None
+        self.coefficients = None
+        # Values of each point of a point set (by validation set index), or all values of a mixing set or calculation list
+        # (by its key) as the only entry
+        self.values = dict([])
+        # Subsets of point sets made so far, so that their chunks and extraction plans are reused
+        self.subsets = dict([])
+        self.counts = dict([('reused', 0), ('calculated', 0)])
+    # Phases the tags changed since the last evaluation are in, or None if everything has to be calculated
+    def changedPhases(self, validation, coefficients):
+        if self.validation is not validation or self.coefficients is None or self.coefficients.keys() != coefficients.keys():
+            return None
+        return self.index.phases([tag for tag in coefficients.keys() if coefficients[tag] != self.coefficients[tag]])
+    # Whether each point of point set n_val keeps its previous values when changed phases change, or whether a whole
+    # mixing set does (as the only entry)
+    def keep(self, n_val, validationSet, changed):
+        keys = [key for key in validationSet.keys() if key != 'type']
+        if validationSet['type'] == 'mixing':
+            unaffected = (len(set([validationSet[key]['phase'] for key in keys]) & changed) == 0,)
+        else:
+            unaffected = tuple([len(self.index.pointPhases(validationSet[key]['state']) & changed) == 0 for key in keys])
+        return tuple([a and b for a, b in zip(unaffected, self.reusable(n_val))])
+    # Whether each entry of the previous values of key can be used again. Failed values (NaN, from a calculation that
+    # didn't converge or didn't finish in time) are not: the failure may not happen again.
+    def reusable(self, key):
+        return tuple([not np.any(np.isnan(np.asarray(entry, dtype = float))) for entry in self.values[key]])
+    # The points of a point set that aren't kept, as a set and input text of their own, or None if the input can't be split
+    def subset(self, n_val, validationSet, inputText, keep):
+        subsetKey = (n_val, keep)
+        if subsetKey in self.subsets and self.subsets[subsetKey][0] is validationSet and self.subsets[subsetKey][1] == inputText:
+            return self.subsets[subsetKey][2]
+        lines = calculationLines(validationSet, inputText)
+        if lines is None:
+            return None
+        header, stateLines = lines
+        keys = [key for key in validationSet.keys() if key != 'type']
+        chosen = set([keys[i] for i in range(len(keys)) if not keep[i]])
+        pointSet = dict([(key, validationSet[key]) for key in validationSet.keys() if key == 'type' or key in chosen])
+        text = '\n'.join(header + [f'nCalc             = {len(chosen)}']
+                         + [stateLines[i] for i in range(len(keys)) if not keep[i]]) + '\n'
+        self.subsets[subsetKey] = (validationSet, inputText, (pointSet, text))
+        return pointSet, text
+    # Values of point set n_val from the previous values of kept points and the new values of the others
+    def merge(self, n_val, keep, newValues):
+        f = []
+        position = 0
+        for kept, previousValues in zip(keep, self.values[n_val]):
+            if kept:
+                f.extend(previousValues)
+            else:
+                f.extend(newValues[position:position + len(previousValues)])
+                position += len(previousValues)
+        return f
+    def record(self, validation, coefficients, values):
+        self.validation = validation
+        self.coefficients = dict(coefficients)
+        self.values = dict([])
+        for key, keyValues in values.items():
+            if isinstance(key, int) and validation[key]['type'] == 'point':
+                sizes = [len(paths) for paths in thermoOutput.extractionPlan(validation[key]).calculations.values()]
+                self.values[key] = np.split(np.array(keyValues), np.cumsum(sizes)[:-1])
+            else:
+                self.values[key] = [list(keyValues)]
+    # Counts of calculations since the last call, as a line for the console
+    def takeStatistics(self):
+        counts = self.counts
+        self.counts = dict([(key, 0) for key in counts.keys()])
+        return f'{counts["calculated"]} of {counts["reused"] + counts["calculated"]} Thermochimica calculations run, the rest reused'
+
+# Functional values for one evaluation: fills template (an optimaTemplate.DatabaseTemplate) with tags/beta in a
+# scratch directory and evaluates the validation sets on up to processes workers.
+# Mixing sets are evaluated together through the calculation lists of a MixingPlan.
+# With orderCalculations, point sets and calculation lists run through RunCalculationList have their calculations
+# put in calculationOrder first. They are split into chunks (see ChunkPlanner) when outputKeyword lets their outputs
+# be kept apart (chunks writing to the shared output would only take turns); chunk outputs are merged back in order.
+# workers may be a thermoWorkers.WorkerPool made with backend, to run the sets backend supports on resident workers.
+# previous may be a PreviousEvaluation, to keep the values of points that the tags changed since can't affect.
+# RunCalculationList runs are kept within limits (runLimits if None), and worker requests within the limits of
+# workers, all before the evaluation's deadline; point sets calculated by backend in this process have no time limit.
+# Values of calculations that failed to converge or never finished are NaN, for the optimizer to mask.
+# inputTexts holds the RunCalculationList input for each validation set (None for mixing sets).
+def evaluateValidation(template, validation, inputTexts, tags, beta, thermochimica_path,
+                       processes = 1, backend = None, scratchRoot = None, planner = None, orderCalculations = False,
+                       workers = None, limits = None, previous = None):
+    if planner is None:
+        planner = chunkPlanner
+    if limits is None:
+        limits = runLimits
+    deadline = limits.deadline()
+    plan = mixingPlan(validation)
+    scratch = Scratch(scratchRoot)
+    coefficients = dict(zip(tags.keys(), beta))
+    # With coefficient slots mapped, the backend takes new values in memory instead of parsing a database
+    patched = backend is not None and backend.slots is not None
+    try:
+        if patched:
+            backend.patch(coefficients)
+            backend.database = scratch.database
+        # (key, label, set or chunk, input text, whether to use backend), in the order values are reassembled.
+        # The key is the validation set index, or ('mixing', group) for a mixing calculation list.
+        tasks = []
+        chunked = set()
+        # Permutations back from calculationOrder, by key
+        permutations = dict([])
+        # (key, set) to run on workers
+        workerRequests = []
+        useWorkers = workers is not None and workers.usable()
+        def addTasks(key, label, validationSet, inputText, useBackend):
+            parts = [(validationSet, inputText)]
+            runsList = (validationSet['type'] == 'point'
+                        and (backend is None or not useBackend or not backend.supports(validationSet)))
+            if validationSet['type'] == 'point' and not runsList and useWorkers:
+                workerRequests.append((key, validationSet))
+                return
+            if runsList and orderCalculations:
+                validationSet, inputText, permutation = orderPointSet(validationSet, inputText)
+                parts = [(validationSet, inputText)]
+                if permutation is not None:
+                    permutations[key] = permutation
+            if runsList and outputKeyword:
+                nChunks = planner.chunks(key, len(validationSet) - 1, processes)
+                chunked.add(key)
+                parts = splitPointSet(validationSet, inputText, nChunks)
+            for c, (part, text) in enumerate(parts):
+                tasks.append((key, f'{label}-{c}', part, text, useBackend))
+                # Compile extraction plans here so that workers inherit them
+                if part['type'] == 'point':
+                    thermoOutput.extractionPlan(part)
+        values = dict([])
+        # Phases of the tags changed since the previous evaluation, and which points of point sets keep their values
+        changed = None
+        if previous is not None:
+            changed = previous.changedPhases(validation, coefficients)
+        kept = dict([])
+        for n_val in range(len(validation)):
+            if n_val in plan.sets:
+                continue
+            validationSet, inputText = validation[n_val], inputTexts[n_val]
+            if changed is not None and n_val in previous.values:
+                keep = previous.keep(n_val, validationSet, changed)
+                if all(keep):
+                    values[n_val] = previous.merge(n_val, keep, [])
+                    previous.counts['reused'] += len(validationSet) - 1
+                    continue
+                if any(keep) and validationSet['type'] == 'point':
+                    subset = previous.subset(n_val, validationSet, inputText, keep)
+                    if subset is not None:
+                        kept[n_val] = keep
+                        validationSet, inputText = subset
+                        previous.counts['reused'] += sum(keep)
+            if previous is not None:
+                previous.counts['calculated'] += len(validationSet) - 1
+            addTasks(n_val, f'{n_val}', validationSet, inputText, True)
+        # Calculation lists are limited to one phase, which the library backend can't do
+        for group, (pointSet, inputText) in enumerate(plan.calculationLists()):
+            key = ('mixing', group)
+            if (changed is not None and key in previous.values and plan.groups[group][0] not in changed
+                and all(previous.reusable(key))):
+                values[key] = previous.values[key][0]
+                previous.counts['reused'] += len(pointSet) - 1
+                continue
+            if previous is not None:
+                previous.counts['calculated'] += len(pointSet) - 1
+            addTasks(key, f'mixing{group}', pointSet, inputText, False)
+        # Tasks may run in worker processes, so the backend's warm start data comes back with their results.
+        # Set aside what it holds already, so that workers only return what they add.
+        pending = None
+        if backend is not None:
+            pending = backend.takeUpdates()
+        pendingCounts = limits.takeCounts()
+        def evaluateTask(key, label, part, text, useBackend):
+            taskBackend = backend if useBackend else None
+            start = time.perf_counter()
+            values = validationSetValues(part, text, scratch.inputFile(label), scratch.outputFile(label),
+                                         scratch.database, thermochimica_path, taskBackend, limits, deadline)
+            updates = None
+            if taskBackend is not None:
+                updates = taskBackend.takeUpdates()
+            return values, time.perf_counter() - start, updates, limits.takeCounts()
+        # The database file is only needed by what doesn't run on a patched backend
+        fileTasks = [task for task in tasks if not (patched and task[4] and task[2]['type'] == 'point'
+                                                    and backend.supports(task[2]))]
+        if len(fileTasks) > 0 or (len(workerRequests) > 0 and not patched):
+            template.write(scratch.database, coefficients)
+        global sharedOutputReported
+        runsShared = [task for task in fileTasks if not (task[4] and backend is not None and task[2]['type'] == 'point'
+                                                         and backend.supports(task[2]))]
+        if (not outputKeyword and processes != 1 and not sharedOutputReported
+            and (len(runsShared) > 1 or any([len(task[2]) > 2 for task in runsShared]))):
+            print(f'RunCalculationList runs all write {thermochimica_path}/outputs/thermoout.json, so they run one at a time and point sets '
+                  'are not split into chunks; set outputKeyword if this Thermochimica build can write its output elsewhere')
+            sharedOutputReported = True
+        if len(workerRequests) > 0:
+            workerCoefficients = coefficients if patched else None
+            for (key, validationSet), result in zip(workerRequests, workers.calculate(workerRequests, scratch.database,
+                                                                                       workerCoefficients, deadline)):
+                if isinstance(result, Exception):
+                    raise result
+                values[key] = result
+        results = optimaParallel.mapConcurrently(evaluateTask, tasks, processes)
+        if pending is not None:
+            backend.mergeUpdates(pending)
+        limits.mergeCounts(pendingCounts)
+        failedStates = 0
+        for task, result in zip(tasks, results):
+            if isinstance(result, Exception):
+                raise result
+            taskValues, elapsed, updates, counts = result
+            if updates is not None:
+                backend.mergeUpdates(updates)
+            limits.mergeCounts(counts)
+            failedStates += counts['failed states']
+            values.setdefault(task[0], []).extend(taskValues)
+            # Runs that were killed and run again say nothing about how long a chunk takes
+            if task[0] in chunked and counts['timeouts'] == 0:
+                planner.record(task[0], len(task[2]) - 1, elapsed)
+        if failedStates > 0:
+            print(f'{failedStates} Thermochimica states did not finish in time')
+        for key, permutation in permutations.items():
+            values[key] = list(np.array(values[key])[permutation])
+        for n_val, keep in kept.items():
+            values[n_val] = previous.merge(n_val, keep, values[n_val])
+        if previous is not None:
+            previous.record(validation, coefficients, values)
+        # Reassemble in validation order
+        energies = [values[('mixing', group)] for group in range(len(plan.groups))]
+        f = []
+        for n_val in range(len(validation)):
+            if n_val in plan.sets:
+                f.extend(plan.setValues(n_val, energies))
+            else:
+                f.extend(values[n_val])
+    finally:
+        scratch.close()
+    return np.array(f)
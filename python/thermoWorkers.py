@@ -0,0 +1,205 @@
+import multiprocessing.connection
+import os
+import time
+import numpy as np
+import optima
+import optimaParallel
+import thermoOutput
+import thermoValidation
+
+# Pool of long-lived Thermochimica worker processes.
+# Each worker is forked with a thermochimicaLibrary.ThermochimicaLibrary and stays resident between evaluations,
+# taking "parse this database and run this validation set" requests over a pipe and sending the values back.
+# That saves starting a process per calculation list, and keeps each worker's warm start data from one evaluation
+# to the next: a validation set always goes to the same worker while that worker is alive.
+# Workers are pinged before each round of requests; ones that have died or stopped answering are replaced,
+# and a request that was running on a worker that crashed or went over its time limit is retried on its replacement.
+
+def serve(connection, backend):
+    # Start counting from zero, rather than from whatever the parent had counted when this worker was forked
+    backend.takeUpdates()
+    # The database file as last parsed: a file rewritten in place (as by updateDat) has to be parsed again
+    parsed = None
+    while True:
+        try:
+            message = connection.recv()
+        except (EOFError, OSError):
+            return
+        if message[0] == 'stop':
+            return
+        elif message[0] == 'ping':
+            connection.send(('pong',))
+        elif message[0] == 'calculate':
+            database, validationSet, coefficients = message[1], message[2], message[3]
+            try:
+                if coefficients is not None and backend.slots is not None:
+                    # Coefficients go straight into the database parsed before this worker was forked
+                    backend.patch(coefficients)
+                    parsed = None
+                else:
+                    status = os.stat(database)
+                    version = (database, status.st_mtime_ns, status.st_size)
+                    if parsed != version:
+                        parsed = None
+                        backend.parse(database)
+                        parsed = version
+                values = list(backend.calculate(validationSet))
+                # Warm start data stays here, only the counts go back
+                updates, statistics = backend.takeUpdates()
+                connection.send(('values', values, statistics))
+            except (optima.OptimaException, OSError):
+                connection.send(('failed',))
+
+class Worker:
+    def __init__(self, context, backend):
+        self.connection, workerConnection = context.Pipe()
+        self.process = context.Process(target = serve, args = (workerConnection, backend), daemon = True)
+        self.process.start()
+        workerConnection.close()
+    def stop(self):
+        try:
+            self.connection.send(('stop',))
+        except (OSError, ValueError):
+            pass
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.connection.close()
+
+class WorkerPool:
+    def __init__(self, backend, processes = 0, limits = None, pingTimeout = 5):
+        if processes < 1:
+            processes = optimaParallel.defaultProcesses()
+        self.backend = backend
+        # Each request may take as long as a RunCalculationList run of its states would
+        self.limits = limits if limits is not None else thermoValidation.runLimits
+        self.pingTimeout = pingTimeout
+        self.context = optimaParallel.forkContext()
+        self.pid = os.getpid()
+        self.workers = []
+        if self.context is not None:
+            self.workers = [Worker(self.context, backend) for _ in range(processes)]
+        # Worker index for each request key, so that sets keep going to the worker holding their warm start data
+        self.assignments = dict([])
+        self.respawns = 0
+    # Workers can only be used from the process that started them, and only on platforms that can fork
+    def usable(self):
+        return len(self.workers) > 0 and os.getpid() == self.pid
+    def respawn(self, index):
+        self.workers[index].stop()
+        self.workers[index] = Worker(self.context, self.backend)
+        self.respawns += 1
+    # Replaces workers that have died or don't answer a ping
+    def check(self):
+        for index in range(len(self.workers)):
+            worker = self.workers[index]
+            healthy = worker.process.is_alive()
+            if healthy:
+                try:
+                    worker.connection.send(('ping',))
+                    healthy = worker.connection.poll(self.pingTimeout) and worker.connection.recv() == ('pong',)
+                except (EOFError, OSError):
+                    healthy = False
+            if not healthy:
+                print(f'Thermochimica worker {index} is not responding, restarting it')
+                self.respawn(index)
+    # Values for each (key, validation set) in requests, in the same order, calculated on database,
+    # or with coefficients (tag: value) patched into memory if given and the backend has its slots mapped.
+    # A failed calculation is returned as an OptimaException in place of its values, as optimaParallel does.
+    # Requests are kept within the limits of the pool (a thermoValidation.RunLimits) and before deadline (on
+    # time.monotonic(), or None). A request whose worker crashes or goes over its limit is retried once on a new worker;
+    # if it fails again, its set is split in half (with isolate set in limits) until the states that fail are found,
+    # and only their values are NaN.
+    def calculate(self, requests, database, coefficients = None, deadline = None):
+        limits = self.limits
+        self.check()
+        # Parts of requests waiting for each worker, as (position, order, set, retries): the values of a request are
+        # those of its parts in order, and a part split in half is replaced by two with orders one longer
+        queues = [[] for _ in self.workers]
+        for position, (key, validationSet) in enumerate(requests):
+            if key not in self.assignments:
+                self.assignments[key] = len(self.assignments) % len(self.workers)
+            queues[self.assignments[key]].append((position, (0,), validationSet, limits.retries))
+        # The part each busy worker is running, and when it has to be done by (None for no limit)
+        running = dict([])
+        partValues = [dict([]) for _ in requests]
+        def send(index):
+            if len(queues[index]) == 0:
+                return
+            part = queues[index].pop(0)
+            timeout = limits.runTimeout(len(part[2]) - 1)
+            running[index] = (part, None if timeout is None else time.monotonic() + timeout)
+            limits.counts['runs'] += 1
+            self.workers[index].connection.send(('calculate', database, part[2], coefficients))
+        def fail(index):
+            # Run the part again on a new worker, then its halves, or give up on the states in it
+            (position, order, part, retries), expiry = running.pop(index)
+            self.respawn(index)
+            states = [key for key in part.keys() if key != 'type']
+            if retries > 0:
+                limits.counts['retries'] += 1
+                queues[index].insert(0, (position, order, part, retries - 1))
+            elif limits.isolate and len(states) > 1:
+                first = set(states[:(len(states) + 1) // 2])
+                halves = [dict([(key, part[key]) for key in part.keys() if key == 'type' or key in first]),
+                          dict([(key, part[key]) for key in part.keys() if key == 'type' or key not in first])]
+                queues[index][0:0] = [(position, order + (k,), half, 0) for k, half in enumerate(halves)]
+            else:
+                print(f'Thermochimica worker failed on state{"s" if len(states) > 1 else ""} {", ".join(states)} '
+                      f'of validation set {requests[position][0]}')
+                limits.counts['failed states'] += len(states)
+                partValues[position][order] = [np.nan] * thermoOutput.extractionPlan(part).size
+            send(index)
+        for index in range(len(self.workers)):
+            send(index)
+        while len(running) > 0:
+            connections = dict([(self.workers[index].connection, index) for index in running.keys()])
+            expiries = [expiry for part, expiry in running.values() if expiry is not None]
+            if deadline is not None:
+                expiries.append(deadline)
+            wait = None
+            if len(expiries) > 0:
+                wait = max(min(expiries) - time.monotonic(), 0)
+            ready = multiprocessing.connection.wait(list(connections.keys()), wait)
+            if len(ready) == 0:
+                now = time.monotonic()
+                if deadline is not None and now >= deadline:
+                    # Stop what is still running, so that it doesn't hold up the next evaluation
+                    for index in list(running.keys()):
+                        running.pop(index)
+                        self.respawn(index)
+                    print('Evaluation went over its time limit')
+                    raise optima.OptimaException
+                for index in [index for index, (part, expiry) in running.items() if expiry is not None and now >= expiry]:
+                    print(f'Thermochimica worker {index} timed out, restarting it')
+                    limits.counts['timeouts'] += 1
+                    fail(index)
+                continue
+            for connection in ready:
+                index = connections[connection]
+                try:
+                    message = connection.recv()
+                except (EOFError, OSError):
+                    print(f'Thermochimica worker {index} crashed, restarting it')
+                    fail(index)
+                    continue
+                (position, order, part, retries), expiry = running.pop(index)
+                if message[0] == 'values':
+                    partValues[position][order] = message[1]
+                    self.backend.mergeUpdates((dict([]), message[2]))
+                else:
+                    partValues[position][order] = optima.OptimaException()
+                send(index)
+        results = []
+        for parts in partValues:
+            orders = sorted(parts.keys())
+            if any([isinstance(parts[order], Exception) for order in orders]):
+                results.append(optima.OptimaException())
+            else:
+                results.append([value for order in orders for value in parts[order]])
+        return results
+    def close(self):
+        for worker in self.workers:
+            worker.stop()
+        self.workers = []
@@ -0,0 +1,390 @@
+import ctypes
+import os
+import numpy as np
+import dictTools
+import optima
+
+# In-process Thermochimica backend.
+# Calls Thermochimica's Fortran API through its C bindings (the TCAPI_* symbols) from a shared library,
+# instead of running RunCalculationList on an input file and reading outputs/thermoout.json back.
+# Thermochimica builds static libraries by default; a shared one can be linked from its objects (compiled with -fPIC):
+#   gfortran -shared -o lib/libthermochimica.so obj/*.o -llapack -lblas
+# The library is looked for at OPTIMA_THERMOCHIMICA_LIBRARY if set, otherwise in the lib directory of thermochimica_path.
+# Only the values in valueGetters below can be read this way. Callers fall back to RunCalculationList
+# for validation sets that ask for anything else, or when the library can't be loaded.
+
+libraryNames = ['libthermochimica.so', 'libthermochimica.dylib']
+
+# Symbols needed for every calculation
+requiredSymbols = ['TCAPI_setThermoFilename', 'TCAPI_sSParseCSDataFile', 'TCAPI_setUnitTemperature',
+                   'TCAPI_setUnitPressure', 'TCAPI_setUnitMass', 'TCAPI_setTemperaturePressure',
+                   'TCAPI_setElementMass', 'TCAPI_thermochimica', 'TCAPI_checkInfoThermo',
+                   'TCAPI_resetThermo', 'TCAPI_resetThermoAll']
+
+# Symbols needed to warm start calculations from the converged results of an earlier one (Thermochimica's reinitialization data)
+reinitSymbols = ['TCAPI_saveReinitData', 'TCAPI_getReinitDataSizes', 'TCAPI_getReinitData', 'TCAPI_setReinitData',
+                 'TCAPI_setReinitRequested']
+# Optional symbol giving the number of Gibbs energy minimizer iterations of the last calculation
+iterationSymbol = 'TCAPI_getNumberIterations'
+# Length of the element-used table in the reinitialization data (Thermochimica's periodic table, from 0)
+elementTableSize = 169
+
+# Allocatable arrays of parsed coefficients (as gfortran exports Thermochimica's ModuleParseCS variables) that tags are
+# looked for in by ThermochimicaLibrary.mapCoefficients
+coefficientArrays = ['__moduleparsecs_MOD_dgibbscoeffspeciestemp', '__moduleparsecs_MOD_dmaggibbscoeffspeciestemp',
+                     '__moduleparsecs_MOD_dregularparamcs', '__moduleparsecs_MOD_dmagneticparamcs']
+
+# Returns the loaded library, or None if there is none or it lacks the required symbols
+def loadLibrary(thermochimica_path):
+    candidates = []
+    if os.environ.get('OPTIMA_THERMOCHIMICA_LIBRARY'):
+        candidates.append(os.environ['OPTIMA_THERMOCHIMICA_LIBRARY'])
+    candidates.extend([os.path.join(thermochimica_path, 'lib', name) for name in libraryNames])
+    for candidate in candidates:
+        if not os.path.isfile(candidate):
+            continue
+        try:
+            library = ctypes.CDLL(os.path.abspath(candidate))
+        except OSError as e:
+            print(f'Could not load {candidate}: {e}')
+            continue
+        missing = [symbol for symbol in requiredSymbols if not hasattr(library, symbol)]
+        if len(missing) > 0:
+            print(f'{candidate} is missing {", ".join(missing)}')
+            continue
+        return library
+    return None
+
+# Fortran character arguments are passed as the characters and a length
+def stringArguments(string):
+    encoded = string.encode()
+    return ctypes.c_char_p(encoded), ctypes.byref(ctypes.c_int(len(encoded)))
+
+def elementPotential(library, path):
+    value = ctypes.c_double(0)
+    info = ctypes.c_int(0)
+    library.TCAPI_getOutputChemPot(*stringArguments(path[1]), ctypes.byref(value), ctypes.byref(info))
+    return value.value, info.value
+
+def solutionPhaseMoles(library, path):
+    value = ctypes.c_double(0)
+    info = ctypes.c_int(0)
+    library.TCAPI_getMolesPhase(*stringArguments(path[1]), ctypes.byref(value), ctypes.byref(info))
+    return value.value, info.value
+
+def pureCondensedPhaseMoles(library, path):
+    value = ctypes.c_double(0)
+    info = ctypes.c_int(0)
+    library.TCAPI_getPureConPhaseMol(*stringArguments(path[1]), ctypes.byref(value), ctypes.byref(info))
+    return value.value, info.value
+
+def speciesValue(library, path):
+    moleFraction = ctypes.c_double(0)
+    chemicalPotential = ctypes.c_double(0)
+    info = ctypes.c_int(0)
+    library.TCAPI_getOutputSolnSpecies(*stringArguments(path[1]), *stringArguments(path[3]),
+                                       ctypes.byref(moleFraction), ctypes.byref(chemicalPotential), ctypes.byref(info))
+    if path[4] == 'mole fraction':
+        return moleFraction.value, info.value
+    return chemicalPotential.value, info.value
+
+# Converged assemblage, phase amounts, potentials and mole fractions of a calculation, to start another one from
+class ReinitData:
+    def __init__(self, nElements, nSpecies):
+        self.nElements = nElements
+        self.nSpecies = nSpecies
+        self.assemblage = np.zeros(nElements, dtype = np.int32)
+        self.molesPhase = np.zeros(nElements)
+        self.elementPotential = np.zeros(nElements)
+        self.chemicalPotential = np.zeros(nSpecies)
+        self.molFraction = np.zeros(nSpecies)
+        self.elementsUsed = np.zeros(elementTableSize, dtype = np.int32)
+    def arguments(self):
+        return [self.assemblage.ctypes.data_as(ctypes.POINTER(ctypes.c_int)),
+                self.molesPhase.ctypes.data_as(ctypes.POINTER(ctypes.c_double)),
+                self.elementPotential.ctypes.data_as(ctypes.POINTER(ctypes.c_double)),
+                self.chemicalPotential.ctypes.data_as(ctypes.POINTER(ctypes.c_double)),
+                self.molFraction.ctypes.data_as(ctypes.POINTER(ctypes.c_double)),
+                self.elementsUsed.ctypes.data_as(ctypes.POINTER(ctypes.c_int))]
+    # Data of the last calculation, or None if Thermochimica has none
+    @staticmethod
+    def read(library):
+        library.TCAPI_saveReinitData()
+        nElements = ctypes.c_int(0)
+        nSpecies = ctypes.c_int(0)
+        library.TCAPI_getReinitDataSizes(ctypes.byref(nElements), ctypes.byref(nSpecies))
+        if nElements.value <= 0 or nSpecies.value <= 0:
+            return None
+        data = ReinitData(nElements.value, nSpecies.value)
+        available = ctypes.c_int(0)
+        library.TCAPI_getReinitData(*data.arguments(), ctypes.byref(available))
+        if available.value == 0:
+            return None
+        return data
+    def write(self, library):
+        library.TCAPI_setReinitData(ctypes.byref(ctypes.c_int(self.nElements)), ctypes.byref(ctypes.c_int(self.nSpecies)),
+                                    *self.arguments())
+        library.TCAPI_setReinitRequested(ctypes.byref(ctypes.c_int(1)))
+
+# gfortran array descriptor (GCC 8 and later) of an allocatable array of up to 7 dimensions
+class FortranArray(ctypes.Structure):
+    _fields_ = [('base', ctypes.c_void_p),
+                ('offset', ctypes.c_ssize_t),
+                ('elementLength', ctypes.c_size_t),
+                ('version', ctypes.c_int),
+                ('rank', ctypes.c_byte),
+                ('type', ctypes.c_byte),
+                ('attribute', ctypes.c_short),
+                ('span', ctypes.c_ssize_t),
+                ('dimensions', (ctypes.c_ssize_t * 3) * 7)]
+
+# The allocated memory of a double precision module array as a numpy array that writes through to it,
+# or None if the library doesn't export it or it isn't allocated
+def moduleArray(library, symbol):
+    try:
+        descriptor = FortranArray.in_dll(library, symbol)
+    except ValueError:
+        return None
+    if not descriptor.base or descriptor.elementLength != ctypes.sizeof(ctypes.c_double) or not 0 < descriptor.rank <= 7:
+        return None
+    size = 1
+    for d in range(descriptor.rank):
+        stride, lower, upper = descriptor.dimensions[d]
+        size *= max(upper - lower + 1, 0)
+    if size == 0:
+        return None
+    return np.ctypeslib.as_array((ctypes.c_double * size).from_address(descriptor.base))
+
+# Value paths (as in thermoout.json, with None matching any name) and the getter and symbol for each
+valueGetters = [
+    (['elements', None, 'element potential'], elementPotential, 'TCAPI_getOutputChemPot'),
+    (['solution phases', None, 'moles'], solutionPhaseMoles, 'TCAPI_getMolesPhase'),
+    (['solution phases', None, 'species', None, 'mole fraction'], speciesValue, 'TCAPI_getOutputSolnSpecies'),
+    (['solution phases', None, 'species', None, 'chemical potential'], speciesValue, 'TCAPI_getOutputSolnSpecies'),
+    (['pure condensed phases', None, 'moles'], pureCondensedPhaseMoles, 'TCAPI_getPureConPhaseMol')
+]
+
+# Key paths to the leaves of a nested validation values dict, in the order getParallelDictValues visits them
+def valuePaths(values):
+    paths = []
+    dictTools.getDictKeyPaths(values, [], paths)
+    return paths
+
+class ThermochimicaLibrary:
+    def __init__(self, library, elementNumbers, tunit, punit, munit):
+        self.library = library
+        self.elementNumbers = elementNumbers
+        self.tunit = tunit
+        self.punit = punit
+        self.munit = munit
+        self.getters = [(pattern, getter) for pattern, getter, symbol in valueGetters if hasattr(library, symbol)]
+        self.database = None
+        # Warm starts: the ReinitData of each state (by its state values) from the last time it converged.
+        # Coefficients only change a little between evaluations, so that is a good initial estimate for the next one.
+        self.warmStart = all([hasattr(library, symbol) for symbol in reinitSymbols])
+        self.reinitData = dict([])
+        # Minimizer iterations each state took from a cold start, to estimate what warm starts save
+        self.coldIterations = dict([])
+        # Changes to the above since takeUpdates, and counts since takeStatistics
+        self.updates = dict([])
+        self.statistics = dict([('calculations', 0), ('warm starts', 0), ('iterations', 0), ('saved iterations', 0)])
+        # Where each tag's value lives in the parsed coefficient arrays: tag: [(symbol, index), ...].
+        # Set by mapCoefficients; None while new coefficients have to be parsed from a database file.
+        self.slots = None
+    def getter(self, path):
+        for pattern, getter in self.getters:
+            if len(pattern) == len(path) and all([key is None or key == name for key, name in zip(pattern, path)]):
+                return getter
+        return None
+    # True if every value asked for by a 'point' validation set can be read from the library
+    def supports(self, validationSet):
+        for key in validationSet.keys():
+            if key == 'type':
+                continue
+            for path in valuePaths(validationSet[key]['values']):
+                if self.getter(path) is None:
+                    return False
+        return True
+    # Database files are rewritten between evaluations, so parse every time one is given
+    def parse(self, database):
+        library = self.library
+        library.TCAPI_resetThermoAll()
+        library.TCAPI_setThermoFilename(*stringArguments(database))
+        library.TCAPI_sSParseCSDataFile()
+        info = ctypes.c_int(0)
+        library.TCAPI_checkInfoThermo(ctypes.byref(info))
+        if info.value != 0:
+            print(f'Thermochimica could not parse {database} (info {info.value})')
+            raise optima.OptimaException
+        self.database = database
+    # Finds where the tags of template (an optimaTemplate.DatabaseTemplate) end up in the parsed coefficient arrays,
+    # so that patch can apply new values without writing and parsing a database.
+    # Each tag is given a distinct marker value and the arrays are searched for it, twice with different markers.
+    # The mapping is then checked by running validationSet on a patched database against a freshly parsed one;
+    # if the check fails, patching stays off.
+    # tags holds the tags to be optimized with their two initial values; database files are written in directory.
+    # Returns True if every tag was found and the check passed.
+    def mapCoefficients(self, template, tags, validationSet, directory):
+        self.slots = None
+        if len(tags) == 0 or not any([hasattr(self.library, symbol) for symbol in coefficientArrays]):
+            return False
+        database = os.path.join(directory, f'optima-probe-{os.getpid()}.dat')
+        try:
+            slots = None
+            for probe in range(2):
+                markers = dict([(tag, -987654.25 - 16 * k - 2 * probe) for k, tag in enumerate(tags.keys())])
+                template.write(database, markers)
+                self.parse(database)
+                found = dict([(tag, []) for tag in tags.keys()])
+                for symbol in coefficientArrays:
+                    array = moduleArray(self.library, symbol)
+                    if array is None:
+                        continue
+                    for tag, marker in markers.items():
+                        found[tag].extend([(symbol, int(index)) for index in np.flatnonzero(array == marker)])
+                if any([len(locations) == 0 for locations in found.values()]) or (slots is not None and found != slots):
+                    return False
+                slots = found
+            # Check against a freshly parsed database, patching after a calculation has been run on the parsed one
+            # as evaluations do, in case Thermochimica copies coefficients elsewhere when it first calculates
+            check = dict([(tag, np.mean(values)) for tag, values in tags.items()])
+            template.write(database, check)
+            self.parse(database)
+            reference = self.calculate(validationSet)
+            template.write(database, dict([(tag, values[0]) for tag, values in tags.items()]))
+            self.parse(database)
+            self.calculate(validationSet)
+            self.slots = slots
+            self.patch(check)
+            patched = self.calculate(validationSet)
+            if not np.allclose(patched, reference, rtol = 1e-10, atol = 0):
+                self.slots = None
+                return False
+            return True
+        except optima.OptimaException:
+            self.slots = None
+            return False
+        finally:
+            self.database = None
+            if os.path.exists(database):
+                os.remove(database)
+    # Writes values (tag: value) into the parsed coefficient arrays
+    def patch(self, values):
+        arrays = dict([(symbol, moduleArray(self.library, symbol)) for symbol in coefficientArrays])
+        for tag, value in values.items():
+            for symbol, index in self.slots.get(tag, []):
+                arrays[symbol][index] = value
+    # Runs every calculation in a 'point' validation set, returning the values asked for as an array
+    # (NaN for calculations that failed to converge)
+    def calculate(self, validationSet):
+        library = self.library
+        f = []
+        for key in validationSet.keys():
+            if key == 'type':
+                continue
+            state = validationSet[key]['state']
+            self.setState(state)
+            paths = valuePaths(validationSet[key]['values'])
+            if not self.solve(tuple([float(value) for value in state])):
+                # Left for the optimizer to mask
+                f.extend([np.nan] * len(paths))
+                continue
+            for path in paths:
+                value, info = self.getter(path)(library, path)
+                if info != 0:
+                    library.TCAPI_resetThermo()
+                    print(f'Could not get {": ".join(path)} from Thermochimica (info {info})')
+                    raise optima.OptimaException
+                f.append(value)
+            library.TCAPI_resetThermo()
+        return np.array(f)
+    # Sets up a calculation at state (temperature, pressure and element masses)
+    def setState(self, state):
+        library = self.library
+        library.TCAPI_setUnitTemperature(*stringArguments(self.tunit))
+        library.TCAPI_setUnitPressure(*stringArguments(self.punit))
+        library.TCAPI_setUnitMass(*stringArguments(self.munit))
+        library.TCAPI_setTemperaturePressure(ctypes.byref(ctypes.c_double(float(state[0]))),
+                                             ctypes.byref(ctypes.c_double(float(state[1]))))
+        for element, mass in zip(self.elementNumbers, state[2:]):
+            library.TCAPI_setElementMass(ctypes.byref(ctypes.c_int(element)), ctypes.byref(ctypes.c_double(float(mass))))
+    # Runs the calculation set up for state, warm started if it has converged before, returning whether it converged.
+    # A warm start that fails is retried from a cold start before giving up. Thermochimica skips every step while the
+    # error of the failed run is set, so it is reset and the state set up again first, and the retry doesn't ask for
+    # reinitialization so that it can't start from the same data again.
+    def solve(self, stateKey):
+        library = self.library
+        info = ctypes.c_int(0)
+        warm = self.warmStart and stateKey in self.reinitData
+        retry = False
+        if warm:
+            self.reinitData[stateKey].write(library)
+            library.TCAPI_thermochimica()
+            library.TCAPI_checkInfoThermo(ctypes.byref(info))
+            if info.value != 0:
+                warm = False
+                retry = True
+                del self.reinitData[stateKey]
+                self.updates[stateKey] = None
+                library.TCAPI_resetThermo()
+                library.TCAPI_setReinitRequested(ctypes.byref(ctypes.c_int(0)))
+                self.setState(stateKey)
+        if not warm:
+            if self.warmStart and not retry:
+                # Still ask for reinitialization data to be kept, so that the next evaluation can start from it
+                library.TCAPI_setReinitRequested(ctypes.byref(ctypes.c_int(1)))
+            library.TCAPI_thermochimica()
+            library.TCAPI_checkInfoThermo(ctypes.byref(info))
+        if info.value != 0:
+            library.TCAPI_resetThermo()
+            print('Thermochimica calculation failed to converge')
+            return False
+        iterations = self.iterations()
+        self.statistics['calculations'] += 1
+        if iterations is not None:
+            self.statistics['iterations'] += iterations
+            if warm and stateKey in self.coldIterations:
+                self.statistics['saved iterations'] += self.coldIterations[stateKey] - iterations
+            elif not warm:
+                self.coldIterations[stateKey] = iterations
+        if warm:
+            self.statistics['warm starts'] += 1
+        if self.warmStart:
+            data = ReinitData.read(library)
+            if data is not None:
+                self.reinitData[stateKey] = data
+                self.updates[stateKey] = (data, self.coldIterations.get(stateKey))
+        return True
+    # Minimizer iterations of the last calculation, or None if the library doesn't report them
+    def iterations(self):
+        if not hasattr(self.library, iterationSymbol):
+            return None
+        iterations = ctypes.c_int(0)
+        getattr(self.library, iterationSymbol)(ctypes.byref(iterations))
+        return iterations.value
+    # Warm start data and counts gathered since the last call, to pass back from a worker process with mergeUpdates
+    def takeUpdates(self):
+        updates = (self.updates, self.statistics)
+        self.updates = dict([])
+        self.statistics = dict([(key, 0) for key in self.statistics.keys()])
+        return updates
+    def mergeUpdates(self, updates):
+        reinitUpdates, statistics = updates
+        for stateKey, update in reinitUpdates.items():
+            if update is None:
+                self.reinitData.pop(stateKey, None)
+                continue
+            data, coldIterations = update
+            self.reinitData[stateKey] = data
+            if coldIterations is not None:
+                self.coldIterations[stateKey] = coldIterations
+        for key, value in statistics.items():
+            self.statistics[key] += value
+    # Counts since the last call, as a line for the console
+    def takeStatistics(self):
+        statistics = self.statistics
+        self.statistics = dict([(key, 0) for key in statistics.keys()])
+        report = f'{statistics["warm starts"]} of {statistics["calculations"]} Thermochimica calculations warm started'
+        if hasattr(self.library, iterationSymbol):
+            report += f', {statistics["iterations"]} minimizer iterations ({statistics["saved iterations"]} saved)'
+        return report